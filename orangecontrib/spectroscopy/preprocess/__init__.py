@@ -1,11 +1,11 @@
+import warnings
 from typing import Union, Sequence
 
 import bottleneck
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
-from scipy.interpolate import interp1d
 from scipy.ndimage import gaussian_filter1d
-from scipy.spatial import ConvexHull, QhullError
 from scipy.signal import savgol_filter
 from sklearn.preprocessing import normalize as sknormalize
 
@@ -26,6 +26,7 @@ from orangecontrib.spectroscopy.preprocess.transform import (
     Transmittance,
     CommonDomainRef,
 )
+from orangecontrib.spectroscopy.preprocess.parallel import transform_rows
 from orangecontrib.spectroscopy.preprocess.utils import (
     SelectColumn,
     CommonDomain,
@@ -36,13 +37,17 @@ from orangecontrib.spectroscopy.preprocess.utils import (
     interp1d_with_unknowns_numpy,
     interp1d_with_unknowns_scipy,
     interp1d_wo_unknowns_scipy,
+    interp1d_wo_unknowns_operator,
     edge_baseline,
     MissingReferenceException,
     WrongReferenceException,
     replace_infs,
     transform_to_sorted_features,
+    compute_dtype,
     PreprocessException,
     linear_baseline,
+    is_dask_array,
+    transform_dask_rows,
 )
 
 
@@ -76,6 +81,9 @@ class MNFDenoisingFeature(SelectColumn):
 
 
 class _MNFCommon(CommonDomainOrderUnknowns):
+    # noise is estimated from differences between consecutive rows
+    rows_independent = False
+
     def __init__(self, domain, components):
         super().__init__(domain)
         self.domain = domain
@@ -227,19 +235,21 @@ class Cut(Preprocess):
     def __call__(self, data):
         x = getx(data)
         if not self.inverse:
-            okattrs = [
-                at
-                for at, v in zip(data.domain.attributes, x, strict=True)
-                if (self.lowlim is None or self.lowlim <= v)
-                and (self.highlim is None or v <= self.highlim)
-            ]
+            keep = np.ones(len(x), dtype=bool)
+            if self.lowlim is not None:
+                keep &= self.lowlim <= x
+            if self.highlim is not None:
+                keep &= x <= self.highlim
         else:
-            okattrs = [
-                at
-                for at, v in zip(data.domain.attributes, x, strict=True)
-                if (self.lowlim is not None and v <= self.lowlim)
-                or (self.highlim is not None and self.highlim <= v)
-            ]
+            keep = np.zeros(len(x), dtype=bool)
+            if self.lowlim is not None:
+                keep |= x <= self.lowlim
+            if self.highlim is not None:
+                keep |= self.highlim <= x
+        attributes = data.domain.attributes
+        # attributes keep their order, so a range cut from a sorted axis
+        # selects contiguous columns, which Orange takes as a view of X
+        okattrs = [attributes[i] for i in np.flatnonzero(keep)]
         domain = Orange.data.Domain(
             okattrs, data.domain.class_vars, metas=data.domain.metas
         )
@@ -304,41 +314,105 @@ class RubberbandBaselineFeature(SelectColumn):
     InheritEq = True
 
 
+def lower_hull_vertices(x, Y):
+    """
+    Return a mask of the lower convex hull vertices of every row of Y
+    (with shared and sorted x). NaNs are ignored.
+
+    All rows are processed at once. Points that lie on or above a chord
+    between two other remaining points can not be hull vertices, so they are
+    removed until every remaining point is below the chord of its neighbours,
+    which means that the remaining points form the lower hull. Chords to
+    increasingly distant neighbours are also tested to speed up removal.
+    """
+    valid = ~np.isnan(Y)
+    # remaining points of each row are kept compacted to the left
+    P = np.argsort(~valid, axis=1, kind="stable")
+    count = valid.sum(axis=1)
+    Yp = np.take_along_axis(Y, P, 1)
+    Xp = x[P]
+    iteration = 0
+    while P.shape[1] > 2:
+        iteration += 1
+        positions = np.arange(P.shape[1])
+        remove = np.zeros(P.shape, dtype=bool)
+        s = 1
+        while 2 * s < P.shape[1] and s <= 2**iteration:
+            inner = positions[s:-s] < (count[:, None] - s)
+            xa, xm, xb = Xp[:, : -2 * s], Xp[:, s:-s], Xp[:, 2 * s :]
+            ya, ym, yb = Yp[:, : -2 * s], Yp[:, s:-s], Yp[:, 2 * s :]
+            above = (xb - xa) * (ym - ya) - (yb - ya) * (xm - xa) >= 0
+            remove[:, s:-s] |= inner & above
+            s *= 2
+        if not remove.any():
+            break
+        keep = (positions < count[:, None]) & ~remove
+        count = keep.sum(axis=1)
+        order = np.argsort(~keep, axis=1, kind="stable")[:, : count.max()]
+        P = np.take_along_axis(P, order, 1)
+        Yp = np.take_along_axis(Yp, order, 1)
+        Xp = np.take_along_axis(Xp, order, 1)
+    vertices = np.zeros(Y.shape, dtype=bool)
+    selected = np.arange(P.shape[1]) < count[:, None]
+    vertices[np.repeat(np.arange(len(Y)), count), P[selected]] = True
+    return vertices
+
+
+def interpolate_between_vertices(x, Y, vertices):
+    """Linearly interpolate rows of Y between their vertices (a mask).
+    Values outside the outermost vertices are NaN."""
+    n = Y.shape[1]
+    indices = np.arange(n)
+    left = np.maximum.accumulate(np.where(vertices, indices, -1), axis=1)
+    right = np.minimum.accumulate(np.where(vertices, indices, n)[:, ::-1], axis=1)
+    right = right[:, ::-1]
+    outside = (left < 0) | (right >= n)
+    left = np.clip(left, 0, n - 1)
+    right = np.clip(right, 0, n - 1)
+    yl = np.take_along_axis(Y, left, 1)
+    yr = np.take_along_axis(Y, right, 1)
+    xl, xr = x[left], x[right]
+    dx = xr - xl
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = yl + (yr - yl) * np.where(dx != 0, (x - xl) / dx, 0)
+    out[outside] = np.nan
+    return out
+
+
 class _RubberbandBaselineCommon(CommonDomainOrder):
+    parallel_rows = True
+
     def __init__(self, peak_dir, sub, domain):
         super().__init__(domain)
         self.peak_dir = peak_dir
         self.sub = sub
 
     def transformed(self, X, x):
-        newd = np.zeros_like(X)
-        for rowi, row in enumerate(X):
-            # remove NaNs which ConvexHull can not handle
-            source = np.column_stack((x, row))
-            source = source[~bottleneck.anynan(source, axis=1)]
-            try:
-                v = ConvexHull(source).vertices
-            except (QhullError, ValueError):
-                # FIXME notify user
-                baseline = np.zeros_like(row)
-            else:
-                if self.peak_dir == RubberbandBaseline.PeakPositive:
-                    v = np.roll(v, -v.argmin())
-                    v = v[: v.argmax() + 1]
-                elif self.peak_dir == RubberbandBaseline.PeakNegative:
-                    v = np.roll(v, -v.argmax())
-                    v = v[: v.argmin() + 1]
-                # If there are NaN values at the edges of data then convex hull
-                # does not include the endpoints. Because the same values are also
-                # NaN in the current row, we can fill them with NaN (bounds_error
-                # achieves this).
-                baseline = interp1d(source[v, 0], source[v, 1], bounds_error=False)(x)
-            finally:
-                if self.sub == 0:
-                    newd[rowi] = row - baseline
-                else:
-                    newd[rowi] = baseline
-        return newd
+        Y = X if self.peak_dir == RubberbandBaseline.PeakPositive else -X
+        baseline = interpolate_between_vertices(x, Y, lower_hull_vertices(x, Y))
+        # Without a hull (less than three points or all points on a line)
+        # the baseline is zero. FIXME notify user
+        valid = ~np.isnan(Y)
+        ends = np.zeros(Y.shape, dtype=bool)
+        rows = np.flatnonzero(valid.any(axis=1))
+        ends[rows, np.argmax(valid[rows], axis=1)] = True
+        ends[rows, Y.shape[1] - 1 - np.argmax(valid[rows, ::-1], axis=1)] = True
+        line = interpolate_between_vertices(x, Y, ends)
+        with np.errstate(invalid="ignore"):
+            flat = bottleneck.nanmax(np.abs(Y - line), axis=1) <= (
+                1e-12 * bottleneck.nanmax(np.abs(Y), axis=1)
+            )
+        no_hull = (valid.sum(axis=1) < 3) | flat
+        baseline[no_hull] = 0
+        # If there are NaN values at the edges of data then convex hull
+        # does not include the endpoints. Because the same values are also
+        # NaN in the current row, they are NaN in the baseline.
+        if self.peak_dir != RubberbandBaseline.PeakPositive:
+            baseline = -baseline
+        if self.sub == 0:
+            return X - baseline
+        else:
+            return baseline
 
 
 class RubberbandBaseline(Preprocess):
@@ -423,49 +497,59 @@ class _NormalizeCommon(CommonDomain):
     def transformed(self, data):
         if data.X.shape[0] == 0:
             return data.X
-        data = data.copy()
-
-        with data.unlocked():
-            if self.method == Normalize.Vector:
-                nans = np.isnan(data.X)
-                nan_num = nans.sum(axis=1, keepdims=True)
-                ys = data.X
-                if np.any(nan_num > 0):
-                    # interpolate nan elements for normalization
-                    x = getx(data)
-                    ys = interp1d_with_unknowns_numpy(x, ys, x)
-                    ys = np.nan_to_num(ys)  # edge elements can still be zero
-                data.X = sknormalize(ys, norm='l2', axis=1, copy=False)
-                if np.any(nan_num > 0):
-                    # keep nans where they were
-                    data.X[nans] = float("nan")
-            elif self.method == Normalize.Area:
-                norm_data = Integrate(
-                    methods=self.int_method, limits=[[self.lower, self.upper]]
-                )(data)
-                data.X /= norm_data.X
-                replace_infs(data.X)
-            elif self.method == Normalize.SNV:
-                data.X = (
-                    data.X - bottleneck.nanmean(data.X, axis=1).reshape(-1, 1)
-                ) / bottleneck.nanstd(data.X, axis=1).reshape(-1, 1)
-                replace_infs(data.X)
-            elif self.method == Normalize.Attribute:
-                if self.attr in data.domain and isinstance(
-                    data.domain[self.attr], Orange.data.ContinuousVariable
-                ):
-                    ndom = Orange.data.Domain([data.domain[self.attr]])
-                    factors = data.transform(ndom)
-                    data.X /= factors.X
-                    replace_infs(data.X)
-                else:  # invalid attribute for normalization
-                    data.X *= float("nan")
-            elif self.method == Normalize.MinMax:
-                min = bottleneck.nanmin(data.X, axis=1).reshape(-1, 1)
-                max = bottleneck.nanmax(data.X, axis=1).reshape(-1, 1)
-                data.X = data.X / (max - min)
-                replace_infs(data.X)
-        return data.X
+        # a copy that is modified
+        X = np.array(data.X, dtype=compute_dtype())
+
+        if self.method == Normalize.Vector:
+            nans = np.isnan(X)
+            nan_num = nans.sum(axis=1, keepdims=True)
+            ys = X
+            if np.any(nan_num > 0):
+                # interpolate nan elements for normalization
+                x = getx(data)
+                ys = interp1d_with_unknowns_numpy(x, ys, x)
+                ys = np.nan_to_num(ys)  # edge elements can still be zero
+            X = sknormalize(ys, norm='l2', axis=1, copy=False).astype(
+                X.dtype, copy=False
+            )
+            if np.any(nan_num > 0):
+                # keep nans where they were
+                X[nans] = float("nan")
+        elif self.method == Normalize.Area:
+            norm_data = Integrate(
+                methods=self.int_method, limits=[[self.lower, self.upper]]
+            )(data)
+            X /= norm_data.X
+            replace_infs(X)
+        elif self.method == Normalize.SNV:
+            if X.dtype == np.float64:
+                mean = bottleneck.nanmean(X, axis=1)
+                std = bottleneck.nanstd(X, axis=1)
+            else:
+                # accumulate in float64
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning)  # empty rows
+                    mean = np.nanmean(X, axis=1, dtype=np.float64)
+                    std = np.nanstd(X, axis=1, dtype=np.float64)
+            X -= mean.reshape(-1, 1)
+            X /= std.reshape(-1, 1)
+            replace_infs(X)
+        elif self.method == Normalize.Attribute:
+            if self.attr in data.domain and isinstance(
+                data.domain[self.attr], Orange.data.ContinuousVariable
+            ):
+                ndom = Orange.data.Domain([data.domain[self.attr]])
+                factors = data.transform(ndom)
+                X /= factors.X
+                replace_infs(X)
+            else:  # invalid attribute for normalization
+                X *= float("nan")
+        elif self.method == Normalize.MinMax:
+            min = bottleneck.nanmin(X, axis=1).reshape(-1, 1)
+            max = bottleneck.nanmax(X, axis=1).reshape(-1, 1)
+            X /= max - min
+            replace_infs(X)
+        return X
 
     def __eq__(self, other):
         return (
@@ -577,6 +661,9 @@ class InterpolatedFeature(SelectColumn):
 
 
 class _InterpolateCommon:
+    # every row is interpolated separately
+    rows_independent = True
+
     def __init__(self, points, kind, domain, handle_nans=True, interpfn=None):
         self.points = points
         self.kind = kind
@@ -593,6 +680,11 @@ class _InterpolateCommon:
             and any(at.compute_value for at in self.domain.attributes)
         ):
             data = data.from_table(self.domain, data)
+        if is_dask_array(data.X):
+            return transform_dask_rows(self._interpolate, data)
+        return self._interpolate(data)
+
+    def _interpolate(self, data):
         x = getx(data)
         # removing whole NaN columns from the data will effectively replace
         # NaNs that are not on the edges with interpolated values
@@ -609,7 +701,7 @@ class _InterpolateCommon:
                 else:
                     interpfn = interp1d_with_unknowns_scipy
             else:
-                interpfn = interp1d_wo_unknowns_scipy
+                interpfn = interp1d_wo_unknowns_operator
         return interpfn(x, ys, self.points, kind=self.kind)
 
     def __eq__(self, other):
@@ -790,6 +882,8 @@ class _ExtractEXAFSCommon(CommonDomain):
     # not CommonDomainOrderUnknowns because E -> K
     # and because transformed needs Edge jumps
 
+    parallel_rows = True
+
     def __init__(
         self, edge, extra_from, extra_to, poly_deg, kweight, m, k_interp, domain
     ):
@@ -804,7 +898,11 @@ class _ExtractEXAFSCommon(CommonDomain):
 
     def __call__(self, data):
         data = self.transform_domain(data)
+        if is_dask_array(data.X):
+            return transform_dask_rows(self._extract, data)
+        return self._extract(data)
 
+    def _extract(self, data):
         if "edge_jump" in data.domain:
             edges = data.transform(Orange.data.Domain([data.domain["edge_jump"]]))
             I_jumps = edges.X[:, 0]
@@ -832,7 +930,10 @@ class _ExtractEXAFSCommon(CommonDomain):
             X[nan_rows] = 1.0
 
         # do the transformation
-        X = self.transformed(X, xs[xsind], I_jumps)
+        if self.parallel_rows:
+            X = transform_rows(self.transformed, X, (xs[xsind],), (I_jumps,))
+        else:
+            X = self.transformed(X, xs[xsind], I_jumps)
 
         # discard nan rows
         X[nan_rows] = np.nan
@@ -974,6 +1075,8 @@ class DespikeFeature(SelectColumn):
 
 
 class _DespikeCommon(CommonDomainOrderUnknowns):
+    parallel_rows = True
+
     def __init__(self, threshold, cutoff, dis, domain):
         super().__init__(domain)
         self.threshold = threshold
@@ -985,52 +1088,54 @@ class _DespikeCommon(CommonDomainOrderUnknowns):
         # dis sets the distance over which to interpolate spiked areas
 
     def transformed(self, data, X):
-        def interpolatespikes(spikes, row_in):
-            row_out = row_in.copy()
-            non_nan_nor_spike = None
-            for i in np.nonzero(spikes)[0]:
-                w = np.arange(max(i - self.dis, 0), min(i + self.dis + 1, len(spikes)))
-                w2 = w[spikes[w] == 0]
-                row_out[i] = np.nanmean(row_in[w2])
-                if np.isnan(
-                    row_out[i]
-                ):  # no valid points within distance, find closest value
-                    if non_nan_nor_spike is None:  # compute it only once
-                        non_nan_nor_spike = np.nonzero(
-                            ~(np.isnan(row_in) | (spikes > 0))
-                        )[0]
-                    # find nearest non-nan indices
-                    valid_ind = []
-                    insertp = np.searchsorted(non_nan_nor_spike, i, side="left")
-                    if insertp > 0:
-                        valid_ind.append(non_nan_nor_spike[insertp - 1])  # left non-nan
-                    if insertp < len(non_nan_nor_spike):
-                        valid_ind.append(non_nan_nor_spike[insertp])  # right non-nan
-                    valid_ind = np.array(valid_ind)
-                    diff_i = np.abs(valid_ind - i)
-                    # closest non-nan indices (or pair of indices)
-                    closest_ind = valid_ind[np.nonzero(diff_i == np.min(diff_i))[0]]
-                    row_out[i] = np.nanmean(row_in[closest_ind])
-            return row_out
-
-        out = []
-        Series = data
-        if Series.size > 0:
-            for row in Series:
-                Distance = np.abs(np.diff(row, n=1))
-                # Spiked spectra are processed and non spiked are passed through
-                if np.any(Distance > self.cutoff):
-                    median1 = np.median(row)
-                    mad_int = np.median(np.abs(row - median1))
-                    modified_z_scores = 0.6745 * (row - median1) / mad_int
-                    spikes = abs(modified_z_scores) > self.threshold
-                    despiked = interpolatespikes(spikes, row)
-                    out.append(despiked)
-                else:
-                    out.append(row)
-            return np.array(out)
-        else:
-            return data
+        out = np.array(data, copy=True)
+        if data.size == 0:
+            return out
+        # Spiked spectra are processed and non spiked are passed through
+        with np.errstate(invalid="ignore"):
+            spiked = np.any(np.abs(np.diff(data, n=1, axis=1)) > self.cutoff, axis=1)
+        if not np.any(spiked):
+            return out
+        rows = data[spiked]
+        median1 = bottleneck.median(rows, axis=1)[:, None]
+        mad_int = bottleneck.median(np.abs(rows - median1), axis=1)[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            modified_z_scores = 0.6745 * (rows - median1) / mad_int
+            spikes = np.abs(modified_z_scores) > self.threshold
+        out[spiked] = interpolate_spikes(rows, spikes, self.dis)
+        return out
+
+
+def interpolate_spikes(X, spikes, dis):
+    """
+    Replace spikes (a mask) in rows of X with the mean of non-spike values
+    within distance dis. Where there are none, use the nearest non-spike
+    value (or the mean of the two nearest ones at the same distance).
+    """
+    n = X.shape[1]
+    valid = ~(np.isnan(X) | spikes)
+    width = 2 * dis + 1
+    values = np.pad(np.where(valid, X, 0), ((0, 0), (dis, dis)))
+    counts = np.pad(valid, ((0, 0), (dis, dis)))
+    sums = sliding_window_view(values, width, axis=1).sum(axis=2)
+    counts = sliding_window_view(counts, width, axis=1).sum(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+    # no valid points within distance, find closest values
+    indices = np.arange(n)
+    left = np.maximum.accumulate(np.where(valid, indices, -1), axis=1)
+    right = np.minimum.accumulate(np.where(valid, indices, n)[:, ::-1], axis=1)
+    right = right[:, ::-1]
+    dist_left = np.where(left >= 0, indices - left, n)
+    dist_right = np.where(right < n, right - indices, n)
+    left_value = np.take_along_axis(X, np.clip(left, 0, n - 1), 1)
+    right_value = np.take_along_axis(X, np.clip(right, 0, n - 1), 1)
+    closest = np.where(dist_left < dist_right, left_value, right_value)
+    both = (dist_left == dist_right) & (dist_left < n)
+    closest[both] = (left_value[both] + right_value[both]) / 2
+    closest[(dist_left == n) & (dist_right == n)] = np.nan
+    means = np.where(counts > 0, means, closest)
+    return np.where(spikes, means, X)
 
 
 class Despike(Preprocess):
@@ -8,7 +8,11 @@ from orangecontrib.spectroscopy.preprocess.utils import (
     SelectColumn,
     CommonDomainOrderUnknowns,
 )
-from orangecontrib.spectroscopy.preprocess.als.baseline import als, arpls, airpls
+from orangecontrib.spectroscopy.preprocess.als.banded import (
+    als_block,
+    arpls_block,
+    airpls_block,
+)
 
 
 class ALSFeature(SelectColumn):
@@ -16,6 +20,8 @@ class ALSFeature(SelectColumn):
 
 
 class ALSCommon(CommonDomainOrderUnknowns):
+    parallel_rows = True
+
     def __init__(self, lam, itermax, p, domain):
         super().__init__(domain)
         self.lam = lam
@@ -23,16 +29,9 @@ class ALSCommon(CommonDomainOrderUnknowns):
         self.p = p
 
     def transformed(self, data, X):
-        final = []
         data = np.array(data)
         if data.size > 0:
-            for row in data:
-                input_array = row
-                final.append(
-                    input_array
-                    - als(input_array, lam=self.lam, p=self.p, itermax=self.itermax)
-                )
-            return np.array(final)
+            return data - als_block(data, lam=self.lam, p=self.p, itermax=self.itermax)
         else:
             return data
 
@@ -62,6 +61,8 @@ class ARPLSFeature(SelectColumn):
 
 
 class ARPLSCommon(CommonDomainOrderUnknowns):
+    parallel_rows = True
+
     def __init__(self, lam, itermax, ratio, domain):
         super().__init__(domain)
         self.lam = lam
@@ -70,14 +71,10 @@ class ARPLSCommon(CommonDomainOrderUnknowns):
 
     def transformed(self, data, X):
         data = np.array(data)
-        final = []
         if data.size > 0:
-            for row in data:
-                final.append(
-                    row
-                    - arpls(row, lam=self.lam, itermax=self.itermax, ratio=self.ratio)
-                )
-            return np.array(final)
+            return data - arpls_block(
+                data, lam=self.lam, itermax=self.itermax, ratio=self.ratio
+            )
         else:
             return data
 
@@ -107,6 +104,8 @@ class AIRPLSFeature(SelectColumn):
 
 
 class AIRPLSCommon(CommonDomainOrderUnknowns):
+    parallel_rows = True
+
     def __init__(self, lam, itermax, porder, domain):
         super().__init__(domain)
         self.lam = lam
@@ -115,17 +114,10 @@ class AIRPLSCommon(CommonDomainOrderUnknowns):
 
     def transformed(self, data, X):
         data = np.array(data)
-        final = []
         if data.size > 0:
-            for row in data:
-                final.append(
-                    row
-                    - airpls(
-                        row, lam=self.lam, porder=self.porder, itermax=self.itermax
-                    )
-                )
-            return np.array(final)
-
+            return data - airpls_block(
+                data, lam=self.lam, porder=self.porder, itermax=self.itermax
+            )
         else:
             return data
 
@@ -0,0 +1,168 @@
+"""
+Penalized least squares baselines (ALS, arPLS and airPLS) for blocks of spectra.
+
+These compute the same baselines as the functions in baseline.py. The
+difference penalty D'D depends only on the number of points, so it is built
+once and shared by all spectra. The weighted systems (W + lam * D'D) z = W y
+are symmetric and banded, and are solved with banded Cholesky decompositions.
+"""
+
+from functools import lru_cache
+
+import bottleneck
+import numpy as np
+from scipy import sparse
+from scipy.linalg import solveh_banded, LinAlgError
+
+
+# blocks with at least this many spectra are solved with a Cholesky
+# decomposition vectorized over spectra; smaller blocks spectrum by spectrum
+VECTORIZED_SOLVE_MIN_ROWS = 200
+
+
+@lru_cache(maxsize=16)
+def difference_penalty(n, differences=2):
+    """
+    Return D'D, where D is the difference matrix of the given order for
+    n points, in the upper banded form of scipy.linalg.solveh_banded:
+    the last row is the diagonal.
+    """
+    D = sparse.eye(n, format='csc')
+    for _ in range(differences):
+        D = D[1:] - D[:-1]
+    P = (D.T @ D).tocsr()
+    ab = np.zeros((differences + 1, n))
+    for k in range(min(differences + 1, n)):
+        ab[differences - k, k:] = P.diagonal(k)
+    ab.flags.writeable = False
+    return ab
+
+
+def _solve_rowwise(penalty, w, B):
+    ab = penalty.copy()
+    out = np.empty_like(B)
+    for i, (wr, b) in enumerate(zip(w, B, strict=True)):
+        ab[-1] = penalty[-1] + wr
+        try:
+            out[i] = solveh_banded(ab, b, check_finite=False)
+        except (LinAlgError, ValueError):
+            out[i] = np.nan
+    return out
+
+
+def _solve_vectorized(penalty, w, B):
+    # work with (points, spectra) arrays so that columns are contiguous
+    u = penalty.shape[0] - 1
+    n = penalty.shape[1]
+    diag = (penalty[-1][:, None] + w.T).copy()
+    B = B.T
+    # L[j, j] and L[j + k, j] of the lower Cholesky factor
+    Ld = np.empty_like(diag)
+    Lo = [None] + [np.zeros((n - k, diag.shape[1])) for k in range(1, u + 1)]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for j in range(n):
+            d = diag[j]
+            for k in range(1, min(u, j) + 1):
+                d -= Lo[k][j - k] ** 2
+            Ld[j] = np.sqrt(d)
+            for k in range(1, min(u, n - 1 - j) + 1):
+                s = np.full(diag.shape[1], penalty[u - k, j + k])
+                for m in range(1, min(u - k, j) + 1):
+                    s -= Lo[k + m][j - m] * Lo[m][j - m]
+                Lo[k][j] = s / Ld[j]
+        y = np.empty_like(B)
+        for j in range(n):
+            s = B[j].copy()
+            for k in range(1, min(u, j) + 1):
+                s -= Lo[k][j - k] * y[j - k]
+            y[j] = s / Ld[j]
+        z = np.empty_like(B)
+        for j in range(n - 1, -1, -1):
+            s = y[j].copy()
+            for k in range(1, min(u, n - 1 - j) + 1):
+                s -= Lo[k][j] * z[j + k]
+            z[j] = s / Ld[j]
+    return z.T
+
+
+def solve_weighted(penalty, w, B):
+    """
+    Solve (diag(w[i]) + P) z[i] = B[i] for every row i, where the banded
+    penalty P is given as from difference_penalty. Rows that can not be
+    solved are NaN.
+    """
+    if len(B) >= VECTORIZED_SOLVE_MIN_ROWS:
+        return _solve_vectorized(penalty, w, B)
+    return _solve_rowwise(penalty, w, B)
+
+
+def als_block(Y, lam=1e6, p=0.1, itermax=10):
+    """ALS baselines (as baseline.als) of all rows of Y."""
+    penalty = lam * difference_penalty(Y.shape[1], 2)
+    w = np.ones(Y.shape)
+    for _ in range(itermax):
+        Z = solve_weighted(penalty, w, w * Y)
+        w = p * (Y > Z) + (1 - p) * (Y < Z)
+    return Z
+
+
+def arpls_block(Y, lam=1e4, ratio=0.05, itermax=100):
+    """arPLS baselines (as baseline.arpls) of all rows of Y."""
+    penalty = lam * difference_penalty(Y.shape[1], 2)
+    W = np.ones(Y.shape)
+    Z = np.zeros(Y.shape)
+    # spectra are removed from the active set when they converge
+    active = np.arange(len(Y))
+    for _ in range(itermax):
+        w = W[active]
+        nan_weights = np.isnan(w).any(axis=1)
+        Z[active[nan_weights]] = 0
+        active, w = active[~nan_weights], w[~nan_weights]
+        if not len(active):
+            break
+        y = Y[active]
+        z = solve_weighted(penalty, w, w * y)
+        Z[active] = z
+        d = y - z
+        dn = np.where(d < 0, d, np.nan)
+        m = bottleneck.nanmean(dn, axis=1)[:, None]
+        s = bottleneck.nanstd(dn, axis=1)[:, None]
+        wt = 1.0 / (1 + np.exp(2 * (d - (2 * s - m)) / s))
+        converged = np.linalg.norm(w - wt, axis=1) / np.linalg.norm(w, axis=1) < ratio
+        W[active] = wt
+        active = active[~converged]
+    return Z
+
+
+def airpls_block(X, lam=100, porder=1, itermax=100):
+    """airPLS baselines (as baseline.airpls) of all rows of X."""
+    penalty = lam * difference_penalty(X.shape[1], porder)
+    abs_sum = np.abs(X).sum(axis=1)
+    W = np.ones(X.shape)
+    Z = np.zeros(X.shape)
+    # spectra are removed from the active set when they converge
+    active = np.arange(len(X))
+    for i in range(1, itermax + 1):
+        if not len(active):
+            break
+        x = X[active]
+        w = W[active]
+        z = solve_weighted(penalty, w, w * x)
+        Z[active] = z
+        d = x - z
+        neg = d < 0
+        dssn = np.abs(np.where(neg, d, 0).sum(axis=1))
+        stop = (dssn < 0.001 * abs_sum[active]) | (i == itermax)
+        # all points belong to peaks or none does
+        stop |= ~neg.any(axis=1) | neg.all(axis=1)
+        cont = ~stop
+        d, neg, dssn = d[cont], neg[cont], dssn[cont][:, None]
+        # d >= 0 means that a point is a part of a peak, so its weight is
+        # set to 0 in order to ignore it
+        w = np.zeros(d.shape)
+        w[neg] = np.exp(i * np.abs(d[neg]) / np.broadcast_to(dssn, d.shape)[neg])
+        w[:, 0] = np.exp(i * np.max(np.where(neg, d, -np.inf), axis=1) / dssn[:, 0])
+        w[:, -1] = w[:, 0]
+        active = active[cont]
+        W[active] = w
+    return Z
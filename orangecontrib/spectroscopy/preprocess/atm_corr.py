@@ -10,13 +10,36 @@ from orangecontrib.spectroscopy.data import getx, spectra_mean
 from orangecontrib.spectroscopy.preprocess.utils import (
     SelectColumn,
     CommonDomainOrderUnknowns,
+    CommonDomainRef,
     interp1d_with_unknowns_numpy,
     nan_extend_edges_and_interpolate,
     MissingReferenceException,
 )
 
 
-class _AtmCorr(CommonDomainOrderUnknowns):
+def reference_without_baselines(reference, wavenumbers, ranges, mean_reference):
+    """
+    Return reference spectra (or their mean) interpolated to wavenumbers
+    with linear baselines removed in index ranges.
+    """
+    if mean_reference:
+        atms = np.atleast_2d(spectra_mean(reference.X))
+    else:
+        atms = np.atleast_2d(reference.X)
+    # all input data needs to be interpolated (and NaNs removed)
+    atms = interp1d_with_unknowns_numpy(getx(reference), atms, wavenumbers)
+    # we know that X is not NaN. same handling of reference as of X
+    atms, _ = nan_extend_edges_and_interpolate(wavenumbers, atms)
+
+    # remove baseline in reference (skip this?)
+    for p, q in ranges:
+        atms[:, p:q] -= interp1d(wavenumbers[[p, q - 1]], atms[:, [p, q - 1]])(
+            wavenumbers[p:q]
+        )
+    return atms
+
+
+class _AtmCorr(CommonDomainOrderUnknowns, CommonDomainRef):
     """
     Atmospheric gas correction. Removes reference spectrum (or spectra) from
     the input spectra.
@@ -48,8 +71,8 @@ class _AtmCorr(CommonDomainOrderUnknowns):
         mean_reference,
         domain,
     ):
-        super().__init__(domain)
-        self.reference = reference
+        CommonDomainOrderUnknowns.__init__(self, domain)
+        CommonDomainRef.__init__(self, reference, domain)
         if correct_ranges is not None:
             self.correct_ranges = [[min(r), max(r)] for r in correct_ranges]
         else:
@@ -63,18 +86,29 @@ class _AtmCorr(CommonDomainOrderUnknowns):
         self.spline_tukey_param = 0.2
         self.mean_reference = mean_reference
 
-    def transformed(self, X, wavenumbers):
-        def interpolate_to_data(other_xs, other_data):
-            # all input data needs to be interpolated (and NaNs removed)
-            interpolated = interp1d_with_unknowns_numpy(
-                other_xs, other_data, wavenumbers
-            )
-            # we know that X is not NaN. same handling of reference as of X
-            interpolated, _ = nan_extend_edges_and_interpolate(
-                wavenumbers, interpolated
+    def __eq__(self, other):
+        return (
+            CommonDomainRef.__eq__(self, other)
+            and self.correct_ranges == other.correct_ranges
+            and self.spline_ranges == other.spline_ranges
+            and self.smooth_win == other.smooth_win
+            and self.spline_base_win == other.spline_base_win
+            and self.mean_reference == other.mean_reference
+        )
+
+    def __hash__(self):
+        return hash(
+            (
+                CommonDomainRef.__hash__(self),
+                tuple(map(tuple, self.correct_ranges)),
+                tuple(map(tuple, self.spline_ranges)),
+                self.smooth_win,
+                self.spline_base_win,
+                self.mean_reference,
             )
-            return interpolated
+        )
 
+    def transformed(self, X, wavenumbers):
         def find_wn_ranges(wn, ranges):
             # Find indexes of a list of ranges of wavenumbers.
             if not len(ranges):
@@ -98,17 +132,13 @@ class _AtmCorr(CommonDomainOrderUnknowns):
         ranges = find_wn_ranges(wavenumbers, self.correct_ranges)
         ranges = [[p, q] for p, q in ranges if q - p > 1]
         if ranges:
-            if self.mean_reference:
-                atms = np.atleast_2d(spectra_mean(self.reference.X))
-            else:
-                atms = np.atleast_2d(self.reference.X)
-            atms = interpolate_to_data(getx(self.reference), atms)
-
-            # remove baseline in reference (skip this?)
-            for p, q in ranges:
-                atms[:, p:q] -= interp1d(wavenumbers[[p, q - 1]], atms[:, [p, q - 1]])(
-                    wavenumbers[p:q]
-                )
+            atms = self.interpolated(
+                self.reference,
+                wavenumbers,
+                reference_without_baselines,
+                tuple((int(p), int(q)) for p, q in ranges),
+                self.mean_reference,
+            )
 
             # Basic removal of atmospheric spectrum
             dy = X[:, :-1] - X[:, 1:]
@@ -0,0 +1,183 @@
+"""
+Persistent cache of preprocessed data.
+
+Results are stored in a directory as compressed .npz files named by a key,
+a fingerprint of the full input data and everything else that defines the
+result. Files contain only values and names; the domain of a result is
+constructed by the preprocessors. The cache is bounded in size; the least
+recently used results are removed first.
+
+It is enabled with the QUASAR_PREPROCESS_CACHE_SIZE environment variable
+(the size in megabytes). QUASAR_PREPROCESS_CACHE_DIR sets its location,
+which defaults to a directory in Orange's cache.
+"""
+
+import glob
+import importlib.metadata
+import os
+import tempfile
+import zipfile
+from copy import deepcopy
+
+import numpy as np
+from Orange.data import Domain, Table
+from Orange.misc.environ import cache_dir
+
+from orangecontrib.spectroscopy.preprocess.utils import compute_dtype, fingerprint
+
+
+def _package_version():
+    try:
+        return importlib.metadata.version("Orange-Spectroscopy")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def _domain_names(domain: Domain):
+    return [
+        [v.name for v in part]
+        for part in (domain.attributes, domain.class_vars, domain.metas)
+    ]
+
+
+class ResultCache:
+    VERSION = 2  # increase when stored results or their keys change
+
+    PREFIX = "result-"
+    SUFFIX = ".npz"
+
+    def __init__(self, directory, maxsize):
+        self.directory = directory
+        self.maxsize = maxsize  # in bytes
+
+    @classmethod
+    def key(cls, *parts):
+        # results of other versions of the package or computed with another
+        # precision (see compute_dtype) are not used
+        return fingerprint(
+            cls.VERSION, _package_version(), np.dtype(compute_dtype()).name, *parts
+        )
+
+    def _filename(self, key):
+        return os.path.join(self.directory, self.PREFIX + key + self.SUFFIX)
+
+    def get(self, key, data, domain):
+        """
+        Return the stored result for the key in the domain or None. The
+        result gets the ids, the attributes and non-numeric metas of data,
+        from which it was computed.
+        """
+        filename = self._filename(key)
+        try:
+            with np.load(filename, allow_pickle=False) as f:
+                names = [f[f"names{i}"].tolist() for i in range(3)]
+                X, Y, W, numeric = f["X"], f["Y"], f["W"], f["metas"]
+                name = str(f["name"])
+            if names != _domain_names(domain):
+                raise ValueError("stored result is in another domain")
+            metas = np.empty((len(X), len(domain.metas)), dtype=object)
+            primitive = np.array([v.is_primitive() for v in domain.metas], dtype=bool)
+            metas[:, primitive] = numeric
+            for i, var in enumerate(domain.metas):
+                if not primitive[i]:
+                    metas[:, i] = data.get_column(var)
+            if all(primitive):
+                metas = metas.astype(float)
+            table = Table.from_numpy(
+                domain,
+                X,
+                Y,
+                metas,
+                W if W.size else None,
+                deepcopy(data.attributes),
+                ids=data.ids,
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            self._remove(filename)
+            return None
+        table.name = name
+        # mark as recently used
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        return table
+
+    def put(self, key, table, data):
+        """
+        Store a table with dense values, computed from data, and evict old
+        results if needed. Non-numeric metas are not stored, so they need
+        to come from data unchanged.
+        """
+        if not all(isinstance(a, np.ndarray) for a in (table.X, table.Y, table.W)):
+            return
+        primitive = np.array([v.is_primitive() for v in table.domain.metas], dtype=bool)
+        if not all(
+            p or v in data.domain
+            for p, v in zip(primitive, table.domain.metas, strict=True)
+        ):
+            return
+        names = _domain_names(table.domain)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # write into a temporary file so that readers never see partial files
+            fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    X=table.X,
+                    Y=table.Y,
+                    W=table.W,
+                    metas=table.metas[:, primitive].astype(float),
+                    name=np.array(table.name, dtype=str),
+                    **{
+                        f"names{i}": np.array(n, dtype=str) for i, n in enumerate(names)
+                    },
+                )
+            os.replace(tmpname, self._filename(key))
+        except OSError:
+            return  # the cache is an optimization only
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used results over the size limit."""
+        files = []
+        for fn in glob.glob(os.path.join(self.directory, self.PREFIX + "*")):
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, fn))
+        files.sort(reverse=True)
+        total = 0
+        for _, size, fn in files:
+            total += size
+            if total > self.maxsize:
+                self._remove(fn)
+
+    @staticmethod
+    def _remove(filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def clear(self):
+        for fn in glob.glob(os.path.join(self.directory, self.PREFIX + "*")):
+            self._remove(fn)
+
+
+def result_cache():
+    """Return the cache as set with environment variables or None."""
+    try:
+        size = int(float(os.getenv("QUASAR_PREPROCESS_CACHE_SIZE") or 0) * 1024**2)
+    except (ValueError, OverflowError):  # an invalid size disables the cache
+        return None
+    if size <= 0:
+        return None
+    directory = os.getenv("QUASAR_PREPROCESS_CACHE_DIR") or os.path.join(
+        cache_dir(), "spectroscopy-preprocess"
+    )
+    return ResultCache(directory, size)
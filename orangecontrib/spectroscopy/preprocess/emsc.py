@@ -11,10 +11,7 @@ from orangecontrib.spectroscopy.preprocess.utils import (
     CommonDomainOrderUnknowns,
     interp1d_with_unknowns_numpy,
     MissingReferenceException,
-    interpolate_extend_to,
     CommonDomainRef,
-    table_eq_x,
-    subset_for_hash,
 )
 from orangecontrib.spectroscopy.preprocess.npfunc import Function, Segments
 
@@ -102,6 +99,26 @@ def weighted_wavenumbers(weights, wavenumbers):
         return w
 
 
+def emsc_correct(M, M_weighted, X, n_correct, scaling=True):
+    """
+    Correct all spectra in X with a single least squares solve.
+
+    The model matrix is shared by all spectra, so the parameters of all
+    spectra are estimated at once (multiple right-hand sides). The first
+    n_correct model columns are subtracted and, if scaling, the corrected
+    spectra are divided by the parameter of the next (reference) column.
+
+    Return corrected spectra with appended model parameters.
+    """
+    m = np.linalg.lstsq(M_weighted, X.T, rcond=-1)[0].T
+    corrected = X - m[:, :n_correct] @ M[:, :n_correct].T
+    if scaling:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corrected /= m[:, n_correct : n_correct + 1]
+    corrected[np.isinf(corrected)] = np.nan  # fix values caused by zero weights
+    return np.hstack((corrected, m))  # append the model parameters
+
+
 class EMSCFeature(SelectColumn):
     InheritEq = True
 
@@ -111,6 +128,8 @@ class EMSCModel(SelectColumn):
 
 
 class _EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
+    parallel_rows = True
+
     def __init__(self, reference, badspectra, weights, order, scaling, domain):
         CommonDomainOrderUnknowns.__init__(self, domain)
         CommonDomainRef.__init__(self, reference, domain)
@@ -122,9 +141,8 @@ class _EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
 
     def transformed(self, X, wavenumbers):
         # wavenumber have to be input as sorted
-        # about 85% of time in __call__ function is spent is lstsq
-        ref_X = interpolate_extend_to(self.reference, wavenumbers)
-        wei_X = weighted_wavenumbers(self.weights, wavenumbers)
+        ref_X = self.interpolate_extend_to(self.reference, wavenumbers)
+        wei_X = self.interpolated(self.weights, wavenumbers, weighted_wavenumbers)
 
         N = wavenumbers.shape[0]
         m0 = -2.0 / (wavenumbers[0] - wavenumbers[N - 1])
@@ -132,7 +150,7 @@ class _EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
 
         n_badspec = len(self.badspectra) if self.badspectra is not None else 0
         if self.badspectra:
-            badspectra_X = interpolate_extend_to(self.badspectra, wavenumbers)
+            badspectra_X = self.interpolate_extend_to(self.badspectra, wavenumbers)
 
         M = []
         for x in range(0, self.order + 1):
@@ -140,55 +158,37 @@ class _EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
         for y in range(0, n_badspec):
             M.append(badspectra_X[y])
         M.append(ref_X)  # always add reference spectrum to the model
-        n_add_model = len(M)
         M = np.vstack(
             M
         ).T  # M is for the correction, for par. estimation M_weighted is used
 
         M_weighted = M * wei_X.T
 
-        newspectra = np.zeros((X.shape[0], X.shape[1] + n_add_model))
-        for i, rawspectrum in enumerate(X):
-            rawspectrumW = (rawspectrum * wei_X)[0]  # noqa: F841
-            m = np.linalg.lstsq(M_weighted, rawspectrum, rcond=-1)[0]
-            corrected = rawspectrum
-
-            for x in range(0, self.order + 1 + n_badspec):
-                corrected = corrected - (m[x] * M[:, x])
-            if self.scaling:
-                corrected = corrected / m[self.order + 1 + n_badspec]
-            corrected[np.isinf(corrected)] = np.nan  # fix values caused by zero weights
-            corrected = np.hstack((corrected, m))  # append the model parameters
-            newspectra[i] = corrected
-
-        return newspectra
+        return emsc_correct(M, M_weighted, X, self.order + 1 + n_badspec, self.scaling)
 
     def __eq__(self, other):
         return (
             CommonDomainRef.__eq__(self, other)
-            and table_eq_x(self.badspectra, other.badspectra)
+            and self.table_eq(self.badspectra, other, other.badspectra)
             and self.order == other.order
             and self.scaling == other.scaling
             and (
                 self.weights == other.weights
                 if not isinstance(self.weights, Table)
-                else table_eq_x(self.weights, other.weights)
+                else self.table_eq(self.weights, other, other.weights)
             )
         )
 
     def __hash__(self):
-        domain = self.badspectra.domain if self.badspectra is not None else None
-        fv = subset_for_hash(self.badspectra.X) if self.badspectra is not None else None
         weights = (
             self.weights
             if not isinstance(self.weights, Table)
-            else subset_for_hash(self.weights.X)
+            else self.table_fingerprint(self.weights)
         )
         return hash(
             (
                 CommonDomainRef.__hash__(self),
-                domain,
-                fv,
+                self.table_fingerprint(self.badspectra),
                 weights,
                 self.order,
                 self.scaling,
@@ -16,6 +16,9 @@ from orangecontrib.spectroscopy.preprocess.utils import (
     CommonDomain,
     edge_baseline,
     linear_baseline,
+    transform_to_sorted_wavenumbers,
+    compute_dtype,
+    is_dask_array,
 )
 
 INTEGRATE_DRAW_CURVE_WIDTH = 2
@@ -51,14 +54,13 @@ class IntegrateFeature(SharedComputeValue):
         return self.compute_draw_info(x_s, y_s)
 
     def extract_data(self, data, common):
-        data, x, x_sorter = common
+        X, x = common
         # find limiting indices (inclusive left, exclusive right)
         lim_min, lim_max = min(self.limits), max(self.limits)
-        lim_min = np.searchsorted(x, lim_min, sorter=x_sorter, side="left")
-        lim_max = np.searchsorted(x, lim_max, sorter=x_sorter, side="right")
-        x_s = x[x_sorter][lim_min:lim_max]
-        y_s = data.X[:, x_sorter][:, lim_min:lim_max]
-        return x_s, y_s
+        lim_min = np.searchsorted(x, lim_min, side="left")
+        lim_max = np.searchsorted(x, lim_max, side="right")
+        # a view into the data shared by all features
+        return x[lim_min:lim_max], X[:, lim_min:lim_max]
 
     def compute_draw_info(self, x_s, y_s):
         return {}
@@ -76,8 +78,20 @@ class IntegrateFeature(SharedComputeValue):
 
     def compute(self, data, common):
         x_s, y_s = self.extract_data(data, common)
+        if is_dask_array(y_s):
+            return y_s.map_blocks(
+                lambda y: self.compute_integral(x_s, y),
+                drop_axis=1,
+                dtype=float,
+                meta=np.empty((0,), dtype=float),
+            )
         return self.compute_integral(x_s, y_s)
 
+    def compute_indexed(self, index):
+        """Return values for spectra without unknowns in the IntegralIndex
+        (index.known) or None if they can not be computed from it."""
+        return None
+
     def __eq__(self, other):
         return super().__eq__(other) and self.limits == other.limits
 
@@ -110,6 +124,17 @@ class IntegrateFeatureEdgeBaseline(IntegrateFeature):
         y_s = y_s - self.compute_baseline(x, y_s)
         return scipy.integrate.trapezoid(y_s, x, axis=1)
 
+    def compute_indexed(self, index):
+        lo, hi = index.window(min(self.limits), max(self.limits))
+        if hi - lo < 2:
+            return None
+        # the baseline is linear: its integral only depends on the edges
+        x_e, y_e = index.columns([lo, hi - 1])
+        baseline = self.compute_baseline(x_e, y_e)
+        return index.trapezoid(lo, hi) - scipy.integrate.trapezoid(
+            baseline, x_e, axis=1
+        )
+
     def compute_draw_info(self, x, ys):
         return [
             (
@@ -131,6 +156,10 @@ class IntegrateFeatureEdgeBaselineAbsolute(IntegrateFeatureEdgeBaseline):
         y_s = y_s - self.compute_baseline(x, y_s)
         return scipy.integrate.trapezoid(np.abs(y_s), x, axis=1)
 
+    def compute_indexed(self, index):
+        # absolute values can not be integrated with prefix sums
+        return None
+
     def compute_draw_info(self, x, ys):
         baseline = self.compute_baseline(x, ys)
         abs_ys = np.abs(ys - baseline) + baseline
@@ -177,6 +206,26 @@ class IntegrateFeatureSeparateBaseline(IntegrateFeature):
 
         return scipy.integrate.trapezoid(y_s, x_s, axis=1)
 
+    def compute_indexed(self, index):
+        x_s = index.window_x(min(self.limits), max(self.limits))
+        zero_points = self.limits[2:]
+        if len(x_s) < 2 or zero_points[0] == zero_points[1]:
+            return None
+        lo, hi = index.window(min(self.limits[:2]), max(self.limits[:2]))
+        if hi - lo < 2:
+            return np.zeros(np.count_nonzero(index.known))
+        # baseline values at the zero points only depend on their neighbours
+        # (or on the first or last two points of x_s when extrapolating)
+        start = np.searchsorted(index.x, x_s[0])
+        neighbours = np.clip(np.searchsorted(x_s, zero_points), 1, len(x_s) - 1)
+        cols = np.unique(np.r_[neighbours - 1 + start, neighbours + start, lo, hi - 1])
+        x_e, y_e = index.columns(cols)
+        baseline = self.compute_baseline(x_e, y_e)
+        edges = np.searchsorted(cols, [lo, hi - 1])
+        return index.trapezoid(lo, hi) - scipy.integrate.trapezoid(
+            baseline[:, edges], x_e[edges], axis=1
+        )
+
     def compute_draw_info(self, x_s, y_s):
         xl, ysl = self.limit_region(x_s, y_s)
         return [
@@ -318,8 +367,7 @@ class IntegrateFeatureAtPeak(IntegrateFeature):
         return (("Closest to", "Nearest value"),)
 
     def extract_data(self, data, common):
-        data, x, x_sorter = common
-        return x, data.X
+        return common[1], common[0]
 
     def compute_baseline(self, x, y):
         return np.zeros(y.shape)
@@ -343,9 +391,18 @@ class IntegrateFeatureAtPeak(IntegrateFeature):
 
 class _IntegrateCommon(CommonDomain):
     def transformed(self, data):
-        x = getx(data)
-        x_sorter = np.argsort(x)
-        return data, x, x_sorter
+        """Return data sorted by wavenumbers (a view if they were sorted)
+        and sorted wavenumbers. Features take windows of these."""
+        xs, xsind, mon, X = transform_to_sorted_wavenumbers(
+            getx(data), data.X, dtype=compute_dtype()
+        )
+        return X, xs[xsind]
+
+    def dask_transformed(self, data):
+        # columns are sorted lazily, features integrate blocks of rows
+        X = data.X.rechunk({1: -1})
+        xs, xsind, mon, X = transform_to_sorted_wavenumbers(getx(data), X)
+        return X, xs[xsind]
 
     def __eq__(self, other):
         # pylint: disable=useless-parent-delegation
@@ -356,6 +413,70 @@ class _IntegrateCommon(CommonDomain):
         return super().__hash__()
 
 
+class IntegralIndex:
+    """
+    Data sorted by wavenumbers with prefix sums of trapezoid integrals, which
+    give integrals for any limits without going through whole spectra.
+    Build it once and compute many integrals (see compute).
+    """
+
+    def __init__(self, data):
+        self.domain = data.domain
+        self.X, self.x = _IntegrateCommon(data.domain).transformed(data)
+        # spectra with unknowns are integrated as usual
+        self.known = ~np.isnan(self.X).any(axis=1)
+        self.cumulative = np.zeros((np.count_nonzero(self.known), len(self.x)))
+        if len(self.x):
+            self.cumulative[:] = scipy.integrate.cumulative_trapezoid(
+                self.X[self.known], self.x, axis=1, initial=0
+            )
+
+    def window(self, lim_min, lim_max):
+        """Indices of wavenumbers within limits (inclusive left, exclusive right)"""
+        return (
+            np.searchsorted(self.x, lim_min, side="left"),
+            np.searchsorted(self.x, lim_max, side="right"),
+        )
+
+    def window_x(self, lim_min, lim_max):
+        lo, hi = self.window(lim_min, lim_max)
+        return self.x[lo:hi]
+
+    def columns(self, cols):
+        """Wavenumbers and values of known spectra at given indices"""
+        return self.x[cols], self.X[:, cols][self.known]
+
+    def trapezoid(self, lo, hi):
+        """Integrals of known spectra over wavenumbers lo:hi"""
+        if hi - lo < 2:
+            return np.zeros(len(self.cumulative))
+        return self.cumulative[:, hi - 1] - self.cumulative[:, lo]
+
+    def compute(self, integrate):
+        """Return integrals defined by an Integrate preprocessor for all
+        spectra, as integrate(data).X (or its new metas)."""
+        domain = integrate(Orange.data.Table.from_domain(self.domain)).domain
+        features = [
+            v.compute_value
+            for v in domain.attributes + domain.metas
+            if v not in self.domain and isinstance(v.compute_value, IntegrateFeature)
+        ]
+        common = self.X, self.x
+        out = np.empty((len(self.X), len(features)))
+        for i, feature in enumerate(features):
+            known = feature.compute_indexed(self)
+            if known is None:
+                out[:, i] = feature.compute(None, common)
+            else:
+                out[self.known, i] = known
+                if not self.known.all():
+                    x_s, y_s = feature.extract_data(None, common)
+                    out[~self.known, i] = feature.compute_integral(
+                        x_s, y_s[~self.known]
+                    )
+        return out
+
+
 class Integrate(Preprocess):
     INTEGRALS = [
         IntegrateFeatureSimple,
@@ -1,3 +1,8 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
 import numpy as np
 from scipy.signal import hilbert
 from sklearn.decomposition import TruncatedSVD
@@ -13,17 +18,101 @@ from orangecontrib.spectroscopy.preprocess.utils import (
     CommonDomainOrderUnknowns,
     interpolate_extend_to,
     CommonDomainRef,
-    table_eq_x,
-    subset_for_hash,
 )
 from orangecontrib.spectroscopy.preprocess.emsc import (
     weighted_wavenumbers,
     average_table_x,
+    emsc_correct,
 )
 
 
+# maximum number of Mie curve values computed at once in ME-EMSC iterations
+QEXT_BLOCK_SIZE = 2**22
+
+
+class MieCurvesCache:
+    """
+    A bounded LRU cache for compressed Mie extinction curves and the
+    selected number of components, keyed by a content hash of the
+    reference and the parameter grids.
+
+    If directory is set, computed values are also stored there (as .npy)
+    and reused across sessions.
+    """
+
+    VERSION = 1  # increase when computation of the cached values changes
+
+    def __init__(self, maxsize=32, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def key(cls, *parts):
+        h = hashlib.sha1(str(cls.VERSION).encode())
+        for p in parts:
+            if isinstance(p, str):
+                h.update(p.encode())
+            else:
+                p = np.ascontiguousarray(p, dtype=float)
+                h.update(str(p.shape).encode())
+                h.update(p.tobytes())
+        return h.hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, "mie-" + key + ".npy")
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            return np.load(self._filename(key))
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, key, value):
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            np.save(self._filename(key), value)
+        except OSError:
+            pass  # the cache is an optimization only
+
+    def get(self, parts, compute):
+        """Return the cached value for key parts or compute it."""
+        key = self.key(*parts)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        value = self._load(key)
+        if value is None:
+            value = np.asarray(compute())
+            self._save(key, value)
+        value.flags.writeable = False
+        with self._lock:
+            self._cache[key] = value
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+mie_curves_cache = MieCurvesCache()
+
+
 def calculate_complex_n(ref_X, wavenumbers):
-    """Calculates the scaled imaginary part and scaled fluctuating real part of the refractive index."""
+    """Calculates the scaled imaginary part and scaled fluctuating real part of the refractive index.
+
+    ref_X can also be a 2D array of references, one per row."""
     npr = ref_X
     nprs = npr / (wavenumbers * 100)
 
@@ -36,84 +125,108 @@ def calculate_complex_n(ref_X, wavenumbers):
             dw * np.linspace(1, 200, 200) + (wavenumbers[-1]),
         )
     )
-    extension1 = npr[0] * np.ones(200)
-    extension2 = npr[-1] * np.ones(200)
-    npr_extended = np.hstack((extension1, npr, extension2))
+    extension1 = np.repeat(npr[..., :1], 200, axis=-1)
+    extension2 = np.repeat(npr[..., -1:], 200, axis=-1)
+    npr_extended = np.concatenate((extension1, npr, extension2), axis=-1)
 
     # Calculate Hilbert transform
     nkks_extended = -hilbert(npr_extended / (wavenumbers_extended * 100)).imag
 
     # Cut extended spectrum
-    nkks = nkks_extended[200:-200]
+    nkks = nkks_extended[..., 200:-200]
     return nprs, nkks
 
 
 def calculate_Qext_curves(nprs, nkks, alpha0, gamma, wavenumbers):
+    """Calculate Mie extinction curves for all combinations of alpha0 and gamma.
+
+    For 2D nprs and nkks (one row per reference) the result is a 3D
+    array with the curves of each reference in the first axis."""
+
     def mie_hulst_extinction(rho, tanbeta):
         beta = np.arctan(tanbeta)
-        cosbeta = np.cos(beta)
+        cosbeta_rho = np.cos(beta) / rho
+        damping = 4 * np.exp(-rho * tanbeta) * cosbeta_rho
         return (
             2
-            - 4 * np.e ** (-rho * tanbeta) * (cosbeta / rho) * np.sin(rho - beta)
-            - 4
-            * np.e ** (-rho * tanbeta)
-            * (cosbeta / rho) ** 2
-            * np.cos(rho - 2 * beta)
-            + 4 * (cosbeta / rho) ** 2 * np.cos(2 * beta)
+            - damping * np.sin(rho - beta)
+            - damping * cosbeta_rho * np.cos(rho - 2 * beta)
+            + 4 * cosbeta_rho**2 * np.cos(2 * beta)
         )
 
-    rho = np.array(
-        [
-            alpha0val * (1 + gammaval * nkks) * (wavenumbers * 100)
-            for alpha0val in alpha0
-            for gammaval in gamma
-        ]
-    )
-    tanbeta = [nprs / (1 / gammaval + nkks) for _ in alpha0 for gammaval in gamma]
-    Qext = np.array(
-        [
-            mie_hulst_extinction(rhoval, tanbetaval)
-            for rhoval, tanbetaval in zip(rho, tanbeta)  # noqa: B905
-        ]
-    )
+    # curves are ordered by alpha0 first and then by gamma
+    alpha0val = np.repeat(alpha0, len(gamma))[:, np.newaxis]
+    gammaval = np.tile(gamma, len(alpha0))[:, np.newaxis]
+    nprs = nprs[..., np.newaxis, :]
+    nkks = nkks[..., np.newaxis, :]
+    rho = alpha0val * (1 + gammaval * nkks) * (wavenumbers * 100)
+    tanbeta = nprs / (1 / gammaval + nkks)
+    Qext = mie_hulst_extinction(rho, tanbeta)
     return Qext
 
 
 def orthogonalize_Qext(Qext, reference):
-    m = np.dot(reference, reference)
+    """Orthogonalize Qext curves to the reference. Also works on stacks of
+    curves (3D Qext) with one reference per stack (2D reference)."""
+    m = np.sum(reference * reference, axis=-1, keepdims=True)
     norm = np.sqrt(m)
     rnorm = reference / norm
-    s = np.dot(Qext, rnorm)
-    Qext_orthogonalized = Qext - s[:, np.newaxis] * rnorm[np.newaxis, :]
+    s = np.einsum("...cn,...n->...c", Qext, rnorm)
+    Qext_orthogonalized = Qext - s[..., np.newaxis] * rnorm[..., np.newaxis, :]
     return Qext_orthogonalized
 
 
 def compress_Mie_curves(Qext_orthogonalized, numComp):
-    svd = TruncatedSVD(
-        n_components=numComp, n_iter=7, random_state=42
-    )  # Self.ncomp needs to be specified
-    svd.fit(Qext_orthogonalized)
-    badspectra = svd.components_[0:numComp, :]
-    return badspectra
+    """Return the first numComp principal directions of Qext curves.
+
+    A stack of curves (3D input) is decomposed at once. Signs follow the
+    convention of TruncatedSVD."""
+    _, _, vt = np.linalg.svd(Qext_orthogonalized, full_matrices=False)
+    badspectra = vt[..., :numComp, :]
+    # as sklearn's svd_flip: the largest absolute value in each row is positive
+    max_abs = np.argmax(np.abs(badspectra), axis=-1)
+    signs = np.sign(np.take_along_axis(badspectra, max_abs[..., np.newaxis], -1))
+    return badspectra * signs
+
+
+def mie_basis(reference, wavenumbers, alpha0, gamma, ncomp):
+    """Compressed Mie extinction curves orthogonalized to the reference."""
+
+    def compute():
+        nprs, nkks = calculate_complex_n(reference, wavenumbers)
+        Qext = calculate_Qext_curves(nprs, nkks, alpha0, gamma, wavenumbers)
+        Qext = orthogonalize_Qext(Qext, reference)
+        return compress_Mie_curves(Qext, ncomp)
+
+    return mie_curves_cache.get(
+        ("basis", reference, wavenumbers, alpha0, gamma, ncomp), compute
+    )
 
 
 def cal_ncomp(reference, wavenumbers, explainedVarLim, alpha0, gamma):
-    nprs, nkks = calculate_complex_n(reference, wavenumbers)
-    Qext = calculate_Qext_curves(nprs, nkks, alpha0, gamma, wavenumbers)
-    Qext_orthogonalized = orthogonalize_Qext(Qext, reference)
-    maxNcomp = reference.shape[0] - 1
-    svd = TruncatedSVD(n_components=min(maxNcomp, 30), n_iter=7, random_state=42)
-    svd.fit(Qext_orthogonalized)
-    lda = np.array(
-        [
-            (sing_val**2) / (Qext_orthogonalized.shape[0] - 1)
-            for sing_val in svd.singular_values_
-        ]
+    def compute():
+        nprs, nkks = calculate_complex_n(reference, wavenumbers)
+        Qext = calculate_Qext_curves(nprs, nkks, alpha0, gamma, wavenumbers)
+        Qext_orthogonalized = orthogonalize_Qext(Qext, reference)
+        maxNcomp = reference.shape[0] - 1
+        svd = TruncatedSVD(n_components=min(maxNcomp, 30), n_iter=7, random_state=42)
+        svd.fit(Qext_orthogonalized)
+        lda = np.array(
+            [
+                (sing_val**2) / (Qext_orthogonalized.shape[0] - 1)
+                for sing_val in svd.singular_values_
+            ]
+        )
+        explainedVariance = 100 * lda / np.sum(lda)
+        explainedVariance = np.cumsum(explainedVariance)
+        numComp = np.argmax(explainedVariance > explainedVarLim) + 1
+        return numComp
+
+    return int(
+        mie_curves_cache.get(
+            ("ncomp", reference, wavenumbers, explainedVarLim, alpha0, gamma), compute
+        )
     )
-    explainedVariance = 100 * lda / np.sum(lda)
-    explainedVariance = np.cumsum(explainedVariance)
-    numComp = np.argmax(explainedVariance > explainedVarLim) + 1
-    return numComp
 
 
 class ME_EMSCFeature(SelectColumn):
@@ -125,6 +238,8 @@ class ME_EMSCModel(SelectColumn):
 
 
 class _ME_EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
+    parallel_rows = True
+
     def __init__(
         self,
         reference,
@@ -163,55 +278,56 @@ class _ME_EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
             M_basic = np.vstack(M_basic).T
             return M_basic
 
-        def cal_emsc_basic(M_basic, spectrum):
-            m = np.linalg.lstsq(M_basic, spectrum, rcond=-1)[0]
-            corrected = spectrum
-            for x in range(0, 3):
-                corrected = corrected - (m[x] * M_basic[:, x])
-            corrected = corrected / m[3]
-            scaled_spectrum = corrected
-            return scaled_spectrum
-
         def make_emsc_model(badspectra, referenceSpec):
-            M = np.ones([len(wavenumbers), self.ncomp + 2])
-            M[:, 1 : self.ncomp + 1] = np.array([spectrum for spectrum in badspectra.T])
-            M[:, self.ncomp + 1] = referenceSpec
+            # for stacked inputs, there is a separate model for each spectrum
+            M = np.ones(referenceSpec.shape + (self.ncomp + 2,))
+            M[..., 1 : self.ncomp + 1] = np.swapaxes(badspectra, -1, -2)
+            M[..., self.ncomp + 1] = referenceSpec
             return M
 
-        def cal_emsc(M, X):
-            correctedspectra = np.zeros((X.shape[0], X.shape[1] + M.shape[1]))
-            for i, rawspectrum in enumerate(X):
-                m = np.linalg.lstsq(M, rawspectrum, rcond=-1)[0]
-                corrected = rawspectrum
-                for x in range(0, 1 + self.ncomp):
-                    corrected = corrected - (m[x] * M[:, x])
-                corrected = corrected / m[1 + self.ncomp]
-                corrected[np.isinf(corrected)] = (
-                    np.nan
-                )  # fix values caused by zero weights
-                corrected = np.hstack((corrected, m))  # append the model parameters
-                correctedspectra[i] = corrected
+        def calculate_rmse(res):
+            return np.round(np.sqrt((1 / res.shape[1]) * np.sum(res**2, axis=1)), 4)
 
+        def cal_emsc(M, X):
+            correctedspectra = emsc_correct(M, M, X, 1 + self.ncomp)
             params = correctedspectra[:, -(self.ncomp + 2) :]
             res = X - np.dot(params, M.T)  # Have to check if this is correct FIXME
             return correctedspectra, res
 
-        def iteration_step(spectrum, reference, wavenumbers, M_basic, alpha0, gamma):
+        def cal_emsc_stacked(M, X):
+            # lstsq does not work on stacks of matrices, pinv does
+            M_pinv = np.linalg.pinv(M, rcond=np.finfo(M.dtype).eps * max(M.shape[1:]))
+            params = np.einsum("kpn,kn->kp", M_pinv, X)
+            corrected = X - np.einsum(
+                "knp,kp->kn", M[..., : 1 + self.ncomp], params[:, : 1 + self.ncomp]
+            )
+            corrected /= params[:, 1 + self.ncomp : 2 + self.ncomp]
+            corrected[np.isinf(corrected)] = np.nan  # fix values caused by zero weights
+            res = X - np.einsum("knp,kp->kn", M, params)
+            return np.hstack((corrected, params)), res
+
+        def iteration_step(spectra, corrected, M_basic, alpha0, gamma):
             # scale with basic EMSC:
-            reference = cal_emsc_basic(M_basic, reference)
+            m = np.linalg.lstsq(M_basic, corrected.T, rcond=-1)[0].T
+            reference = (corrected - m[:, :3] @ M_basic[:, :3].T) / m[:, 3:4]
             # some BLAS implementation can raise an exception in the upper call (MKL)
             # while some other only return an array of NaN (OpenBLAS), therefore
-            # raise an exception manually
-            if np.all(np.isnan(reference)):
-                raise np.linalg.LinAlgError()
+            # mark such spectra as failed
+            failed = np.all(np.isnan(reference), axis=1)
+
+            newspectra = np.full(
+                (len(spectra), spectra.shape[1] + self.ncomp + 2), np.nan
+            )
+            res = np.full(spectra.shape, np.nan)
+            ok = ~failed
+            if not np.any(ok):
+                return newspectra, res, failed
 
             # Apply weights
-            reference = reference * wei_X
-            reference = reference[0]
+            reference = reference[ok] * wei_X
 
             # set negative parts to zero
-            nonzeroReference = reference.copy()
-            nonzeroReference[nonzeroReference < 0] = 0
+            nonzeroReference = np.where(reference < 0, 0, reference)
 
             if self.positiveRef:
                 reference = nonzeroReference
@@ -223,13 +339,52 @@ class _ME_EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
 
             badspectra = compress_Mie_curves(Qext, self.ncomp)
 
-            # build ME-EMSC model
+            # build ME-EMSC models
             M = make_emsc_model(badspectra, reference)
 
             # calculate parameters and corrected spectra
-            newspectrum, res = cal_emsc(M, spectrum)
+            newspectra[ok], res[ok] = cal_emsc_stacked(M, spectra[ok])
 
-            return newspectrum, res
+            return newspectra, res, failed
+
+        def iteration_step_blocks(
+            spectra, corrected, M_basic, alpha0, gamma, block_size=None
+        ):
+            if block_size is None:
+                # bound the memory used for the Mie curves of a block
+                block_size = max(
+                    1, QEXT_BLOCK_SIZE // (len(alpha0) * len(gamma) * len(wavenumbers))
+                )
+            parts = []
+            for start in range(0, len(spectra), block_size):
+                block = slice(start, start + block_size)
+                try:
+                    parts.append(
+                        iteration_step(
+                            spectra[block], corrected[block], M_basic, alpha0, gamma
+                        )
+                    )
+                except np.linalg.LinAlgError:
+                    if block_size == 1:
+                        newspectrum = np.full(
+                            (1, spectra.shape[1] + self.ncomp + 2), np.nan
+                        )
+                        res = np.full((1, spectra.shape[1]), np.nan)
+                        parts.append((newspectrum, res, np.ones(1, dtype=bool)))
+                    else:
+                        # redo the block spectrum by spectrum, so that only
+                        # the spectra which cause the problem fail
+                        parts.append(
+                            iteration_step_blocks(
+                                spectra[block],
+                                corrected[block],
+                                M_basic,
+                                alpha0,
+                                gamma,
+                                block_size=1,
+                            )
+                        )
+            return tuple(np.concatenate(p) for p in zip(*parts, strict=True))
 
         def iterate(
             spectra,
@@ -242,72 +397,52 @@ class _ME_EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
         ):
             newspectra = np.full(correctedFirsIteration.shape, np.nan)
             numberOfIterations = np.full(spectra.shape[0], np.nan)
-            residuals = np.full(spectra.shape, np.nan)
             RMSEall = np.full([spectra.shape[0]], np.nan)
-            for i in range(correctedFirsIteration.shape[0]):
-                corrSpec = correctedFirsIteration[i]
-                rawSpec = spectra[i, :]
-                rawSpec = rawSpec.reshape(1, -1)
-                RMSE = [
-                    round(
-                        np.sqrt(
-                            (1 / len(residualsFirstIteration[i, :]))
-                            * np.sum(residualsFirstIteration[i, :] ** 2)
-                        ),
-                        4,
+            corrSpec = correctedFirsIteration.copy()
+            # the last three RMSE values of each spectrum (for the stop criterion)
+            RMSE = np.full([spectra.shape[0], 3], np.nan)
+            RMSE[:, -1] = calculate_rmse(residualsFirstIteration)
+            # spectra are removed from the active set when they converge
+            active = np.arange(spectra.shape[0])
+            for iterationNumber in range(2, self.maxNiter + 1):
+                if not len(active):
+                    break
+                newSpec, res, failed = iteration_step_blocks(
+                    spectra[active],
+                    corrSpec[active, : -self.ncomp - 2],
+                    M_basic,
+                    alpha0,
+                    gamma,
+                )
+                corrSpec[active] = newSpec
+                RMSE[active] = np.column_stack((RMSE[active, 1:], calculate_rmse(res)))
+                # Stop criterion
+                if iterationNumber == self.maxNiter:
+                    stop = np.ones(len(active), dtype=bool)
+                elif self.fixedNiter and iterationNumber < self.fixedNiter:
+                    stop = np.zeros(len(active), dtype=bool)
+                elif iterationNumber == self.fixedNiter:
+                    stop = np.ones(len(active), dtype=bool)
+                elif iterationNumber > 2 and not self.fixedNiter:
+                    rmse = RMSE[active]
+                    stop = ((rmse[:, 2] == rmse[:, 1]) & (rmse[:, 2] == rmse[:, 0])) | (
+                        rmse[:, 2] > rmse[:, 1]
                     )
-                ]
-                for iterationNumber in range(2, self.maxNiter + 1):
-                    try:
-                        newSpec, res = iteration_step(
-                            rawSpec,
-                            corrSpec[: -self.ncomp - 2],
-                            wavenumbers,
-                            M_basic,
-                            alpha0,
-                            gamma,
-                        )
-                    except np.linalg.LinAlgError:
-                        newspectra[i, :] = np.full(
-                            [rawSpec.shape[1] + self.ncomp + 2], np.nan
-                        )
-                        residuals[i, :] = np.full(rawSpec.shape, np.nan)
-                        RMSEall[i] = np.nan
-                        break
-                    corrSpec = newSpec[0, :]
-                    rmse = round(np.sqrt((1 / len(res[0, :])) * np.sum(res**2)), 4)
-                    RMSE.append(rmse)
-                    # Stop criterion
-                    if iterationNumber == self.maxNiter:
-                        newspectra[i, :] = corrSpec
-                        numberOfIterations[i] = iterationNumber
-                        residuals[i, :] = res
-                        RMSEall[i] = RMSE[-1]
-                        break
-                    elif self.fixedNiter and iterationNumber < self.fixedNiter:
-                        continue
-                    elif (
-                        iterationNumber == self.maxNiter
-                        or iterationNumber == self.fixedNiter
-                    ):
-                        newspectra[i, :] = corrSpec
-                        numberOfIterations[i] = iterationNumber
-                        residuals[i, :] = res
-                        RMSEall[i] = RMSE[-1]
-                        break
-                    elif iterationNumber > 2 and not self.fixedNiter:
-                        if (rmse == RMSE[-2] and rmse == RMSE[-3]) or rmse > RMSE[-2]:
-                            newspectra[i, :] = corrSpec
-                            numberOfIterations[i] = iterationNumber
-                            residuals[i, :] = res
-                            RMSEall[i] = RMSE[-1]
-                            break
+                else:
+                    stop = np.zeros(len(active), dtype=bool)
+                # failed spectra stay NaN
+                stop &= ~failed
+                finished = active[stop]
+                newspectra[finished] = corrSpec[finished]
+                numberOfIterations[finished] = iterationNumber
+                RMSEall[finished] = RMSE[finished, -1]
+                active = active[~(stop | failed)]
             return newspectra, RMSEall, numberOfIterations
 
-        ref_X = interpolate_extend_to(self.reference, wavenumbers)
+        ref_X = self.interpolate_extend_to(self.reference, wavenumbers)
         ref_X = ref_X[0]
 
-        wei_X = weighted_wavenumbers(self.weights, wavenumbers)
+        wei_X = self.interpolated(self.weights, wavenumbers, weighted_wavenumbers)
 
         ref_X = ref_X * wei_X
         ref_X = ref_X[0]
@@ -318,24 +453,28 @@ class _ME_EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
         if self.positiveRef:
             ref_X = nonzeroReference
 
+        # For the first iteration, make basic EMSC model
+        M_basic = make_basic_emsc_mod(
+            ref_X
+        )  # Consider to make the M_basic in the init since this one does not change.
+
         resonant = True  # Possibility for using the 2008 version
 
         if resonant:  # if this should be any point, we need to terminate after 1 iteartion for the non-resonant one
-            nprs, nkks = calculate_complex_n(ref_X, wavenumbers)
+            # Scattering curves for ME-EMSC (cached)
+            badspectra = mie_basis(
+                ref_X, wavenumbers, self.alpha0, self.gamma, self.ncomp
+            )
         else:
             npr = np.zeros(len(wavenumbers))
             nprs = npr / (wavenumbers * 100)
             nkks = np.zeros(len(wavenumbers))
-
-        # For the first iteration, make basic EMSC model
-        M_basic = make_basic_emsc_mod(
-            ref_X
-        )  # Consider to make the M_basic in the init since this one does not change.
-
-        # Calculate scattering curves for ME-EMSC
-        Qext = calculate_Qext_curves(nprs, nkks, self.alpha0, self.gamma, wavenumbers)
-        Qext = orthogonalize_Qext(Qext, ref_X)
-        badspectra = compress_Mie_curves(Qext, self.ncomp)
+            # Calculate scattering curves for ME-EMSC
+            Qext = calculate_Qext_curves(
+                nprs, nkks, self.alpha0, self.gamma, wavenumbers
+            )
+            Qext = orthogonalize_Qext(Qext, ref_X)
+            badspectra = compress_Mie_curves(Qext, self.ncomp)
 
         # Establish ME-EMSC model
         M = make_emsc_model(badspectra, ref_X)
@@ -344,17 +483,13 @@ class _ME_EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
         newspectra, res = cal_emsc(M, X)
 
         if self.fixedNiter == 1 or self.maxNiter == 1:
-            res = np.array(res)
             numberOfIterations = np.ones([1, newspectra.shape[0]])
-            RMSEall = [
-                round(np.sqrt((1 / res.shape[1]) * np.sum(res[specNum, :] ** 2)), 4)
-                for specNum in range(newspectra.shape[0])
-            ]  # ADD RESIDUALS!!!!! FIXME
+            RMSEall = calculate_rmse(res)  # ADD RESIDUALS!!!!! FIXME
             newspectra = np.hstack(
                 (
                     newspectra,
                     numberOfIterations.reshape(-1, 1),
-                    np.array(RMSEall).reshape(-1, 1),
+                    RMSEall.reshape(-1, 1),
                 )
             )
             return newspectra
@@ -380,7 +515,7 @@ class _ME_EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
             and (
                 self.weights == other.weights
                 if not isinstance(self.weights, Table)
-                else table_eq_x(self.weights, other.weights)
+                else self.table_eq(self.weights, other, other.weights)
             )
         )
 
@@ -388,7 +523,7 @@ class _ME_EMSC(CommonDomainOrderUnknowns, CommonDomainRef):
         weights = (
             self.weights
             if not isinstance(self.weights, Table)
-            else subset_for_hash(self.weights.X)
+            else self.table_fingerprint(self.weights)
         )
         return hash(
             (
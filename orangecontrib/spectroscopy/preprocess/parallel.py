@@ -0,0 +1,100 @@
+"""
+Row-parallel computation of transformations in multiple processes.
+
+It is enabled with the QUASAR_N_PROCESSES environment variable, which is
+also used by the Peak Fit and Polar widgets. It can be a number of processes
+or "all" for all cores. Without it, everything is computed in the current
+process.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SharedMemoryManager
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+# smaller inputs are not split (starting processes takes time)
+PARALLEL_MIN_ROWS = 100
+
+
+def n_processes():
+    env_proc = os.getenv("QUASAR_N_PROCESSES")
+    return os.cpu_count() if env_proc == "all" else int(env_proc) if env_proc else 1
+
+
+def _shared_array(smm, shape, dtype):
+    shm = smm.SharedMemory(size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _transform_block(function, start, stop, args, inp, out, row_args):
+    """Compute rows start:stop of function on shared input and write them
+    into the shared output. inp and out are (name, shape, dtype)."""
+    shm_in = SharedMemory(name=inp[0])
+    shm_out = SharedMemory(name=out[0])
+    try:
+        X = np.ndarray(inp[1], dtype=inp[2], buffer=shm_in.buf)
+        result = np.ndarray(out[1], dtype=out[2], buffer=shm_out.buf)
+        result[start:stop] = function(
+            X[start:stop], *args, *(a[start:stop] for a in row_args)
+        )
+    finally:
+        # views into buffers need to be deleted before closing
+        X = result = None
+        shm_in.close()
+        shm_out.close()
+
+
+def transform_rows(function, X, args=(), row_args=(), processes=None):
+    """
+    Return function(X, *args, *row_args) for a function that computes rows
+    independently. Rows are split among processes (see n_processes); row_args
+    are split with them. Input and output are passed through shared memory,
+    the function and args are pickled.
+    """
+    processes = n_processes() if processes is None else processes
+    n = len(X)
+    if (
+        processes <= 1
+        or n < PARALLEL_MIN_ROWS
+        or not isinstance(X, np.ndarray)
+        # daemonic processes (such as pool workers) can not have children
+        or multiprocessing.current_process().daemon
+    ):
+        return function(X, *args, *row_args)
+
+    # the first row is computed here to find the output shape
+    first = np.asarray(function(X[:1], *args, *(a[:1] for a in row_args)))
+    bounds = np.linspace(1, n, processes + 1).astype(int)
+    with SharedMemoryManager() as smm:
+        shm_in, shared_in = _shared_array(smm, X.shape, X.dtype)
+        shared_in[...] = X
+        shape = (n,) + first.shape[1:]
+        shm_out, shared_out = _shared_array(smm, shape, first.dtype)
+        inp_desc = (shm_in.name, X.shape, X.dtype)
+        out_desc = (shm_out.name, shape, first.dtype)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(
+                    _transform_block,
+                    function,
+                    start,
+                    stop,
+                    args,
+                    inp_desc,
+                    out_desc,
+                    row_args,
+                )
+                for start, stop in zip(bounds[:-1], bounds[1:], strict=True)
+                if start < stop
+            ]
+            for f in futures:
+                f.result()  # raises exceptions from processes
+        out = shared_out.copy()
+        # views into buffers need to be deleted before the manager shuts down
+        shared_in = shared_out = None
+    out[:1] = first
+    return out
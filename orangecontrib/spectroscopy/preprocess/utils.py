@@ -1,12 +1,22 @@
-import math
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import lru_cache
 from typing import Optional
 
 import numpy as np
-from Orange.data import Table, Domain
+from Orange.data import Table, Domain, Variable
 from Orange.data.util import SharedComputeValue
+from scipy import sparse
 from scipy.interpolate import interp1d
 
+from orangecontrib.spectroscopy import dask_client
 from orangecontrib.spectroscopy.data import getx
+from orangecontrib.spectroscopy.preprocess.parallel import transform_rows
 
 
 try:
@@ -16,6 +26,69 @@ except ImportError:
     dask = False
 
 
+def is_dask_array(X):
+    return bool(dask) and isinstance(X, dask.array.Array)
+
+
+def compute_dask(array):
+    """Compute a dask array on the package-level dask_client, if there is one."""
+    if dask_client is not None:
+        return dask_client.compute(array).result()
+    return array.compute()
+
+
+def transform_dask_rows(function, data: Table, rows_independent=True):
+    """
+    Lazily compute function(table), which returns an array with a row for
+    every row of the table, on a table with a dask X. The function is mapped
+    (with map_blocks) onto tables of blocks of rows of data, so that chained
+    transformations build a single task graph. If rows are not independent,
+    all rows form a single block and the function must keep the number of
+    columns; otherwise it is computed on a row of zeros to find it, so that
+    no blocks of chained transformations are computed in advance.
+    """
+    X = data.X.rechunk({0: "auto" if rows_independent else -1, 1: -1})
+    # Y and metas are small; they are needed in blocks for some transformations
+    Y, metas = (
+        compute_dask(a) if is_dask_array(a) else a for a in (data.Y, data.metas)
+    )
+
+    # tasks get only what they need: the whole table would bring its dask X
+    # and the graph into every task
+    domain = data.domain
+
+    def block(Xb, block_info=None):
+        start, stop = block_info[0]["array-location"][0]
+        part = Table.from_numpy(domain, Xb, Y[start:stop], metas[start:stop])
+        return np.asarray(function(part))
+
+    if X.shape[0] == 0:
+        return block(np.empty(X.shape), {0: {"array-location": [(0, 0)]}})
+    if rows_independent:
+        # the width of rows does not depend on their values
+        zeros = np.zeros((1, X.shape[1]), dtype=X.dtype)
+        with np.errstate(all="ignore"):
+            first = block(zeros, {0: {"array-location": [(0, 1)]}})
+        ncols, dtype = first.shape[1], first.dtype
+    else:
+        ncols, dtype = X.shape[1], X.dtype
+    return X.map_blocks(
+        block,
+        chunks=(X.chunks[0], (ncols,)),
+        dtype=dtype,
+        meta=np.empty((0, 0), dtype=dtype),
+    )
+
+
+def compute_dtype():
+    """
+    Return the dtype of intermediate arrays of transformations, set with
+    the QUASAR_PRECISION environment variable: float64 (default) or float32,
+    which halves their memory. Tables always store float64.
+    """
+    return np.float32 if os.getenv("QUASAR_PRECISION") == "float32" else np.float64
+
+
 def is_increasing(a):
     return np.all(np.diff(a) >= 0)
 
@@ -66,13 +139,28 @@ class CommonDomain:
     (input domain needs to be the same as it was with training data).
     """
 
+    #: transformed computes rows independently, so they can be computed in
+    #: multiple processes (see transform_rows); used by CommonDomainOrder
+    parallel_rows = False
+
+    #: the result for a row does not depend on other rows, so dask arrays
+    #: and tables are transformed in blocks of rows (see transform_dask_rows
+    #: and transform_in_blocks)
+    rows_independent = True
+
     def __init__(self, domain: Domain):
         self.domain = domain
 
     def __call__(self, data):
         data = self.transform_domain(data)
+        if is_dask_array(data.X):
+            return self.dask_transformed(data)
         return self.transformed(data)
 
+    def dask_transformed(self, data):
+        """Lazily transform data (in self.domain) with a dask X."""
+        return transform_dask_rows(self.transformed, data, self.rows_independent)
+
     def transform_domain(self, data):
         if data.domain != self.domain:
             data = data.from_table(self.domain, data)
@@ -91,37 +179,179 @@ class CommonDomain:
 class CommonDomainRef(CommonDomain):
     """CommonDomain which also ensures reference domain transformation"""
 
+    #: number of interpolated references kept (see interpolated)
+    interpolated_cache_size = 8
+
     def __init__(self, reference: Table, domain: Domain):
         super().__init__(domain)
         self.reference = reference
+        self._init_caches()
+
+    def _init_caches(self):
+        self._interpolated = OrderedDict()
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+    def table_fingerprint(self, table):
+        """
+        Return table_fingerprint of a reference-like table (or weights),
+        which is computed once per table. As with interpolated, tables
+        held by the transformation must not be modified.
+        """
+        if table is None:
+            return None
+        with self._lock:
+            if id(table) in self._fingerprints:
+                return self._fingerprints[id(table)][1]
+        fp = table_fingerprint(table)
+        with self._lock:
+            # tables are kept with fingerprints so that their ids stay valid
+            self._fingerprints[id(table)] = table, fp
+        return fp
+
+    def table_eq(self, table, other, other_table):
+        """Compare a table held by self with one held by other (see table_eq_x)."""
+        return table_eq_x(
+            table, other_table, (self.table_fingerprint, other.table_fingerprint)
+        )
+
+    def interpolated(self, table, wavenumbers, interpolate, *args):
+        """
+        Return interpolate(table, wavenumbers, *args) for a reference-like
+        table (or weights), cached by the table, the target wavenumbers and
+        (hashable) args, so that chunks and repeated transformations on the
+        same axis interpolate it once. Results are shared and read-only.
+        """
+        wavenumbers = np.asarray(wavenumbers)
+        key = (
+            id(table),
+            interpolate,
+            args,
+            wavenumbers.dtype.str,
+            wavenumbers.tobytes(),
+        )
+        with self._lock:
+            if key in self._interpolated:
+                self._interpolated.move_to_end(key)
+                return self._interpolated[key][1]
+        X = np.asarray(interpolate(table, wavenumbers, *args))
+        X.flags.writeable = False
+        with self._lock:
+            # tables are kept with the results so that their ids stay valid
+            self._interpolated[key] = table, X
+            while len(self._interpolated) > self.interpolated_cache_size:
+                self._interpolated.popitem(last=False)
+        return X
 
     def interpolate_extend_to(self, interpolate: Table, wavenumbers):
-        return interpolate_extend_to(interpolate, wavenumbers)
+        return self.interpolated(interpolate, wavenumbers, interpolate_extend_to)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_interpolated", "_fingerprints", "_lock"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_caches()
 
     def __eq__(self, other):
-        return super().__eq__(other) and table_eq_x(self.reference, other.reference)
+        return super().__eq__(other) and self.table_eq(
+            self.reference, other, other.reference
+        )
 
     def __hash__(self):
-        domain = self.reference.domain if self.reference is not None else None
-        fv = subset_for_hash(self.reference.X) if self.reference is not None else None
-        return hash((super().__hash__(), domain, fv))
+        return hash((super().__hash__(), self.table_fingerprint(self.reference)))
 
 
 class CommonDomainOrder(CommonDomain):
-    """CommonDomain + it also handles wavenumber order."""
+    """CommonDomain + it also handles wavenumber order.
+
+    When the input domain is computed by another order-aware transformation
+    (as in chained preprocessors), its output is taken while still sorted,
+    so that the order is restored only once and intermediate tables
+    are not built.
+    """
 
     def __call__(self, data):
+        # the same output can be needed by multiple nested domain conversions,
+        # for example when Integrate adds metas to already computed attributes
+        cache = getattr(_shared_outputs, "cache", None)
+        key = _shared_outputs_key(self, data) if cache is not None else None
+        if key is not None and key in cache:
+            return cache[key][1]
+
+        if is_dask_array(data.X):
+            X = self.dask_transformed(self.transform_domain(data))
+        else:
+            X = self._transformed_table(data)
+        if key is not None:
+            # the input is kept so that its memory is not reused
+            cache[key] = data, X
+        return X
+
+    def dask_transformed(self, data):
+        return transform_dask_rows(self._transformed_table, data, self.rows_independent)
+
+    def _transformed_table(self, data):
+        X, xs, xsind, mon, xc = self._sorted_transformed(data)
+
+        # restore order
+        return self._restore_order(X, mon, xsind, xc)
+
+    def _sorted_input(self, data):
+        """Return data in self.domain ordered by wavenumbers."""
+        previous = self._chained_previous(data)
+        if previous is not None:
+            X, xs, xsind, mon, xc = previous._sorted_transformed(data)
+            return xs, xsind, mon, X[:, :xc]
         data = self.transform_domain(data)
+        return transform_to_sorted_features(data, dtype=compute_dtype())
 
+    def _sorted_transformed(self, data):
         # order X by wavenumbers
-        xs, xsind, mon, X = transform_to_sorted_features(data)
+        xs, xsind, mon, X = self._sorted_input(data)
         xc = X.shape[1]
 
         # do the transformation
-        X = self.transformed(X, xs[xsind])
-
-        # restore order
-        return self._restore_order(X, mon, xsind, xc)
+        X = self._transformed_rows(X, xs[xsind])
+        return X, xs, xsind, mon, xc
+
+    def _transformed_rows(self, X, wavenumbers):
+        if self.parallel_rows:
+            return transform_rows(self.transformed, X, (wavenumbers,))
+        return self.transformed(X, wavenumbers)
+
+    def _chained_previous(self, data):
+        """Return the order-aware transformation that computes all attributes
+        of self.domain, in the same order, from data. Return None if there
+        is no such transformation."""
+        attributes = self.domain.attributes
+        if data.domain == self.domain or not attributes:
+            return None
+        cv = attributes[0].compute_value
+        previous = cv.compute_shared if isinstance(cv, SelectColumn) else None
+        if (
+            not isinstance(previous, CommonDomainOrder)
+            # transformations with their own __call__ can not be chained
+            or type(previous).__call__ is not CommonDomainOrder.__call__
+            or len(previous.domain.attributes) != len(attributes)
+        ):
+            return None
+        for i, (a, pa) in enumerate(
+            zip(attributes, previous.domain.attributes, strict=True)
+        ):
+            cv = a.compute_value
+            if (
+                not isinstance(cv, SelectColumn)
+                or cv.compute_shared is not previous
+                or cv.feature != i
+                or a.name != pa.name
+                or a in data.domain
+            ):
+                return None
+        return previous
 
     def _restore_order(self, X, mon, xsind, xc):
         # restore order and leave additional columns as they are
@@ -145,11 +375,9 @@ class CommonDomainOrderUnknowns(CommonDomainOrder):
     values before computation and afterwards sets them back to unknown.
     """
 
-    def __call__(self, data):
-        data = self.transform_domain(data)
-
+    def _sorted_transformed(self, data):
         # order X by wavenumbers
-        xs, xsind, mon, X = transform_to_sorted_features(data)
+        xs, xsind, mon, X = self._sorted_input(data)
         xc = X.shape[1]
 
         # interpolates unknowns
@@ -165,7 +393,7 @@ class CommonDomainOrderUnknowns(CommonDomainOrder):
             X[remaining_nans] = 1.0
 
         # do the transformation
-        X = self.transformed(X, xs[xsind])
+        X = self._transformed_rows(X, xs[xsind])
 
         # set NaNs where there were NaNs in the original array
         if nans is not None:
@@ -175,8 +403,7 @@ class CommonDomainOrderUnknowns(CommonDomainOrder):
                 nans = np.hstack((nans, np.zeros((X.shape[0], addc), dtype=bool)))
             X[nans] = np.nan
 
-        # restore order
-        return self._restore_order(X, mon, xsind, xc)
+        return X, xs, xsind, mon, xc
 
     def __eq__(self, other):
         # pylint: disable=useless-parent-delegation
@@ -187,23 +414,297 @@ class CommonDomainOrderUnknowns(CommonDomainOrder):
         return super().__hash__()
 
 
-def table_eq_x(first: Optional[Table], second: Optional[Table]):
+_shared_outputs = threading.local()
+
+
+@contextmanager
+def shared_outputs():
+    """
+    Keep outputs of order-aware transformations within the context, so that
+    nested domain conversions of the same data (for example, when Integrate
+    adds metas to already computed attributes) do not compute them again.
+    Outputs are released when the outermost context exits.
+    """
+    if getattr(_shared_outputs, "cache", None) is not None:
+        yield
+        return
+    _shared_outputs.cache = {}
+    try:
+        yield
+    finally:
+        _shared_outputs.cache = None
+
+
+def _shared_outputs_key(transformation, data):
+    # nested conversions get different tables with views into the same X,
+    # so the key is where X is
+    X = data.X
+    if not isinstance(X, np.ndarray):
+        return None
+    return (
+        transformation,
+        data.domain,
+        X.__array_interface__["data"][0],
+        X.shape,
+        X.strides,
+        X.dtype.str,
+    )
+
+
+def deferrable_domain(domain: Domain, source: Domain):
+    """
+    Check whether all variables of the domain are either in the source domain
+    or computed by CommonDomain transformations of the source domain, which
+    depend only on the domain and not on the data they were created with.
+    """
+    for var in domain.variables + domain.metas:
+        if var in source:
+            continue
+        cv = var.compute_value
+        if not (
+            isinstance(cv, SharedComputeValue)
+            and isinstance(cv.compute_shared, CommonDomain)
+            and cv.compute_shared.domain == source
+        ):
+            return False
+    return True
+
+
+def preprocessed_domain(preprocessors, domain: Domain):
+    """
+    Return the domain that preprocessors construct from empty tables, starting
+    with domain, or None if any of them needs data to construct it (see
+    deferrable_domain), so that the domain of their output on data is unknown.
+    """
+    for preprocessor in preprocessors:
+        new = preprocessor(Table.from_domain(domain)).domain
+        if new != domain and not deferrable_domain(new, domain):
+            return None
+        domain = new
+    return domain
+
+
+class DeferredPreprocessing:
+    """
+    Apply preprocessors one after another, but build only the tables that
+    are needed.
+
+    Every preprocessor is first applied to an empty table. If it constructed
+    a new domain of CommonDomain transformations (see deferrable_domain), the
+    data is not transformed yet. The data is transformed once into the final
+    domain, where consecutive order-aware transformations run on the same
+    sorted array. Other preprocessors, which need data (such as PCADenoising)
+    or keep the domain, are applied to the data transformed so far. The final
+    domain is the same as with separate application.
+
+    With block_size, data is transformed in blocks of rows (see
+    transform_in_blocks). Transformations report progress with callback
+    (see result).
+    """
+
+    def __init__(self, data: Table, block_size=None):
+        self.data = data
+        self.domain = data.domain
+        self.block_size = block_size
+
+    def apply(self, preprocessor, callback=None):
+        """Apply the preprocessor. If the data transformed so far is
+        needed, callback is passed to result."""
+        empty = Table.from_domain(self.domain)
+        domain = preprocessor(empty).domain
+        if domain != self.domain and deferrable_domain(domain, self.domain):
+            self.domain = domain
+        else:
+            self.data = preprocessor(self.result(callback=callback))
+            self.domain = self.data.domain
+
+    def result(self, out=None, callback=None):
+        """
+        Return the transformed data. Its X is written into out, if given.
+        Before every block of rows, callback is called with the part of
+        rows done (from 0 to 1); it can interrupt by raising an exception.
+        """
+        if self.data.domain is not self.domain or out is not None:
+            if self.block_size is not None or out is not None:
+                self.data = transform_in_blocks(
+                    self.data,
+                    self.domain,
+                    self.block_size or BLOCK_SIZE,
+                    out,
+                    callback=callback,
+                )
+            else:
+                if callback is not None:
+                    callback(0)
+                with shared_outputs():
+                    self.data = self.data.transform(self.domain)
+        return self.data
+
+
+BLOCK_SIZE = 5000
+
+
+def domain_rows_independent(domain: Domain, source: Domain):
+    """
+    Check whether computed variables of the domain compute every row only
+    from the same row of data in the source domain: the shared
+    transformations they depend on, down to the source domain, all have
+    rows_independent set. Shared transformations without it (unknown
+    ones) are assumed to combine rows; other computed variables are
+    assumed to be row-independent.
+    """
+    seen = set()
+    variables = list(domain.variables + domain.metas)
+    while variables:
+        var = variables.pop()
+        cv = var.compute_value
+        if var in source or cv is None:
+            continue
+        if not isinstance(cv, SharedComputeValue):
+            # such as Orange's transformations of a single variable
+            if isinstance(getattr(cv, "variable", None), Variable):
+                variables.append(cv.variable)
+            continue
+        shared = cv.compute_shared
+        if id(shared) in seen:
+            continue
+        seen.add(id(shared))
+        if not getattr(shared, "rows_independent", False):
+            return False
+        shared_domain = getattr(shared, "domain", None)
+        if shared_domain is not None:
+            variables.extend(shared_domain.variables + shared_domain.metas)
+    return True
+
+
+def transform_in_blocks(
+    data: Table, domain: Domain, block_size=BLOCK_SIZE, out=None, callback=None
+):
+    """
+    Transform data into the domain block by block of rows, so that
+    intermediate results of computed features only exist for a block at a
+    time. If the domain depends on transformations that combine rows (see
+    domain_rows_independent), all rows form a single block, so the results
+    are always the same as with data.transform(domain).
+
+    X of the result is written into out, an array of shape (len(data),
+    len(domain.attributes)), which can also be a numpy.memmap. If out is
+    None, it is allocated.
+
+    If given, callback is called before every block with the part of rows
+    done (from 0 to 1).
+    """
+    if sparse.issparse(data.X) or is_dask_array(data.X):
+        return data.transform(domain)
+    n = len(data)
+    if not domain_rows_independent(domain, data.domain):
+        block_size = max(n, 1)
+    if out is None:
+        out = np.empty((n, len(domain.attributes)))
+    elif out.shape != (n, len(domain.attributes)):
+        raise ValueError("out has a wrong shape")
+    Ys, metas = [], []
+    for start in range(0, max(n, 1), block_size):
+        if callback is not None:
+            callback(start / max(n, 1))
+        with shared_outputs():
+            part = data[start : start + block_size].transform(domain)
+        out[start : start + block_size] = part.X
+        Ys.append(part.Y)
+        metas.append(part.metas)
+    return Table.from_numpy(
+        domain,
+        out,
+        np.concatenate(Ys),
+        np.concatenate(metas),
+        data.W,
+        attributes=deepcopy(data.attributes),
+        ids=data.ids,
+    )
+
+
+def _update_fingerprint(h, part):
+    # type names separate parts, so that different structures differ
+    h.update(type(part).__name__.encode())
+    if isinstance(part, Table):
+        _update_fingerprint(h, part.domain)
+        for a in (part.X, part.Y, part.metas, part.W):
+            _update_fingerprint(h, a)
+    elif isinstance(part, Domain):
+        for v in part.attributes + part.class_vars + part.metas:
+            _update_fingerprint(
+                h, (type(v).__name__, v.name, getattr(v, "values", None))
+            )
+        _update_fingerprint(h, (len(part.attributes), len(part.class_vars)))
+    elif isinstance(part, np.ndarray):
+        h.update(str((part.shape, part.dtype.str)).encode())
+        if part.dtype == object:
+            h.update(pickle.dumps(part.tolist(), protocol=4))
+        else:
+            h.update(np.ascontiguousarray(part).data)
+    elif sparse.issparse(part):
+        part = part.tocsr()
+        for a in (np.array(part.shape), part.data, part.indices, part.indptr):
+            _update_fingerprint(h, a)
+    elif isinstance(part, (list, tuple)):
+        h.update(str(len(part)).encode())
+        for p in part:
+            _update_fingerprint(h, p)
+    elif isinstance(part, dict):
+        _update_fingerprint(h, sorted(part.items(), key=lambda kv: repr(kv[0])))
+    elif isinstance(part, bytes):
+        h.update(str(len(part)).encode())
+        h.update(part)
+    else:
+        r = repr(part).encode()
+        h.update(str(len(r)).encode())
+        h.update(r)
+
+
+def fingerprint(*parts):
+    """
+    Return a hex digest of the full content of parts: tables (domain
+    description and all values, not ids), arrays, sparse matrices,
+    nested lists, tuples and dicts of these, and other objects by repr.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    _update_fingerprint(h, parts)
+    return h.hexdigest()
+
+
+def table_fingerprint(table: Optional[Table]):
+    """
+    Return a fingerprint of what transformations use from reference-like
+    tables: the attributes and X. Missing values compare as equal.
+    """
+    if table is None:
+        return None
+    X = table.X
+    if not sparse.issparse(X):
+        # values that compare as equal (NaNs with any payload, -0.0 and 0.0,
+        # different float types) must also have equal bytes
+        X = np.asarray(X, dtype=np.float64)
+        X = np.where(np.isnan(X), np.nan, X + 0.0)
+    return fingerprint([(type(a).__name__, a.name) for a in table.domain.attributes], X)
+
+
+def table_eq_x(first: Optional[Table], second: Optional[Table], fingerprints=None):
+    """
+    Compare attributes and X of tables. Missing values compare as equal.
+    With fingerprints, a pair of functions that return (memoized)
+    table_fingerprint of the first and the second table, X is compared
+    by fingerprints.
+    """
     if first is second:
         return True
     elif first is None or second is None:
         return False
+    elif first.domain.attributes != second.domain.attributes:
+        return False
+    elif fingerprints is not None:
+        return fingerprints[0](first) == fingerprints[1](second)
     else:
-        return first.domain.attributes == second.domain.attributes and np.array_equal(
-            first.X, second.X
-        )
-
-
-def subset_for_hash(array, size=10):
-    if array is None:
-        return tuple()
-    else:
-        vals = list(array.ravel()[:size])
-        return tuple(v if not math.isnan(v) else None for v in vals)
+        return np.array_equal(first.X, second.X, equal_nan=True)
 
 
 def nan_extend_edges_and_interpolate(xs, X):
@@ -215,21 +716,39 @@ def nan_extend_edges_and_interpolate(xs, X):
     nans = None
     if np.any(np.isnan(X)):
         nans = np.isnan(X)
+        dtype = X.dtype
         xs, xsind, mon, X = transform_to_sorted_wavenumbers(xs, X)
         X = interp1d_with_unknowns_numpy(xs[xsind], X, xs[xsind], sides=None)
+        X = X.astype(dtype, copy=False)
         X = transform_back_to_features(xsind, mon, X)
     return X, nans
 
 
-def transform_to_sorted_features(data):
+def transform_to_sorted_features(data, dtype=None):
     xs = getx(data)
-    return transform_to_sorted_wavenumbers(xs, data.X)
+    return transform_to_sorted_wavenumbers(xs, data.X, dtype=dtype)
 
 
-def transform_to_sorted_wavenumbers(xs, X):
+def transform_to_sorted_wavenumbers(xs, X, dtype=None):
+    """
+    Return X with columns sorted by wavenumbers xs (a view if they were
+    sorted and X has the dtype). If dtype is given, X is converted while
+    sorting.
+    """
     xsind = np.argsort(xs)
     mon = is_increasing(xsind)
-    X = X if mon else X[:, xsind]
+    if dtype is not None and isinstance(X, np.ndarray) and X.dtype != dtype:
+        if mon:
+            X = X.astype(dtype)
+        else:
+            # sort in blocks of rows, so that a sorted copy in the original
+            # dtype is not needed
+            out = np.empty(X.shape, dtype)
+            for start in range(0, len(X), BLOCK_SIZE):
+                out[start : start + BLOCK_SIZE] = X[start : start + BLOCK_SIZE, xsind]
+            X = out
+    elif not mon:
+        X = X[:, xsind]
     return xs, xsind, mon, X
 
 
@@ -270,51 +789,189 @@ def remove_whole_nan_ys(x, ys):
     return x, ys
 
 
+def nan_mask_groups(nans):
+    """
+    Group rows by their pattern of unknown values. Yield pairs of row
+    indices and masks of known columns, one for each distinct pattern.
+    """
+    if not nans.any():
+        yield np.arange(len(nans)), np.ones(nans.shape[1], dtype=bool)
+        return
+    packed = np.ascontiguousarray(np.packbits(nans, axis=1))
+    keys = packed.view(np.dtype((np.void, packed.shape[1])))[:, 0]
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.cumsum(np.bincount(inverse))[:-1]
+    for row, rows in zip(first, np.split(order, bounds), strict=True):
+        yield rows, ~nans[row]
+
+
+def interp_rows(xp, fp, points, sides=np.nan):
+    """
+    np.interp(points, xp, fp[i], left=sides, right=sides) for all rows i
+    of fp at once. xp needs to be sorted and fp without unknowns.
+    """
+    points = np.asarray(points, dtype=float)
+    lo = np.clip(np.searchsorted(xp, points, side="right") - 1, 0, len(xp) - 1)
+    hi = np.minimum(lo + 1, len(xp) - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        w = np.where(hi > lo, (points - xp[lo]) / (xp[hi] - xp[lo]), 0)
+    out = np.take(fp, lo, axis=1)
+    upper = np.take(fp, hi, axis=1)
+    upper -= out
+    upper *= w
+    out += upper
+    if sides is None:
+        left, right = fp[:, :1], fp[:, -1:]
+    else:
+        left = right = sides
+    out[:, points < xp[0]] = left
+    out[:, points > xp[-1]] = right
+    out[:, np.isnan(points)] = np.nan
+    return out
+
+
+def _interp_with_unknowns(x, ys, points, interp):
+    """
+    Interpolate rows of ys with interp(xp, fp), which interpolates all rows
+    of fp to points. Unknown values are removed: rows with the same unknowns
+    are interpolated together, rows without any known values stay unknown.
+    """
+    if len(x) == 0:
+        return np.full((len(ys), len(points)), np.nan)
+    out = full_like_type(ys, (len(ys), len(points)), np.nan)
+    sorti = None if is_increasing(x) else np.argsort(x)
+    xs = np.sort(x)
+    for start in range(0, len(ys), BLOCK_SIZE):
+        # the next line ensures numpy arrays
+        block = np.asarray(ys[start : start + BLOCK_SIZE])
+        if sorti is not None:
+            block = block[:, sorti]
+        nans = np.isnan(block)
+        if not nans.any() and len(xs):
+            res = interp(xs, block)
+        else:
+            res = np.full((len(block), len(points)), np.nan)
+            for rows, known in nan_mask_groups(nans):
+                if known.all():
+                    res[rows] = interp(xs, block[rows])
+                elif known.any():  # check if all values are removed
+                    res[rows] = interp(xs[known], block[np.ix_(rows, known)])
+        out[start : start + len(block)] = res
+    return out
+
+
 def interp1d_with_unknowns_numpy(x, ys, points, kind="linear", sides=np.nan):
     if kind != "linear":
         raise NotImplementedError
-    out = full_like_type(ys, (len(ys), len(points)), np.nan)
-    sorti = np.argsort(x)
-    x = x[sorti]
-    for i, y in enumerate(ys):
-        # the next line ensures numpy arrays
-        # for Dask, it would be much more efficient to work with larger sections
-        y = np.array(y[sorti])
-        nan = np.isnan(y)
-        xt = x[~nan]
-        yt = y[~nan]
+
+    def interp(xp, fp):
         # do not interpolate unknowns at the edges
-        if len(xt):  # check if all values are removed
-            out[i] = np.interp(points, xt, yt, left=sides, right=sides)
-    return out
+        return interp_rows(xp, fp, points, sides=sides)
+
+    return _interp_with_unknowns(x, ys, points, interp)
 
 
 def interp1d_with_unknowns_scipy(x, ys, points, kind="linear"):
-    out = full_like_type(ys, (len(ys), len(points)), np.nan)
-    sorti = np.argsort(x)
-    x = x[sorti]
-    for i, y in enumerate(ys):
-        y = y[sorti]
-        nan = np.isnan(y)
-        xt = x[~nan]
-        yt = y[~nan]
-        if len(xt):  # check if all values are removed
-            out[i] = interp1d(
-                xt,
-                yt,
-                fill_value=np.nan,
-                assume_sorted=True,
-                bounds_error=False,
-                kind=kind,
-                copy=False,
-            )(points)
-    return out
+    def interp(xp, fp):
+        return interp1d(
+            xp,
+            fp,
+            fill_value=np.nan,
+            assume_sorted=True,
+            bounds_error=False,
+            kind=kind,
+            copy=False,
+        )(points)
+
+    return _interp_with_unknowns(x, ys, points, interp)
 
 
 def interp1d_wo_unknowns_scipy(x, ys, points, kind="linear"):
     return interp1d(x, ys, fill_value=np.nan, kind=kind, bounds_error=False)(points)
 
 
+def interpolation_operator(x, points, kind="linear"):
+    """
+    Return a sparse matrix M and a mask of points outside of x, so that
+    (M @ ys.T).T, with outside points unknown, equals
+    interp1d_wo_unknowns_scipy(x, ys, points, kind).
+
+    Only kinds where every point depends on at most two values (linear,
+    slinear, nearest, nearest-up, previous and next) give sparse operators;
+    their weights are found as in interp1d. For other kinds None is returned.
+    Operators are cached by x, points and kind, so that data on the same
+    grid reuses them.
+    """
+    x = np.asarray(x, dtype=float)
+    points = np.asarray(points, dtype=float)
+    return _interpolation_operator(x.tobytes(), points.tobytes(), kind)
+
+
+#: kinds of interp1d for which interpolation_operator gives operators
+SPARSE_INTERPOLATION_KINDS = (
+    "linear",
+    "slinear",
+    "nearest",
+    "nearest-up",
+    "previous",
+    "next",
+)
+
+
+@lru_cache(maxsize=16)
+def _interpolation_operator(x, points, kind):
+    x = np.frombuffer(x)
+    points = np.frombuffer(points)
+    n = len(x)
+    if kind not in SPARSE_INTERPOLATION_KINDS or n < 2 or np.isnan(x).any():
+        return None
+    order = np.argsort(x, kind="mergesort")
+    xs = x[order]
+    if kind == "slinear" and np.any(xs[1:] == xs[:-1]):
+        return None  # interp1d raises an error
+    outside = np.isnan(points) | (points < xs[0]) | (points > xs[-1])
+    rows = np.flatnonzero(~outside)
+    p = points[rows]
+    if kind in ("linear", "slinear"):
+        hi = np.clip(np.searchsorted(xs, p), 1, n - 1)
+        lo = hi - 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (p - xs[lo]) / (xs[hi] - xs[lo])
+        rows = np.concatenate((rows, rows))
+        columns = np.concatenate((lo, hi))
+        weights = np.concatenate((1 - t, t))
+    else:
+        if kind in ("nearest", "nearest-up"):
+            bounds = xs / 2.0
+            bounds = bounds[1:] + bounds[:-1]
+            side = "left" if kind == "nearest" else "right"
+            columns = np.clip(np.searchsorted(bounds, p, side=side), 0, n - 1)
+        elif kind == "previous":
+            shifted = np.nextafter(xs, -np.inf)
+            columns = np.clip(np.searchsorted(shifted, p, side="left"), 1, n) - 1
+        else:  # next
+            shifted = np.nextafter(xs, np.inf)
+            columns = np.clip(np.searchsorted(shifted, p, side="right"), 0, n - 1)
+        weights = np.ones(len(rows))
+    M = sparse.csr_matrix((weights, (rows, order[columns])), shape=(len(points), n))
+    M.eliminate_zeros()
+    return M, outside
+
+
+def interp1d_wo_unknowns_operator(x, ys, points, kind="linear"):
+    """interp1d_wo_unknowns_scipy with a cached interpolation_operator"""
+    operator = None
+    if isinstance(ys, np.ndarray) and not np.isnan(ys).any():
+        operator = interpolation_operator(x, points, kind)
+    if operator is None:
+        return interp1d_wo_unknowns_scipy(x, ys, points, kind=kind)
+    M, outside = operator
+    out = np.ascontiguousarray((M @ ys.T).T)
+    out[:, outside] = np.nan
+    return out
+
+
 def edge_baseline(x, y):
     """Baseline from edges. Assumes data without NaNs"""
     return linear_baseline(x, y, zero_points=[x[0], x[-1]]) if len(x) else 0
@@ -1,9 +1,11 @@
 import unittest
+from unittest.mock import patch
 
 import numpy as np
 
 from Orange.data import Table
 from orangecontrib.spectroscopy.preprocess.als import ALSP, ARPLS, AIRPLS
+from orangecontrib.spectroscopy.preprocess.als import baseline, banded
 from orangecontrib.spectroscopy.tests.test_preprocess import (
     TestCommonIndpSamplesMixin,
     SMALLER_COLLAGEN,
@@ -46,3 +48,49 @@ class TestAls(unittest.TestCase, TestCommonIndpSamplesMixin):
             [[-1.15248, -0.155994, 7.83538, 2.82675], [-0.499999, 1.5, 5.5, 0.499999]],
         )
         np.testing.assert_almost_equal(np.array(check), np.array(process), 2)
+
+
+class TestBanded(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.RandomState(0)
+        x = np.linspace(0, 10, 200)
+        cls.Y = (
+            np.sin(x) * rng.rand(12, 1)
+            + np.exp(-((x - 5) ** 2)) * rng.rand(12, 1) * 3
+            + rng.normal(0, 0.05, (12, len(x)))
+        )
+
+    def assert_same_as_rowwise(self, fn_block, fn, **kwargs):
+        expected = np.array([fn(y, **kwargs) for y in self.Y])
+        np.testing.assert_allclose(fn_block(self.Y, **kwargs), expected, atol=1e-9)
+        with patch.object(banded, "VECTORIZED_SOLVE_MIN_ROWS", 1):
+            np.testing.assert_allclose(fn_block(self.Y, **kwargs), expected, atol=1e-9)
+
+    def test_als(self):
+        self.assert_same_as_rowwise(
+            banded.als_block, baseline.als, lam=1e5, p=0.1, itermax=10
+        )
+
+    def test_arpls(self):
+        self.assert_same_as_rowwise(
+            banded.arpls_block, baseline.arpls, lam=1e5, ratio=0.05, itermax=20
+        )
+
+    def test_airpls(self):
+        for porder in [1, 2]:
+            self.assert_same_as_rowwise(
+                banded.airpls_block,
+                baseline.airpls,
+                lam=100,
+                porder=porder,
+                itermax=15,
+            )
+
+    def test_difference_penalty(self):
+        for n, differences in [(7, 1), (7, 2), (7, 3), (2, 2)]:
+            D = np.diff(np.eye(n), differences, axis=0)
+            P = D.T @ D
+            ab = banded.difference_penalty(n, differences)
+            for k in range(min(differences + 1, n)):
+                np.testing.assert_equal(ab[differences - k, k:], np.diag(P, k))
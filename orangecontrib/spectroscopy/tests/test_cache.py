@@ -0,0 +1,171 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from Orange.data import Domain, StringVariable, Table
+
+from orangecontrib.spectroscopy.preprocess import (
+    Cut,
+    Integrate,
+    PCADenoising,
+    SavitzkyGolayFiltering,
+)
+from orangecontrib.spectroscopy.preprocess.cache import ResultCache, result_cache
+from orangecontrib.spectroscopy.preprocess.utils import (
+    fingerprint,
+    preprocessed_domain,
+)
+from orangecontrib.spectroscopy.tests.test_preprocess import SMALL_COLLAGEN
+
+
+class TestFingerprint(unittest.TestCase):
+    def test_deterministic(self):
+        data = SMALL_COLLAGEN
+        self.assertEqual(fingerprint(data), fingerprint(data.copy()))
+        self.assertEqual(fingerprint(data, {"a": 1}), fingerprint(data, {"a": 1}))
+
+    def test_sensitive(self):
+        data = SMALL_COLLAGEN
+        changed = data.copy()
+        with changed.unlocked():
+            changed.X[3, 5] += 1e-12
+        self.assertNotEqual(fingerprint(data), fingerprint(changed))
+        self.assertNotEqual(fingerprint(data), fingerprint(data[:-1]))
+        self.assertNotEqual(fingerprint(data, 1), fingerprint(data, 2))
+        self.assertNotEqual(fingerprint(data.X), fingerprint(data.X.astype(np.float32)))
+        self.assertNotEqual(fingerprint([1, 2], 3), fingerprint([1], 2, 3))
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.tmpdir.name, 10 * 1024**2)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def files(self):
+        return sorted(os.listdir(self.tmpdir.name))
+
+    def test_roundtrip(self):
+        data = SMALL_COLLAGEN
+        preprocessors = [
+            Cut(lowlim=1000, highlim=1500),
+            SavitzkyGolayFiltering(window=5),
+            Integrate(limits=[[1100, 1200]], metas=True),
+        ]
+        result = data
+        for pp in preprocessors:
+            result = pp(result)
+        domain = preprocessed_domain(preprocessors, data.domain)
+        key = self.cache.key(data, "sg")
+        self.assertIsNone(self.cache.get(key, data, domain))
+        self.cache.put(key, result, data)
+        loaded = self.cache.get(key, data, domain)
+        self.assertIs(loaded.domain, domain)
+        self.assertEqual(loaded.domain, result.domain)
+        self.assertEqual(loaded.name, result.name)
+        np.testing.assert_equal(loaded.X, result.X)
+        np.testing.assert_equal(loaded.Y, result.Y)
+        np.testing.assert_equal(loaded.metas, result.metas)
+        np.testing.assert_equal(loaded.ids, data.ids)
+        # files do not need pickle
+        (fn,) = self.files()
+        with np.load(os.path.join(self.tmpdir.name, fn), allow_pickle=False) as f:
+            for name in f.files:
+                self.assertNotEqual(f[name].dtype, object)
+
+    def test_string_metas(self):
+        data = SMALL_COLLAGEN[:5]
+        domain = Domain(
+            data.domain.attributes, data.domain.class_vars, [StringVariable("s")]
+        )
+        data = Table.from_numpy(
+            domain, data.X, data.Y, np.array([["a"], ["b"], ["c"], ["d"], ["e"]])
+        )
+        result = Integrate(limits=[[1100, 1200]], metas=True)(data)
+        key = self.cache.key(data)
+        self.cache.put(key, result, data)
+        loaded = self.cache.get(key, data, result.domain)
+        np.testing.assert_equal(loaded.metas, result.metas)
+
+    def test_other_domain_is_miss(self):
+        data = SMALL_COLLAGEN
+        result = Cut(lowlim=1000, highlim=1500)(data)
+        key = self.cache.key(data)
+        self.cache.put(key, result, data)
+        self.assertIsNone(self.cache.get(key, data, data.domain))
+        self.assertEqual(self.files(), [])
+
+    def test_preprocessed_domain(self):
+        data = SMALL_COLLAGEN
+        cut = Cut(lowlim=1000, highlim=1500)
+        self.assertEqual(preprocessed_domain([cut], data.domain), cut(data).domain)
+        # PCA is fitted on data
+        self.assertIsNone(
+            preprocessed_domain([cut, PCADenoising(components=2)], data.domain)
+        )
+
+    def test_ids_from_input(self):
+        data = SMALL_COLLAGEN
+        key = self.cache.key(data)
+        self.cache.put(key, data, data)
+        other = data.copy()
+        other.ids = other.ids + 1000
+        np.testing.assert_equal(self.cache.get(key, other, data.domain).ids, other.ids)
+
+    def test_corrupt_is_miss(self):
+        data = SMALL_COLLAGEN
+        key = self.cache.key(data)
+        self.cache.put(key, data, data)
+        (fn,) = self.files()
+        with open(os.path.join(self.tmpdir.name, fn), "wb") as f:
+            f.write(b"garbage")
+        self.assertIsNone(self.cache.get(key, data, data.domain))
+        self.assertEqual(self.files(), [])
+
+    def test_evict_least_recently_used(self):
+        data = SMALL_COLLAGEN
+        keys = [self.cache.key(data, i) for i in range(3)]
+        self.cache.put(keys[0], data, data)
+        size = os.path.getsize(os.path.join(self.tmpdir.name, self.files()[0]))
+        self.cache.maxsize = int(size * 2.5)
+        self.cache.put(keys[1], data, data)
+        # make the first one more recently used than the second
+        t = os.path.getmtime(self.cache._filename(keys[1]))
+        for k, dt in ((keys[0], 10), (keys[1], 20)):
+            os.utime(self.cache._filename(k), (t - dt, t - dt))
+        self.cache.put(keys[2], data, data)
+        self.assertIsNotNone(self.cache.get(keys[0], data, data.domain))
+        self.assertIsNone(self.cache.get(keys[1], data, data.domain))
+        self.assertIsNotNone(self.cache.get(keys[2], data, data.domain))
+
+    def test_key_precision(self):
+        data = SMALL_COLLAGEN
+        keys = []
+        for precision in ["float64", "float32"]:
+            with patch.dict(os.environ, {"QUASAR_PRECISION": precision}):
+                keys.append(self.cache.key(data))
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_result_cache_environment(self):
+        with patch.dict(os.environ, {"QUASAR_PREPROCESS_CACHE_SIZE": ""}):
+            self.assertIsNone(result_cache())
+        for size in ["0", "-1", "abc", "nan", "inf"]:
+            with patch.dict(os.environ, {"QUASAR_PREPROCESS_CACHE_SIZE": size}):
+                self.assertIsNone(result_cache())
+        env = {
+            "QUASAR_PREPROCESS_CACHE_SIZE": "2",
+            "QUASAR_PREPROCESS_CACHE_DIR": self.tmpdir.name,
+        }
+        with patch.dict(os.environ, env):
+            cache = result_cache()
+            self.assertEqual(cache.directory, self.tmpdir.name)
+            self.assertEqual(cache.maxsize, 2 * 1024**2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,6 +6,7 @@ from orangecontrib.spectroscopy.data import getx
 from orangecontrib.spectroscopy.tests.test_preprocess import (
     TestCommonIndpSamplesMixin,
     SMALL_COLLAGEN,
+    shuffle_attr,
 )
 
 
@@ -58,3 +59,20 @@ class TestCut(unittest.TestCase, TestCommonIndpSamplesMixin):
         dcut = Cut(highlim=1000, inverse=True)(d)
         self.assertGreaterEqual(min(getx(dcut)), 1000)
         self.assertEqual(max(getx(dcut)), max(getx(d)))
+
+    def test_contiguous_view(self):
+        d = self.collagen
+        for cut in (Cut(lowlim=1000, highlim=1100), Cut(lowlim=1000)):
+            dcut = cut(d)
+            self.assertTrue(np.shares_memory(dcut.X, d.X))
+            np.testing.assert_equal(dcut.X, d[:, dcut.domain.attributes].X)
+
+    def test_unordered(self):
+        d = shuffle_attr(SMALL_COLLAGEN)
+        for cut in (Cut(lowlim=1000, highlim=1100), Cut(lowlim=1000, inverse=True)):
+            dcut = cut(d)
+            expected = cut(SMALL_COLLAGEN)
+            self.assertEqual(
+                set(dcut.domain.attributes), set(expected.domain.attributes)
+            )
+            np.testing.assert_equal(dcut.transform(expected.domain).X, expected.X)
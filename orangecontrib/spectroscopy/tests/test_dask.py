@@ -0,0 +1,110 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from orangecontrib.spectroscopy.preprocess import (
+    Integrate,
+    Interpolate,
+    MNFDenoising,
+    SavitzkyGolayFiltering,
+)
+from orangecontrib.spectroscopy.preprocess.utils import (
+    compute_dask,
+    is_dask_array,
+)
+from orangecontrib.spectroscopy.tests.test_preprocess import SMALL_COLLAGEN
+from orangecontrib.spectroscopy.widgets.preprocessors.registry import preprocess_editors
+from orangecontrib.spectroscopy.widgets.preprocessors.utils import REFERENCE_DATA_PARAM
+
+try:
+    import dask
+    import dask.distributed
+except ImportError:
+    dask = None
+
+try:
+    from Orange.tests.test_dasktable import temp_dasktable
+except ImportError:
+    temp_dasktable = None
+
+
+def preprocessors(reference):
+    """Preprocessors of all editors with default parameters."""
+    for editor in preprocess_editors.sorted():
+        yield editor.createinstance({REFERENCE_DATA_PARAM: reference})
+
+
+def computed(X):
+    return compute_dask(X) if is_dask_array(X) else X
+
+
+@unittest.skipUnless(dask, "dask is not installed")
+@unittest.skipUnless(temp_dasktable, "installed Orange does not support dask")
+class TestDask(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        data = SMALL_COLLAGEN.copy()
+        with data.unlocked():
+            data.X[0, :3] = np.nan
+            data.X[1, 10:15] = np.nan
+        cls.data = data
+        cls.dask_data = temp_dasktable(data)
+        # computations go through a client, which serializes task graphs
+        cls.client = dask.distributed.Client(
+            processes=False, n_workers=1, set_as_default=False, dashboard_address=None
+        )
+        cls.patcher = patch(
+            "orangecontrib.spectroscopy.preprocess.utils.dask_client", cls.client
+        )
+        cls.patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.patcher.stop()
+        cls.client.close()
+
+    def assert_same(self, pp):
+        try:
+            expected = pp(self.data)
+        except Exception as ex:  # pylint: disable=broad-except
+            # some (such as XAS) do not work on this data
+            with self.assertRaises(type(ex)):
+                computed(pp(self.dask_data).X)
+            return
+        result = pp(self.dask_data)
+        self.assertEqual(result.domain, expected.domain)
+        np.testing.assert_allclose(computed(result.X), expected.X, rtol=1e-7)
+
+    def test_all_preprocessors(self):
+        for pp in preprocessors(self.data[:1]):
+            with self.subTest(pp=pp):
+                self.assert_same(pp)
+
+    def test_row_dependent(self):
+        self.assert_same(MNFDenoising(components=3))
+
+    def test_lazy_chain(self):
+        pp = [
+            SavitzkyGolayFiltering(window=9, polyorder=2, deriv=1),
+            Interpolate(np.linspace(1000, 1700, 100)),
+            Integrate(methods=Integrate.Baseline, limits=[[1100, 1200]]),
+        ]
+        data, expected = self.dask_data, self.data
+        with patch(
+            "orangecontrib.spectroscopy.preprocess.utils.compute_dask",
+            wraps=compute_dask,
+        ) as compute:
+            for p in pp:
+                data, expected = p(data), p(expected)
+        # building the chain does not compute blocks of transformations
+        for (array,), _ in compute.call_args_list:
+            self.assertFalse(
+                any(name.startswith("block-") for name in array.dask.layers)
+            )
+        self.assertTrue(is_dask_array(data.X))
+        np.testing.assert_allclose(computed(data.X), expected.X, rtol=1e-7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -102,3 +102,22 @@ class TestSpikeRemoval(unittest.TestCase, TestCommonIndpSamplesMixin):
         changed = method(data)
         check = np.array(data)
         np.testing.assert_almost_equal(changed, check)
+
+    def test_nearest(self):
+        """Spikes without valid points within distance take the nearest value."""
+        data = Table.from_numpy(
+            None,
+            [
+                [1, 2, 1, 2, 1, 1000, 1000, 1000, 1000, 1000, 2, 1, 2, 1, 2, 1],
+                [1, 2, 1, 2, 1, 1000, 1000, 1000, 1000, 2, 1, 2, 1, 2, 1, 2],
+                [1, 2, 1, 2, 1, 2, 1, 2, 1, 2, 1, 2, 1, 2, 1, 2],
+            ],
+        )
+        method = Despike(threshold=7, cutoff=100, dis=1)
+        process = method(data).X
+        np.testing.assert_equal(process[0, 4:11], [1, 1, 1, 1.5, 2, 2, 2])
+        np.testing.assert_equal(process[1, 4:10], [1, 1, 1, 2, 2, 2])
+        np.testing.assert_equal(process[2], data.X[2])
+        # rows are processed independently
+        for i in range(len(data)):
+            np.testing.assert_equal(method(data[i : i + 1]).X[0], process[i])
@@ -7,6 +7,7 @@ from Orange.data import Table
 from orangecontrib.spectroscopy.preprocess.emsc import (
     EMSC,
     MissingReferenceException,
+    emsc_correct,
     SelectionFunction,
     SmoothedSelectionFunction,
 )
@@ -270,6 +271,20 @@ class TestEMSC(unittest.TestCase, TestCommonIndpSamplesMixin):
         self.assertNotEqual(d3.domain, d2.domain)
         self.assertNotEqual(hash(d3.domain), hash(d2.domain))
 
+    def test_emsc_correct_rowwise(self):
+        rng = np.random.RandomState(0)
+        M = rng.rand(20, 4)
+        M_weighted = M * rng.rand(20, 1)
+        X = rng.rand(7, 20)
+        out = emsc_correct(M, M_weighted, X, 3)
+        for row, res in zip(X, out, strict=True):
+            m = np.linalg.lstsq(M_weighted, row, rcond=-1)[0]
+            corrected = (row - M[:, :3] @ m[:3]) / m[3]
+            np.testing.assert_almost_equal(res, np.hstack((corrected, m)))
+        out = emsc_correct(M, M_weighted, X, 3, scaling=False)
+        np.testing.assert_almost_equal(out[:, :20] + out[:, 20:23] @ M[:, :3].T, X)
+        self.assertEqual(emsc_correct(M, M_weighted, X[:0], 3).shape, (0, 24))
+
 
 class TestSelectionFuctions(unittest.TestCase):
     def test_no_smoothing(self):
@@ -1,12 +1,15 @@
 import unittest
 
-from Orange.data import Table
+from Orange.data import ContinuousVariable, Domain, Table
 import numpy as np
 
 from orangecontrib.spectroscopy.preprocess import Integrate
+from orangecontrib.spectroscopy.preprocess.integrate import IntegralIndex
 from orangecontrib.spectroscopy.tests.test_preprocess import (
     TestCommonIndpSamplesMixin,
     SMALL_COLLAGEN,
+    reverse_attr,
+    shuffle_attr,
 )
 
 
@@ -223,3 +226,65 @@ class TestIntegrate(unittest.TestCase, TestCommonIndpSamplesMixin):
         data3 = Table.from_numpy(None, [[1, 2, 3, 22, 1, 2]])
         iii1 = Integrate(methods=Integrate.Simple, limits=[[0, 5]])(data3)
         self.assertEqual(i1.domain[0], iii1.domain[0])
+
+    def test_shared_sorted_data(self):
+        domain = Domain([ContinuousVariable(str(w)) for w in range(6)])
+        data = Table.from_numpy(domain, [[1, 2, 3, 1, 1, 1], [3, 2, 1, 1, 2, 3]])
+        i = Integrate(
+            methods=[Integrate.Simple, Integrate.PeakMax, Integrate.PeakAt],
+            limits=[[1, 3], [0, 4], [2]],
+        )(data)
+        reversed_data = reverse_attr(data)
+        common = i.domain[0].compute_value.compute_shared(data)
+        X, x = common
+        np.testing.assert_equal(x, [0, 1, 2, 3, 4, 5])
+        # features use windows of the same matrix
+        for a in i.domain.attributes:
+            self.assertTrue(
+                np.shares_memory(a.compute_value.extract_data(data, common)[1], X)
+            )
+        ir = Integrate(
+            methods=[Integrate.Simple, Integrate.PeakMax, Integrate.PeakAt],
+            limits=[[1, 3], [0, 4], [2]],
+        )(reversed_data)
+        np.testing.assert_equal(ir.X, i.X)
+
+
+class TestIntegralIndex(unittest.TestCase):
+    def test_same_as_integrate(self):
+        data = shuffle_attr(SMALL_COLLAGEN).copy()
+        with data.unlocked():
+            data.X[0, 5] = np.nan
+            data.X[3, :] = np.nan
+        index = IntegralIndex(data)
+        limits = [
+            [1000, 1500, 900, 1600],
+            [1200, 1100, 1150, 1300],
+            [1200.5, 1201, 1000, 1000.4],
+            [0, 10, 2, 3],
+            [1100, 1100, 1000, 1200],
+        ]
+        for method in Integrate.INTEGRALS:
+            for lim in limits:
+                if method is not Integrate.Separate:
+                    lim = lim[:2]
+                with self.subTest(method=method.name, limits=lim):
+                    integrate = Integrate(methods=method, limits=[lim])
+                    np.testing.assert_allclose(
+                        index.compute(integrate), integrate(data).X, atol=1e-9
+                    )
+
+    def test_metas(self):
+        data = SMALL_COLLAGEN
+        integrate = Integrate(limits=[[1100, 1200], [1200, 1300]], metas=True)
+        np.testing.assert_allclose(
+            IntegralIndex(data).compute(integrate),
+            integrate(data).metas[:, -2:].astype(float),
+        )
+
+    def test_no_attributes(self):
+        data = Table.from_numpy(Domain([]), X=np.zeros((2, 0)))
+        integrate = Integrate(limits=[[1, 2]])
+        np.testing.assert_equal(
+            IntegralIndex(data).compute(integrate), integrate(data).X
+        )
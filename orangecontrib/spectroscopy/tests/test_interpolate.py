@@ -15,10 +15,12 @@ from orangecontrib.spectroscopy.preprocess import (
     interp1d_with_unknowns_numpy,
     interp1d_with_unknowns_scipy,
     interp1d_wo_unknowns_scipy,
+    interp1d_wo_unknowns_operator,
     InterpolateToDomain,
     NotAllContinuousException,
     nan_extend_edges_and_interpolate,
 )
+from orangecontrib.spectroscopy.preprocess.utils import interpolation_operator
 from orangecontrib.spectroscopy.data import getx
 from orangecontrib.spectroscopy.tests.util import spectra_table
 from orangecontrib.spectroscopy.tests.test_preprocess import (
@@ -201,6 +203,87 @@ class TestInterpolate(unittest.TestCase, TestCommonIndpSamplesMixin):
         v, n = nan_extend_edges_and_interpolate(xsm, ysm)
         np.testing.assert_equal(v[:, mix], exp)
 
+    def test_same_as_rowwise(self):
+        rng = np.random.default_rng(0)
+        xs = rng.permutation(np.linspace(0, 100, 30))
+        ys = rng.random((50, 30))
+        ys[rng.random(ys.shape) < 0.1] = np.nan
+        ys[:10, :3] = np.nan  # a shared pattern
+        ys[10] = np.nan
+        ys[11, 1:] = np.nan
+        points = np.r_[-5, np.linspace(0, 100, 47), 120]
+        sorti = np.argsort(xs)
+        for sides in [None, 0.5, np.nan]:
+            expected = np.full((len(ys), len(points)), np.nan)
+            for i, y in enumerate(ys[:, sorti]):
+                known = ~np.isnan(y)
+                if known.any():
+                    expected[i] = np.interp(
+                        points, xs[sorti][known], y[known], left=sides, right=sides
+                    )
+            interpolated = interp1d_with_unknowns_numpy(xs, ys, points, sides=sides)
+            np.testing.assert_allclose(interpolated, expected)
+        # expected has unknown sides
+        interpolated = interp1d_with_unknowns_scipy(xs, ys, points)
+        np.testing.assert_allclose(interpolated, expected)
+
+    def test_no_values(self):
+        ys = np.zeros((3, 0))
+        points = [1.0, 2.0]
+        expected = np.full((3, 2), np.nan)
+        np.testing.assert_equal(
+            interp1d_with_unknowns_numpy(np.array([]), ys, points), expected
+        )
+        np.testing.assert_equal(
+            interp1d_with_unknowns_scipy(np.array([]), ys, points), expected
+        )
+
+    def test_interpolation_operator(self):
+        rng = np.random.default_rng(0)
+        xs = rng.permutation(np.linspace(0, 100, 30))
+        ys = rng.random((20, 30))
+        points = np.r_[-5, np.linspace(0, 100, 47), 120, np.nan]
+        kinds = ["linear", "nearest", "nearest-up", "slinear", "previous", "next"]
+        for kind in kinds:
+            with self.subTest(kind=kind):
+                M, outside = interpolation_operator(xs, points, kind)
+                self.assertLessEqual(M.nnz, 2 * len(points))
+                np.testing.assert_equal(
+                    outside, np.isnan(points) | (points < 0) | (points > 100)
+                )
+                interpolated = interp1d_wo_unknowns_operator(xs, ys, points, kind)
+                expected = interp1d_wo_unknowns_scipy(xs, ys, points[:-1], kind)
+                np.testing.assert_allclose(interpolated[:, :-1], expected)
+        # cached for the same grid
+        self.assertIs(
+            interpolation_operator(xs.copy(), points.copy()),
+            interpolation_operator(xs, points),
+        )
+        # spline operators are dense
+        self.assertIsNone(interpolation_operator(xs, points, "cubic"))
+        interpolated = interp1d_wo_unknowns_operator(xs, ys, points[:-1], "cubic")
+        expected = interp1d_wo_unknowns_scipy(xs, ys, points[:-1], "cubic")
+        np.testing.assert_equal(interpolated, expected)
+
+    def test_interpolation_operator_duplicates(self):
+        xs = np.array([3.0, 0, 1, 1, 2])
+        ys = np.arange(10.0).reshape(2, 5)
+        points = np.array([0, 0.5, 1, 1.5, 2, 3])
+        for kind in ["linear", "nearest", "nearest-up", "previous", "next"]:
+            with self.subTest(kind=kind):
+                interpolated = interp1d_wo_unknowns_operator(xs, ys, points, kind)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    expected = interp1d_wo_unknowns_scipy(xs, ys, points, kind)
+                np.testing.assert_allclose(interpolated, expected)
+
+    def test_interpolation_operator_large(self):
+        # the operator is built without interpolating dense unit vectors
+        xs = np.linspace(0, 1, 10**6)
+        points = np.linspace(0, 1, 10**5)
+        M, _ = interpolation_operator(xs, points)
+        self.assertEqual(M.shape, (10**5, 10**6))
+        self.assertLessEqual(M.nnz, 2 * len(points))
+
     def test_eq(self):
         data = Orange.data.Table("iris")
         i1 = Interpolate([0, 1])(data)
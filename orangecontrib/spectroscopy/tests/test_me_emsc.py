@@ -1,11 +1,18 @@
+import os
+import tempfile
 import unittest
+from unittest.mock import patch
 
 import numpy as np
 
 import Orange
 from Orange.data import FileFormat, dataset_dirs
+from sklearn.decomposition import TruncatedSVD
 
-from orangecontrib.spectroscopy.preprocess.me_emsc import ME_EMSC
+from orangecontrib.spectroscopy.data import getx
+
+from orangecontrib.spectroscopy.preprocess import me_emsc
+from orangecontrib.spectroscopy.preprocess.me_emsc import ME_EMSC, MieCurvesCache
 from orangecontrib.spectroscopy.preprocess.emsc import SmoothedSelectionFunction
 from orangecontrib.spectroscopy.preprocess.npfunc import Sum
 from orangecontrib.spectroscopy.tests.test_preprocess import (
@@ -266,6 +273,19 @@ class TestME_EMSC(unittest.TestCase, TestCommonIndpSamplesMixin):
         )
         np.testing.assert_equal(RMSE, self.RMSE_std)
 
+    def test_batch_same_as_single(self):
+        # spectra converge after different numbers of iterations
+        data = self.spectra.copy()
+        with data.unlocked():
+            data.X = np.vstack((data.X[0], data.X[0] * 1.5 + 0.1, data.X[0][::-1]))
+        f = ME_EMSC(reference=self.reference, ncomp=False, output_model=True)
+        batch = f(data)
+        self.assertGreater(len(np.unique(batch.metas[:, -2])), 1)
+        for i in range(len(data)):
+            single = f(data[i : i + 1])
+            np.testing.assert_almost_equal(batch.X[i : i + 1], single.X)
+            np.testing.assert_almost_equal(batch.metas[i : i + 1], single.metas)
+
     def test_same_data_reference(self):
         # it was crashing before
         ME_EMSC(reference=self.reference)(self.reference)
@@ -352,3 +372,78 @@ class TestInflectionPointWeighting(unittest.TestCase):
         )
         newy = new(oldx)
         self.assertLess(np.max(np.abs(newy - oldy)), 1e-7)
+
+
+class TestCompressMieCurves(unittest.TestCase):
+    def test_same_as_truncated_svd(self):
+        data = SMALLER_COLLAGEN
+        wavenumbers = np.sort(getx(data))
+        reference = data.X[0][np.argsort(getx(data))]
+        n0 = np.linspace(1.1, 1.4, 10)
+        a = np.linspace(2, 7.1, 10)
+        alpha0 = (4 * np.pi * a * (n0 - 1)) * 1e-6
+        gamma = 0.25 * np.log(10) / (4 * np.pi * 0.5 * np.pi * (n0 - 1) * a * 1e-6)
+        nprs, nkks = me_emsc.calculate_complex_n(reference, wavenumbers)
+        Qext = me_emsc.calculate_Qext_curves(nprs, nkks, alpha0, gamma, wavenumbers)
+        Qext = me_emsc.orthogonalize_Qext(Qext, reference)
+        # the curves are nearly linearly dependent
+        self.assertGreater(np.linalg.cond(Qext), 1e12)
+        for ncomp in [3, 7, 20]:
+            svd = TruncatedSVD(n_components=ncomp, n_iter=7, random_state=42)
+            expected = svd.fit(Qext).components_
+            single = me_emsc.compress_Mie_curves(Qext, ncomp)
+            np.testing.assert_allclose(single, expected, atol=1e-10)
+            stacked = me_emsc.compress_Mie_curves(np.stack((Qext, Qext[::-1])), ncomp)
+            self.assertTrue(np.all(np.isfinite(stacked)))
+            np.testing.assert_allclose(stacked[0], expected, atol=1e-10)
+            np.testing.assert_allclose(stacked[1], expected, atol=1e-10)
+
+
+class TestMieCurvesCache(unittest.TestCase):
+    def setUp(self):
+        me_emsc.mie_curves_cache.clear()
+
+    def tearDown(self):
+        me_emsc.mie_curves_cache.clear()
+
+    def test_reuse(self):
+        data = SMALLER_COLLAGEN
+        d1 = ME_EMSC(reference=data[0:1], max_iter=1)(data)
+        with patch(
+            "orangecontrib.spectroscopy.preprocess.me_emsc.calculate_Qext_curves",
+            side_effect=AssertionError,
+        ):
+            d2 = ME_EMSC(reference=data[0:1], max_iter=1)(data)
+        np.testing.assert_equal(d1.X, d2.X)
+        # a different reference needs new curves
+        with self.assertRaises(AssertionError):
+            with patch(
+                "orangecontrib.spectroscopy.preprocess.me_emsc.calculate_Qext_curves",
+                side_effect=AssertionError,
+            ):
+                ME_EMSC(reference=data[1:2], max_iter=1)(data)
+
+    def test_lru(self):
+        cache = MieCurvesCache(maxsize=2)
+        cache.get(("a",), lambda: 1)
+        cache.get(("b",), lambda: 2)
+        cache.get(("a",), lambda: 3)  # a is now the most recent
+        cache.get(("c",), lambda: 4)  # b is removed
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(("a",), lambda: 5), 1)
+        self.assertEqual(cache.get(("b",), lambda: 6), 6)
+
+    def test_key(self):
+        k = MieCurvesCache.key
+        self.assertEqual(k("a", np.arange(3)), k("a", np.arange(3.0)))
+        self.assertNotEqual(k("a", np.arange(3)), k("a", np.arange(1, 4)))
+        self.assertNotEqual(k("a", np.arange(4)), k("a", np.arange(4).reshape(2, 2)))
+
+    def test_directory(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = MieCurvesCache(directory=tmpdir)
+            v = cache.get(("a", np.arange(3)), lambda: np.arange(5.0))
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+            cache = MieCurvesCache(directory=tmpdir)
+            v2 = cache.get(("a", np.arange(3)), lambda: np.zeros(5))
+            np.testing.assert_equal(v, v2)
@@ -20,7 +20,11 @@ from Orange.data import DiscreteVariable, Domain, Table
 from Orange.widgets.tests.base import WidgetTest
 from Orange.util import OrangeDeprecationWarning
 
-from orangecontrib.spectroscopy.data import _spectra_from_image, build_spec_table
+from orangecontrib.spectroscopy.data import (
+    _spectra_from_image,
+    _spectra_from_image_2d,
+    build_spec_table,
+)
 from orangecontrib.spectroscopy.io.util import VisibleImage
 from orangecontrib.spectroscopy.preprocess.integrate import (
     IntegrateFeaturePeakSimple,
@@ -37,6 +41,7 @@ from orangecontrib.spectroscopy.utils import (
     index_values,
     location_values,
     index_values_nan,
+    split_to_size,
 )
 
 NAN = float("nan")
@@ -109,6 +114,34 @@ class TestPolygonSelection(unittest.TestCase):
         self.assertTrue(in_polygon([0.5, 0.5], list(reversed(poly))))
 
 
+class TestVectorBinning(unittest.TestCase):
+    def test_circular_mean(self):
+        degs = np.array([[80, -80, NAN], [10, 20, 30]])
+        np.testing.assert_allclose(
+            np.degrees(owhyper.circular_mean(degs, axis=1)), [90, 20]
+        )
+        self.assertAlmostEqual(np.degrees(owhyper.circular_mean(degs[1])), 20)
+
+    def test_pixel_means(self):
+        yindex = np.array([0, 0, 3, 3, 0])
+        xindex = np.array([1, 1, 2, 1, 2])
+        values = np.array([[1, 2], [3, NAN], [5, 6], [7, 8], [NAN, NAN]])
+        means, counts, rows, cols = owhyper.pixel_means(yindex, xindex, values)
+        np.testing.assert_equal(rows, [0, 3])
+        np.testing.assert_equal(cols, [1, 2])
+        np.testing.assert_equal(counts, [[2, 1], [1, 1]])
+        np.testing.assert_equal(means[0], [[2, NAN], [7, 5]])
+        np.testing.assert_equal(means[1], [[2, NAN], [8, 6]])
+
+    def test_bin_blocks(self):
+        grid = np.arange(5 * 8).reshape(5, 8)
+        blocks = owhyper.bin_blocks(grid, 3)
+        # incomplete blocks are left out on both sides
+        self.assertEqual(blocks.shape, (1, 2, 9))
+        np.testing.assert_equal(blocks[0, 0], [9, 10, 11, 17, 18, 19, 25, 26, 27])
+        np.testing.assert_equal(blocks[0, 1], [12, 13, 14, 20, 21, 22, 28, 29, 30])
+
+
 class TestOWHyper(WidgetTest):
     @classmethod
     def setUpClass(cls):
@@ -261,6 +294,69 @@ class TestOWHyper(WidgetTest):
             [o[out.domain["Group"]].value for o in out], ["G1", "G1"]
         )
 
+    def test_level_of_detail(self):
+        with patch("orangecontrib.spectroscopy.widgets.owhyper.IMAGE_LOD", 100):
+            self.send_signal("Data", self.whitelight)
+            wait_for_image(self.widget)
+        imageplot = self.widget.imageplot
+        self.assertIsNotNone(imageplot.pyramid)
+        vb = imageplot.plot.vb
+        vb.autoRange()
+        # the whole image fits in the view at full resolution
+        self.assertEqual(imageplot.lod_shown, (0, 0, 100, 0, 200))
+        self.assertEqual(imageplot.img.image.shape, (100, 200, 1))
+
+        # zoomed out
+        (x0, x1), (y0, y1) = vb.viewRange()
+        vb.setRange(xRange=(x0, x0 + (x1 - x0) * 16), yRange=(y0, y0 + (y1 - y0) * 16))
+        level = imageplot.lod_shown[0]
+        self.assertGreater(level, 0)
+        self.assertEqual(
+            imageplot.img.image.shape[:2], imageplot.pyramid.level_shape(level)
+        )
+        imageplot.select_square(QPointF(-100, -100), QPointF(1000, 1000))
+        np.testing.assert_equal(imageplot.img.selection, 1)
+        self.assertEqual(imageplot.img.selection.shape, imageplot.img.image.shape[:2])
+
+        # zoomed in, only a part of the image is shown
+        vb.setRange(xRange=(53.2, 53.3), yRange=(30.0, 30.1))
+        self.assertEqual(imageplot.lod_shown[0], 0)
+        self.assertLess(imageplot.img.image.shape[1], 200)
+        self.assertEqual(imageplot.img.selection.shape, imageplot.img.image.shape[:2])
+
+        # autoRange considers the whole image
+        vb.autoRange()
+        self.assertEqual(imageplot.img.image.shape, (100, 200, 1))
+
+    def test_sparse(self):
+        # a diagonal line scan over a large image
+        n = 1000
+        locs = np.arange(n, dtype=float)
+        data = build_spec_table(
+            *_spectra_from_image_2d(np.ones((n, 2)) * locs[:, None], [0, 1], locs, locs)
+        )
+        self.send_signal("Data", data)
+        wait_for_image(self.widget)
+        imageplot = self.widget.imageplot
+        self.assertEqual((imageplot.lsx[2], imageplot.lsy[2]), (n, n))
+        self.assertIsNotNone(imageplot.pyramid)
+        # precomputed images are limited by the number of points
+        pyramid = imageplot.pyramid
+        level_shape = pyramid.level_shape(pyramid.precomputed_level)
+        self.assertLessEqual(level_shape[0] * level_shape[1], 4 * n)
+
+        imageplot.plot.vb.autoRange()
+        image = imageplot.img.image
+        self.assertLess(image.shape[0] * image.shape[1], n * n)
+        imageplot.plot.vb.setRange(xRange=(100, 110), yRange=(100, 110))
+        self.assertEqual(imageplot.lod_shown[0], 0)
+        # only the part in view with points on the diagonal
+        _, y0, y1, x0, x1 = imageplot.lod_shown
+        self.assertLess((y1 - y0) * (x1 - x0), 100 * 100)
+        rows, cols = np.nonzero(~np.isnan(imageplot.img.image[..., 0]))
+        self.assertGreater(len(rows), 0)
+        np.testing.assert_equal(rows + y0, cols + x0)
+
     def test_select_polygon_as_rectangle(self):
         # rectangle and a polygon need to give the same results
         self.send_signal("Data", self.whitelight)
@@ -530,6 +626,29 @@ class TestOWHyper(WidgetTest):
             target = [data.X[0, :3], data.X[1, :3]], [data.X[2, :3], data.X[3, :3]]
             np.testing.assert_equal(called, target)
 
+    def test_integral_index_reuse(self):
+        # indices are built for parts of data
+        with patch(
+            "orangecontrib.spectroscopy.widgets.owhyper.split_to_size",
+            lambda size, _: split_to_size(size, 30),
+        ):
+            self.send_signal("Data", self.whitelight[:100])
+            wait_for_image(self.widget)
+        index = self.widget.imageplot.integral_index
+        self.assertEqual(len(index), 4)
+        self.widget.lowlim = self.widget.highlim - 1
+        self.widget.changed_integral_range()
+        wait_for_image(self.widget)
+        self.assertIs(self.widget.imageplot.integral_index, index)
+        integrate = self.widget.image_values()
+        np.testing.assert_allclose(
+            self.widget.imageplot.data_values, integrate(self.whitelight[:100]).X
+        )
+        self.send_signal("Data", self.whitelight[:50])
+        self.assertIsNone(self.widget.imageplot.integral_index)
+        wait_for_image(self.widget)
+        self.assertIsNot(self.widget.imageplot.integral_index, index)
+
     def test_scatterplot_computation(self):
         spectra = [[[0, 0, 2, 0], [0, 0, 1, 0]], [[1, 2, 2, 0], [0, 1, 1, 0]]]
         wns = [0, 1, 2, 3]
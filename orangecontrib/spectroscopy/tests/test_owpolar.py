@@ -4,7 +4,14 @@ from AnyQt.QtCore import QItemSelectionModel, QItemSelection, QItemSelectionRang
 import Orange
 from Orange.data import ContinuousVariable, DiscreteVariable, Domain
 from Orange.widgets.tests.base import WidgetTest
-from orangecontrib.spectroscopy.widgets.owpolar import OWPolar
+from scipy.optimize import curve_fit
+
+from orangecontrib.spectroscopy.widgets.owpolar import (
+    OWPolar,
+    azimuth,
+    compute,
+    fit_azimuth,
+)
 
 
 class TestOWPolar(WidgetTest):
@@ -183,6 +190,31 @@ class TestOWPolar(WidgetTest):
         )
         np.testing.assert_allclose(self.multiin_model.X, model.X, rtol=5e-06)
 
+    def test_average(self):
+        for i, data in enumerate([self.in1, self.in2, self.in3, self.in4]):
+            self.send_signal("Data", data, i, widget=self.widget)
+        self.widget.map_x = self.widget.x_axis[0]
+        self.widget.map_y = self.widget.y_axis[1]
+        self.widget.feats = [self.widget.feat_view.model()[:][2]]
+        self.widget.alphas = [0]
+        self.widget.autocommit = True
+        self.commit_and_wait(self.widget, 20000)
+        polar = self.get_output("Polar Data")
+
+        self.widget.average = True
+        self.commit_and_wait(self.widget, 20000)
+        averaged = self.get_output("Polar Data")
+
+        n = len(averaged)
+        self.assertEqual(len(polar), 4 * n)
+        np.testing.assert_allclose(
+            averaged.X, polar.X.reshape(4, n, -1).mean(axis=0), rtol=1e-12
+        )
+        np.testing.assert_equal(
+            np.asarray(averaged.metas[:, :2], dtype=float),
+            np.asarray(polar.metas[:n, :2], dtype=float),
+        )
+
     def test_pixelsubset(self):
         # Test multi in with subset of pixels selected
         rng = np.random.default_rng()
@@ -356,5 +388,41 @@ def update_selection(model, view, setting):
     #     pass
 
 
+class TestFit(unittest.TestCase):
+    def test_fit_azimuth(self):
+        rng = np.random.default_rng(0)
+        polangles = [0, 30, 45, 60, 90, 135]
+        values = rng.random((3, 4, 2, len(polangles)))
+        params, r2, _ = fit_azimuth(values, polangles)
+        self.assertEqual(params.shape, (3, 4, 2, 3))
+        for ind in np.ndindex(values.shape[:-1]):
+            v = values[ind]
+            p = curve_fit(azimuth, polangles, v)[0]
+            np.testing.assert_allclose(params[ind], p, atol=1e-7)
+            ss_res = np.sum((v - azimuth(np.asarray(polangles), *p)) ** 2)
+            ss_tot = np.sum((v - np.mean(v)) ** 2)
+            np.testing.assert_allclose(r2[ind], 1 - ss_res / ss_tot, atol=1e-7)
+
+    def test_compute(self):
+        polangles = [0, 45, 90, 135]
+        # maximum at 30 degrees
+        values = azimuth(np.array(polangles), 0.5 * np.sin(np.radians(60)), 0.25, 1)
+        cvs = np.array([[[values, values]], [[values, [np.nan, 1, 1, 1]]]])
+        out, mod, errorstate = compute(cvs, polangles, [0, 90])
+        self.assertEqual(errorstate, 0)
+        self.assertEqual(out.shape, (2, 1, 2, 5))
+        self.assertEqual(mod.shape, (2, 1, 2, 4))
+        np.testing.assert_allclose(out[0, 0, :, 0], 30)
+        np.testing.assert_allclose(out[0, 0, :, 2], 1)
+        np.testing.assert_allclose(out[0, 0, :, 4], 1)
+        np.testing.assert_allclose(mod[0, 0, 0, 1:], mod[0, 0, 1, 1:])
+        self.assertFalse(np.isnan(out[1, 0, 0]).any())
+        self.assertTrue(np.isnan(out[1, 0, 1]).all())
+        self.assertTrue(np.isnan(mod[1, 0, 1]).all())
+
+        _, _, errorstate = compute(np.ones((1, 1, 1, 4)), polangles, [0])
+        self.assertEqual(errorstate, 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,3 +1,7 @@
+import os
+import tempfile
+from unittest.mock import Mock, patch
+
 import numpy as np
 
 import Orange
@@ -7,13 +11,17 @@ from Orange.preprocess.preprocess import Preprocess
 from orangewidget.tests.utils import excepthook_catch
 
 from orangecontrib.spectroscopy.data import getx
+from orangecontrib.spectroscopy.preprocess.utils import DeferredPreprocessing
 from orangecontrib.spectroscopy.tests import spectral_preprocess
 from orangecontrib.spectroscopy.tests.spectral_preprocess import (
     pack_editor,
     wait_for_preview,
 )
 from orangecontrib.spectroscopy.tests.test_owspectra import wait_for_graph
-from orangecontrib.spectroscopy.widgets.owpreprocess import OWPreprocess
+from orangecontrib.spectroscopy.widgets.owpreprocess import (
+    InterruptException,
+    OWPreprocess,
+)
 from orangecontrib.spectroscopy.widgets.preprocessors.misc import (
     CutEditor,
     SavitzkyGolayFilteringEditor,
@@ -188,6 +196,49 @@ class TestOWPreprocess(WidgetTest):
         self.widget.commit.now()
         self.wait_until_finished()
 
+    def test_result_cache(self):
+        data = SMALL_COLLAGEN
+        self.widget.add_preprocessor(pack_editor(CutEditor))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = {
+                "QUASAR_PREPROCESS_CACHE_SIZE": "10",
+                "QUASAR_PREPROCESS_CACHE_DIR": tmpdir,
+            }
+            with patch.dict(os.environ, env):
+                self.send_signal(self.widget.Inputs.data, data)
+                self.widget.commit.now()
+                self.wait_until_finished()
+                computed = self.get_output(self.widget.Outputs.preprocessed_data)
+                self.assertEqual(len(os.listdir(tmpdir)), 1)
+                with patch.object(DeferredPreprocessing, "apply") as apply:
+                    self.send_signal(self.widget.Inputs.data, data.copy())
+                    self.widget.commit.now()
+                    self.wait_until_finished()
+                    apply.assert_not_called()
+                cached = self.get_output(self.widget.Outputs.preprocessed_data)
+        self.assertEqual(cached.domain, computed.domain)
+        np.testing.assert_equal(cached.X, computed.X)
+
+    def test_progress_in_blocks(self):
+        data = SMALL_COLLAGEN
+        self.widget.add_preprocessor(pack_editor(SavitzkyGolayFilteringEditor))
+        self.widget.add_preprocessor(pack_editor(NormalizeEditor))
+        pp_def = [self.widget.preprocessormodel.item(i) for i in range(2)]
+        progress = []
+        state = Mock()
+        state.set_progress_value.side_effect = progress.append
+        state.is_interruption_requested.return_value = False
+        with patch("orangecontrib.spectroscopy.widgets.owpreprocess.BLOCK_SIZE", 3):
+            processed, pp = OWPreprocess.run_task(data, None, pp_def, False, state)
+            # the final table is built with progress in blocks
+            self.assertGreater(len([p for p in progress if p >= 75]), 2)
+            self.assertEqual(progress, sorted(progress))
+            np.testing.assert_almost_equal(processed.X, pp(data).X)
+            # and can be interrupted between blocks
+            state.is_interruption_requested.side_effect = lambda: progress[-1] > 80
+            with self.assertRaises(InterruptException):
+                OWPreprocess.run_task(data, None, pp_def, False, state)
+
     def test_invalid_preprocessors(self):
         settings = {"storedsettings": {"preprocessors": [("xyz.abc.notme", {})]}}
         with self.assertRaises(KeyError):
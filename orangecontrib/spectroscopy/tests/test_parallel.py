@@ -0,0 +1,61 @@
+import os
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from orangecontrib.spectroscopy.preprocess import EMSC, Despike, RubberbandBaseline
+from orangecontrib.spectroscopy.preprocess.als import ALSP
+from orangecontrib.spectroscopy.preprocess.parallel import n_processes, transform_rows
+from orangecontrib.spectroscopy.preprocess.utils import PreprocessException
+from orangecontrib.spectroscopy.tests.test_preprocess import SMALL_COLLAGEN
+
+
+def scale_rows(X, factor, row_factors):
+    return X * factor * row_factors[:, None]
+
+
+def fail(X):
+    raise PreprocessException("failed")
+
+
+@patch("orangecontrib.spectroscopy.preprocess.parallel.PARALLEL_MIN_ROWS", 10)
+class TestParallel(unittest.TestCase):
+    def test_n_processes(self):
+        with patch.dict(os.environ, {"QUASAR_N_PROCESSES": ""}):
+            self.assertEqual(n_processes(), 1)
+        with patch.dict(os.environ, {"QUASAR_N_PROCESSES": "3"}):
+            self.assertEqual(n_processes(), 3)
+        with patch.dict(os.environ, {"QUASAR_N_PROCESSES": "all"}):
+            self.assertEqual(n_processes(), os.cpu_count())
+
+    def test_transform_rows(self):
+        X = np.arange(60.0).reshape(20, 3)
+        factors = np.arange(20.0)
+        result = transform_rows(scale_rows, X, (2,), (factors,), processes=3)
+        np.testing.assert_equal(result, X * 2 * factors[:, None])
+        with self.assertRaises(PreprocessException):
+            transform_rows(fail, X, processes=3)
+
+    def test_same_as_single(self):
+        data = SMALL_COLLAGEN
+        preprocessors = [
+            RubberbandBaseline(),
+            Despike(threshold=5, cutoff=60, dis=5),
+            EMSC(reference=data[:1], output_model=True),
+            ALSP(),
+        ]
+        for pp in preprocessors:
+            with self.subTest(pp):
+                single = pp(data)
+                with (
+                    patch.dict(os.environ, {"QUASAR_N_PROCESSES": "3"}),
+                    patch(
+                        "orangecontrib.spectroscopy.preprocess.utils.transform_rows",
+                        wraps=transform_rows,
+                    ) as parallel,
+                ):
+                    multi = pp(data)
+                    parallel.assert_called_once()
+                np.testing.assert_almost_equal(multi.X, single.X)
+                np.testing.assert_almost_equal(multi.metas, single.metas)
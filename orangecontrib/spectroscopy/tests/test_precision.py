@@ -0,0 +1,96 @@
+import os
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from orangecontrib.spectroscopy.preprocess import (
+    EMSC,
+    Despike,
+    GaussianSmoothing,
+    Integrate,
+    LinearBaseline,
+    Normalize,
+    RubberbandBaseline,
+    SavitzkyGolayFiltering,
+)
+from orangecontrib.spectroscopy.preprocess.als import AIRPLS, ALSP, ARPLS
+from orangecontrib.spectroscopy.preprocess.utils import (
+    compute_dtype,
+    transform_to_sorted_wavenumbers,
+)
+from orangecontrib.spectroscopy.tests.test_preprocess import (
+    SMALL_COLLAGEN,
+    shuffle_attr,
+)
+
+FLOAT32 = {"QUASAR_PRECISION": "float32"}
+
+# differences relative to the largest absolute value of the result
+RTOL = 1e-5
+
+PREPROCESSORS = [
+    SavitzkyGolayFiltering(window=9, polyorder=2, deriv=0),
+    SavitzkyGolayFiltering(window=9, polyorder=2, deriv=1),
+    SavitzkyGolayFiltering(window=9, polyorder=3, deriv=2),
+    GaussianSmoothing(sd=3),
+    RubberbandBaseline(),
+    LinearBaseline(),
+    ALSP(),
+    ARPLS(),
+    AIRPLS(),
+    Normalize(method=Normalize.Vector),
+    Normalize(method=Normalize.SNV),
+    Normalize(method=Normalize.MinMax),
+    Normalize(
+        method=Normalize.Area, lower=1000, upper=1300, int_method=Integrate.Simple
+    ),
+    Integrate(
+        methods=[Integrate.Simple, Integrate.Baseline, Integrate.PeakMax],
+        limits=[[1000, 1300], [1500, 1700], [1500, 1700]],
+    ),
+    EMSC(reference=SMALL_COLLAGEN[:1]),
+    Despike(),
+]
+
+
+class TestPrecision(unittest.TestCase):
+    def test_compute_dtype(self):
+        with patch.dict(os.environ, {"QUASAR_PRECISION": ""}):
+            self.assertEqual(compute_dtype(), np.float64)
+        with patch.dict(os.environ, FLOAT32):
+            self.assertEqual(compute_dtype(), np.float32)
+
+    def test_sorted_in_dtype(self):
+        X = np.arange(12.0).reshape(3, 4)
+        for xs in ([1, 2, 3, 4], [4, 1, 3, 2]):
+            _, xsind, _, Xs = transform_to_sorted_wavenumbers(
+                np.array(xs), X, dtype=np.float32
+            )
+            self.assertEqual(Xs.dtype, np.float32)
+            np.testing.assert_equal(Xs, X[:, xsind])
+
+    def assert_close(self, data):
+        for pp in PREPROCESSORS:
+            with self.subTest(pp=pp):
+                expected = pp(data).X
+                with patch.dict(os.environ, FLOAT32):
+                    result = pp(data).X
+                self.assertEqual(result.dtype, np.float64)  # tables are float64
+                np.testing.assert_equal(np.isnan(result), np.isnan(expected))
+                scale = np.nanmax(np.abs(expected))
+                np.testing.assert_allclose(result, expected, rtol=0, atol=RTOL * scale)
+
+    def test_float32_close(self):
+        self.assert_close(SMALL_COLLAGEN)
+
+    def test_float32_close_unordered_unknowns(self):
+        data = shuffle_attr(SMALL_COLLAGEN).copy()
+        with data.unlocked():
+            data.X[0, :3] = np.nan
+            data.X[1, 20:25] = np.nan
+        self.assert_close(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@ import random
 import unittest
 
 import numpy as np
+from scipy.spatial import ConvexHull
 
 import Orange
 from Orange.classification import RandomForestLearner
@@ -413,6 +414,38 @@ class TestRubberbandBaseline(unittest.TestCase, TestCommonIndpSamplesMixin):
         i = RubberbandBaseline(peak_dir=RubberbandBaseline.PeakNegative)(data)
         np.testing.assert_equal(i.X, [[0, 0, -0.5, 0]])
 
+    def test_same_as_convex_hull(self):
+        rng = np.random.RandomState(0)
+        x = np.sort(rng.uniform(0, 100, 50))
+        X = rng.uniform(size=(20, 50)) + np.sin(x / 10)
+        X[1, :5] = np.nan
+        X[2, -3:] = np.nan
+        X[3, 10:30] = np.nan
+        X[4, ::2] = np.nan
+        data = Table.from_numpy(None, X)
+        data = replacex(data, x)
+        for peak_dir in (
+            RubberbandBaseline.PeakPositive,
+            RubberbandBaseline.PeakNegative,
+        ):
+            sign = 1 if peak_dir == RubberbandBaseline.PeakPositive else -1
+            i = RubberbandBaseline(peak_dir=peak_dir, sub=RubberbandBaseline.View)(data)
+            for row, baseline in zip(X, i.X, strict=True):
+                valid = ~np.isnan(row)
+                v = ConvexHull(np.column_stack((x[valid], sign * row[valid]))).vertices
+                v = np.roll(v, -v.argmin())
+                v = v[: v.argmax() + 1]
+                expected = np.interp(x, x[valid][v], row[valid][v])
+                expected[: np.argmax(valid)] = np.nan
+                expected[len(row) - np.argmax(valid[::-1]) :] = np.nan
+                np.testing.assert_allclose(baseline, expected)
+
+    def test_line(self):
+        """Points on a line have no convex hull."""
+        data = Table.from_numpy(None, [[1, 2, 3, 4], [1, 1, 1, 1], [1, 2, np.nan, 4]])
+        i = RubberbandBaseline(sub=RubberbandBaseline.View)(data)
+        np.testing.assert_equal(i.X, 0)
+
 
 class TestLinearBaseline(unittest.TestCase, TestCommonIndpSamplesMixin):
     preprocessors = [LinearBaseline()]
@@ -1,8 +1,44 @@
+import os
+import pickle
+import tempfile
 from unittest import TestCase
+from unittest.mock import patch
 
-from Orange.data import Table
+import numpy as np
+from Orange.data import Domain, Table
+from Orange.preprocess.transformation import Normalizer
 
-from orangecontrib.spectroscopy.preprocess.utils import table_eq_x
+from orangecontrib.spectroscopy.data import getx
+from orangecontrib.spectroscopy.preprocess import (
+    Cut,
+    EMSC,
+    GaussianSmoothing,
+    Integrate,
+    Interpolate,
+    LinearBaseline,
+    MNFDenoising,
+    Normalize,
+    PCADenoising,
+    RubberbandBaseline,
+    SavitzkyGolayFiltering,
+    SpSubtract,
+)
+from orangecontrib.spectroscopy.preprocess.utils import (
+    CommonDomain,
+    CommonDomainOrder,
+    DeferredPreprocessing,
+    domain_rows_independent,
+    interpolate_extend_to,
+    SelectColumn,
+    table_eq_x,
+    shared_outputs,
+    table_fingerprint,
+    transform_in_blocks,
+)
+from orangecontrib.spectroscopy.tests.test_preprocess import (
+    SMALL_COLLAGEN,
+    shuffle_attr,
+)
 
 
 class TestEq(TestCase):
@@ -24,3 +60,308 @@ class TestEq(TestCase):
         self.assertTrue(table_eq_x(self.iris, self.iris))
         self.assertTrue(table_eq_x(self.iris, self.iris2))
         self.assertFalse(table_eq_x(self.iris, self.iris_changed))
+
+    def test_reference_eq_X_nan(self):
+        data = SMALL_COLLAGEN[:2].copy()
+        with data.unlocked():
+            data.X[0, 3] = np.nan
+        self.assertTrue(table_eq_x(data, data.copy()))
+
+    def test_reference_eq_X_attributes(self):
+        data = SMALL_COLLAGEN[:2]
+        # the same names, but computed differently
+        attributes = [
+            a.copy(compute_value=Normalizer(a, 0, 1)) for a in data.domain.attributes
+        ]
+        computed = data.transform(Domain(attributes))
+        self.assertEqual(
+            [a.name for a in data.domain.attributes],
+            [a.name for a in computed.domain.attributes],
+        )
+        self.assertFalse(table_eq_x(data, computed))
+        fingerprints = (table_fingerprint, table_fingerprint)
+        self.assertFalse(table_eq_x(data, computed, fingerprints))
+        self.assertTrue(table_eq_x(data, data.copy(), fingerprints))
+
+    def test_reference_eq_X_fingerprints_as_values(self):
+        data = SMALL_COLLAGEN[:2].copy()
+        with data.unlocked():
+            data.X[0, 3] = np.nan
+            data.X[1, 4] = 0.0
+        other = data.copy()
+        with other.unlocked():
+            # a NaN with a different payload
+            other.X.view(np.uint64)[0, 3] |= 1
+            other.X[1, 4] = -0.0
+        self.assertTrue(table_eq_x(data, other))
+        fingerprints = (table_fingerprint, table_fingerprint)
+        self.assertTrue(table_eq_x(data, other, fingerprints))
+        single = data.copy()
+        with single.unlocked():
+            single.X = single.X.astype(np.float32).astype(np.float64)
+        single32 = single.copy()
+        with single32.unlocked():
+            single32.X = single32.X.astype(np.float32)
+        self.assertTrue(table_eq_x(single, single32))
+        self.assertTrue(table_eq_x(single, single32, fingerprints))
+
+    def test_common_domain_ref(self):
+        data = SMALL_COLLAGEN
+        ref = data[:1].copy()
+        # the same beginning, which used to be the only part hashed
+        ref_changed = ref.copy()
+        with ref_changed.unlocked():
+            ref_changed.X[0, -1] += 1
+
+        def common(reference):
+            processed = SpSubtract(reference=reference, amount=0.5)(data)
+            return processed.domain[0].compute_value.compute_shared
+
+        c1, c2, c3 = common(ref), common(ref.copy()), common(ref_changed)
+        self.assertEqual(c1, c2)
+        self.assertEqual(hash(c1), hash(c2))
+        self.assertNotEqual(c1, c3)
+        self.assertNotEqual(hash(c1), hash(c3))
+
+    def test_fingerprint_once(self):
+        data = SMALL_COLLAGEN
+
+        def common():
+            processed = EMSC(reference=data[:1], badspectra=data[1:3])(data)
+            return processed.domain[0].compute_value.compute_shared
+
+        with patch(
+            "orangecontrib.spectroscopy.preprocess.utils.table_fingerprint",
+            wraps=table_fingerprint,
+        ) as m:
+            c1, c2 = common(), common()
+            for _ in range(3):
+                hash(c1)
+                self.assertEqual(c1, c2)
+            # reference and bad spectra of both
+            self.assertEqual(m.call_count, 4)
+
+
+class TestChained(TestCase):
+    def test_same_as_separate(self):
+        data = shuffle_attr(SMALL_COLLAGEN).copy()
+        with data.unlocked():
+            data.X[0, :3] = np.nan
+            data.X[1, 10:20] = np.nan
+            data.X[2] = np.nan
+        train, test = data[:50], data[50::-1]
+        preprocessors = [
+            SavitzkyGolayFiltering(window=9, polyorder=2, deriv=0),
+            RubberbandBaseline(),
+            GaussianSmoothing(sd=2),
+            Cut(lowlim=1000, highlim=1500),
+            LinearBaseline(),
+            Normalize(method=Normalize.Vector),
+            SavitzkyGolayFiltering(window=5, polyorder=2, deriv=1),
+        ]
+        separate = test
+        for pp in preprocessors:
+            train = pp(train)
+            separate = pp(separate)
+        with patch.object(
+            CommonDomain,
+            "transform_domain",
+            autospec=True,
+            side_effect=CommonDomain.transform_domain,
+        ) as transform_domain:
+            transformed = test.transform(train.domain)
+        np.testing.assert_equal(transformed.X, separate.X)
+        # the first three are chained, the others follow Cut or Normalize
+        self.assertEqual(transform_domain.call_count, 4)
+
+
+class TestDeferredPreprocessing(TestCase):
+    def test_same_as_separate(self):
+        data = SMALL_COLLAGEN
+        preprocessors = [
+            SavitzkyGolayFiltering(window=9, polyorder=2, deriv=0),
+            Cut(lowlim=1000, highlim=1700),
+            RubberbandBaseline(),
+            PCADenoising(components=5),
+            Normalize(method=Normalize.Vector),
+            GaussianSmoothing(sd=2),
+            Integrate(limits=[[1100, 1200], [1500, 1600]], metas=True),
+        ]
+        separate = data
+        deferred = DeferredPreprocessing(data)
+        for pp in preprocessors:
+            separate = pp(separate)
+            deferred.apply(pp)
+            if isinstance(pp, PCADenoising):
+                # PCA needs data and gets the transformed data
+                self.assertIs(deferred.data.domain, deferred.domain)
+            else:
+                self.assertIsNot(deferred.data.domain, deferred.domain)
+        result = deferred.result()
+        self.assertEqual(result.domain, separate.domain)
+        np.testing.assert_almost_equal(result.X, separate.X)
+        np.testing.assert_almost_equal(result.metas, separate.metas)
+        # the final domain also transforms other data
+        np.testing.assert_almost_equal(
+            data[:5].transform(result.domain).X, separate.X[:5]
+        )
+
+
+class TestSharedOutputs(TestCase):
+    def test_nested(self):
+        data = SMALL_COLLAGEN
+        processed = SavitzkyGolayFiltering(window=9, polyorder=2, deriv=0)(data[:0])
+        processed = Integrate(limits=[[1100, 1200]], metas=True)(processed)
+        expected = data.transform(processed.domain)
+        with patch.object(
+            CommonDomainOrder,
+            "_transformed_table",
+            autospec=True,
+            side_effect=CommonDomainOrder._transformed_table,
+        ) as transformed:
+            with shared_outputs():
+                result = data.transform(processed.domain)
+            # Integrate computes its metas from the same smoothed data
+            self.assertEqual(transformed.call_count, 1)
+            data.transform(processed.domain)
+            self.assertEqual(transformed.call_count, 3)
+        np.testing.assert_equal(result.X, expected.X)
+        np.testing.assert_equal(
+            result.metas.astype(float), expected.metas.astype(float)
+        )
+
+
+class TestTransformInBlocks(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data = SMALL_COLLAGEN
+        data = SavitzkyGolayFiltering(window=9, polyorder=2, deriv=0)(cls.data[:0])
+        data = Normalize(method=Normalize.SNV)(data)
+        data = Integrate(limits=[[1100, 1200]], metas=True)(data)
+        cls.domain = data.domain
+
+    def test_same_as_transform(self):
+        expected = self.data.transform(self.domain)
+        for block_size in [1, 7, 1000]:
+            with self.subTest(block_size):
+                result = transform_in_blocks(self.data, self.domain, block_size)
+                self.assertEqual(result.domain, self.domain)
+                np.testing.assert_equal(result.X, expected.X)
+                np.testing.assert_equal(result.Y, expected.Y)
+                np.testing.assert_almost_equal(
+                    result.metas.astype(float), expected.metas.astype(float)
+                )
+                np.testing.assert_equal(result.ids, expected.ids)
+        result = transform_in_blocks(self.data[:0], self.domain, 7)
+        self.assertEqual(result.X.shape, (0, len(self.domain.attributes)))
+
+    def test_out(self):
+        expected = self.data.transform(self.domain)
+        shape = (len(self.data), len(self.domain.attributes))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "X.npy")
+            out = np.lib.format.open_memmap(fn, mode="w+", shape=shape)
+            result = transform_in_blocks(self.data, self.domain, 10, out=out)
+            self.assertTrue(np.shares_memory(result.X, out))
+            np.testing.assert_equal(np.load(fn), expected.X)
+            del result, out
+        with self.assertRaises(ValueError):
+            transform_in_blocks(self.data, self.domain, 10, out=np.empty((1, 1)))
+
+    def test_rows_dependent(self):
+        # MNF estimates noise from differences between rows
+        data = MNFDenoising(components=2)(self.data)
+        data = Normalize(method=Normalize.SNV)(data)
+        domain = data.domain
+        self.assertFalse(domain_rows_independent(domain, self.data.domain))
+        self.assertTrue(domain_rows_independent(self.domain, self.data.domain))
+        expected = self.data.transform(domain)
+        result = transform_in_blocks(self.data, domain, 10)
+        np.testing.assert_almost_equal(result.X, expected.X)
+
+    def test_rows_dependent_below_other_shared(self):
+        data = MNFDenoising(components=2)(self.data)
+        x = getx(self.data)
+        points = np.linspace(x.min(), x.max(), 20)
+        domain = Interpolate(points)(data).domain
+        self.assertFalse(domain_rows_independent(domain, self.data.domain))
+        # through a single variable transformation
+        attributes = [
+            a.copy(compute_value=Normalizer(a, 0, 1)) for a in data.domain.attributes
+        ]
+        domain = Domain(attributes)
+        self.assertFalse(domain_rows_independent(domain, self.data.domain))
+        domain = Interpolate(points)(self.data).domain
+        self.assertTrue(domain_rows_independent(domain, self.data.domain))
+
+    def test_unknown_shared_rows_dependent(self):
+        class Unknown:
+            def __call__(self, data):
+                return data.X
+
+        attributes = [
+            a.copy(compute_value=SelectColumn(i, Unknown()))
+            for i, a in enumerate(self.data.domain.attributes)
+        ]
+        domain = Domain(attributes)
+        self.assertFalse(domain_rows_independent(domain, self.data.domain))
+
+    def test_callback(self):
+        parts = []
+        transform_in_blocks(self.data, self.domain, 10, callback=parts.append)
+        n = len(self.data)
+        self.assertEqual(parts, [start / n for start in range(0, n, 10)])
+        # deferred steps are transformed in blocks before PCA needs data
+        parts = []
+        deferred = DeferredPreprocessing(self.data, block_size=10)
+        deferred.apply(SavitzkyGolayFiltering(window=9, polyorder=2, deriv=0))
+        deferred.apply(PCADenoising(components=2), callback=parts.append)
+        self.assertEqual(len(parts), len(range(0, n, 10)))
+        deferred.apply(Normalize(method=Normalize.SNV))
+        parts = []
+        deferred.result(callback=parts.append)
+        self.assertEqual(len(parts), len(range(0, n, 10)))
+
+    def test_deferred(self):
+        deferred = DeferredPreprocessing(self.data, block_size=10)
+        deferred.apply(SavitzkyGolayFiltering(window=9, polyorder=2, deriv=0))
+        deferred.apply(Normalize(method=Normalize.SNV))
+        with patch(
+            "orangecontrib.spectroscopy.preprocess.utils.transform_in_blocks",
+            wraps=transform_in_blocks,
+        ) as blocks:
+            result = deferred.result()
+            blocks.assert_called_once()
+        expected = Normalize(method=Normalize.SNV)(
+            SavitzkyGolayFiltering(window=9, polyorder=2, deriv=0)(self.data)
+        )
+        np.testing.assert_almost_equal(result.X, expected.X)
+
+
+class TestInterpolatedReference(TestCase):
+    def test_interpolated_once(self):
+        data = SMALL_COLLAGEN
+        pp = EMSC(reference=data[:1], badspectra=data[1:3], weights=data[3:4])
+        with patch(
+            "orangecontrib.spectroscopy.preprocess.utils.interpolate_extend_to",
+            wraps=interpolate_extend_to,
+        ) as m:
+            processed = pp(data)
+            common = processed.domain[0].compute_value.compute_shared
+            transform_in_blocks(data, processed.domain, block_size=3)
+            # reference and bad spectra
+            self.assertEqual(m.call_count, 2)
+        cached = list(common._interpolated.values())
+        self.assertEqual(len(cached), 3)  # with weights
+        for _, X in cached:
+            self.assertFalse(X.flags.writeable)
+
+    def test_pickle(self):
+        data = SMALL_COLLAGEN
+        processed = SpSubtract(reference=data[:1], amount=0.5)(data)
+        common = processed.domain[0].compute_value.compute_shared
+        self.assertEqual(len(common._interpolated), 1)
+        unpickled = pickle.loads(pickle.dumps(processed.domain))
+        ucommon = unpickled[0].compute_value.compute_shared
+        self.assertEqual(len(ucommon._interpolated), 0)
+        np.testing.assert_equal(data.transform(unpickled).X, processed.X)
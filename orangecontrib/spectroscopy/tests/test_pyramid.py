@@ -0,0 +1,98 @@
+import unittest
+import warnings
+
+import numpy as np
+
+from orangecontrib.spectroscopy.utils.pyramid import ImagePyramid, PointLabels
+
+
+def block_reduce(image, f, function):
+    h, w = -(-image.shape[0] // f), -(-image.shape[1] // f)
+    padded = np.full((h * f, w * f) + image.shape[2:], np.nan)
+    padded[: image.shape[0], : image.shape[1]] = image
+    blocks = padded.reshape((h, f, w, f) + image.shape[2:])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return function(blocks, axis=(1, 3))
+
+
+class TestImagePyramid(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        cls.shape = (37, 53)
+        yy, xx = np.mgrid[: cls.shape[0], : cls.shape[1]]
+        keep = rng.random(yy.size) < 0.8
+        cls.y, cls.x = yy.ravel()[keep], xx.ravel()[keep]
+        cls.values = rng.random((len(cls.y), 2))
+        cls.values[rng.random(len(cls.y)) < 0.1, 0] = np.nan
+        cls.image = np.full(cls.shape + (2,), np.nan)
+        cls.image[cls.y, cls.x] = cls.values
+
+    def test_levels(self):
+        for max_pixels in [10**6, 100, 1]:
+            for reduction, function in [("mean", np.nanmean), ("max", np.nanmax)]:
+                pyramid = ImagePyramid(
+                    self.y, self.x, self.values, self.shape, reduction, max_pixels
+                )
+                self.assertEqual(pyramid.top, 6)
+                for level in range(pyramid.top + 1):
+                    expected = block_reduce(self.image, 2**level, function)
+                    h, w = pyramid.level_shape(level)
+                    self.assertEqual(expected.shape[:2], (h, w))
+                    np.testing.assert_allclose(
+                        pyramid.region(level, 0, h, 0, w), expected
+                    )
+                    np.testing.assert_allclose(
+                        pyramid.region(level, 1, h, 2, w), expected[1:h, 2:w]
+                    )
+
+    def test_precomputed(self):
+        pyramid = ImagePyramid(self.y, self.x, self.values, self.shape, max_pixels=100)
+        self.assertEqual(pyramid.precomputed_level, 3)
+        self.assertEqual(pyramid.level_shape(3), (5, 7))
+        self.assertEqual(len(pyramid._levels), 4)
+
+    def test_precomputed_sparse(self):
+        pyramid = ImagePyramid(
+            np.array([0, 999]), np.array([0, 999]), np.array([1.0, 2]), (1000, 1000)
+        )
+        self.assertLessEqual(np.prod(pyramid.level_shape(pyramid.precomputed_level)), 8)
+        np.testing.assert_equal(
+            pyramid.region(0, 999, 1000, 998, 1000)[..., 0], [[np.nan, 2]]
+        )
+
+    def test_duplicates(self):
+        pyramid = ImagePyramid(
+            np.array([0, 0, 1]), np.array([1, 1, 0]), np.array([1.0, 3, 5]), (2, 2)
+        )
+        np.testing.assert_equal(
+            pyramid.region(0, 0, 2, 0, 2)[..., 0], [[np.nan, 2], [5, np.nan]]
+        )
+        np.testing.assert_equal(pyramid.region(1, 0, 1, 0, 1)[..., 0], [[3]])
+
+    def test_invalid_reduction(self):
+        with self.assertRaises(ValueError):
+            ImagePyramid(self.y, self.x, self.values, self.shape, "median")
+
+
+class TestPointLabels(unittest.TestCase):
+    def test_region(self):
+        rng = np.random.default_rng(0)
+        shape = (37, 53)
+        y, x = rng.integers(0, shape[0], 500), rng.integers(0, shape[1], 500)
+        labels = rng.integers(0, 4, 500).astype(np.uint8)
+        image = np.zeros(shape, dtype=np.uint8)
+        np.maximum.at(image, (y, x), labels)
+        point_labels = PointLabels(y, x, labels)
+        self.assertEqual(len(point_labels), np.count_nonzero(labels))
+        for level in [0, 1, 3, 6]:
+            expected = block_reduce(image.astype(float), 2**level, np.nanmax)
+            h, w = expected.shape
+            region = point_labels.region(level, h // 3, h, w // 3, w)
+            self.assertEqual(region.dtype, np.uint8)
+            np.testing.assert_equal(region, expected[h // 3 :, w // 3 :])
+
+
+if __name__ == "__main__":
+    unittest.main()
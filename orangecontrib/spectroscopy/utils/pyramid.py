@@ -0,0 +1,184 @@
+"""
+Multi-resolution images of values at points on a grid.
+
+A pixel at level k of an ImagePyramid combines a block of 2**k x 2**k grid
+pixels. Coarse levels are precomputed. Regions of finer levels are computed
+from points when they are needed, so memory does not grow with the size of
+the full resolution image. For sparse points, precomputed levels are also
+limited by the number of points.
+"""
+
+import numpy as np
+
+
+# the finest precomputed level has at most this many pixels
+PRECOMPUTED_MAX_PIXELS = 1024 * 1024
+
+# ... and at most this many pixels per point
+PRECOMPUTED_PIXELS_PER_POINT = 4
+
+
+def _pad_even(array, fill):
+    pad = [(0, s % 2) for s in array.shape[:2]] + [(0, 0)] * (array.ndim - 2)
+    return np.pad(array, pad, constant_values=fill)
+
+
+def _block_sum(array):
+    return array[0::2, 0::2] + array[1::2, 0::2] + array[0::2, 1::2] + array[1::2, 1::2]
+
+
+def _block_max(array):
+    return np.fmax(
+        np.fmax(array[0::2, 0::2], array[1::2, 0::2]),
+        np.fmax(array[0::2, 1::2], array[1::2, 1::2]),
+    )
+
+
+class ImagePyramid:
+    """
+    Images of values at points with pixel indices (yindex, xindex) on a grid
+    of the given shape. Pixels of images at coarser levels are means ("mean")
+    or maxima ("max") of the points they cover; pixels without points are NaN.
+
+    Args:
+        yindex, xindex (np.ndarray): pixel rows and columns of points
+        values (np.ndarray): values of points, one column per channel
+        shape (tuple): the number of grid rows and columns
+        reduction (str): "mean" or "max"
+        max_pixels (int): the size limit of precomputed levels; for sparse
+            points the limit is PRECOMPUTED_PIXELS_PER_POINT times the
+            number of points
+    """
+
+    def __init__(
+        self,
+        yindex,
+        xindex,
+        values,
+        shape,
+        reduction="mean",
+        max_pixels=PRECOMPUTED_MAX_PIXELS,
+    ):
+        self.shape = tuple(shape)
+        self.top = max(int(np.ceil(np.log2(max(self.shape)))), 0)
+        # points are sorted by rows so that regions are found with bisection
+        self._order = np.argsort(yindex, kind="stable")
+        self._y = np.asarray(yindex)[self._order]
+        self._x = np.asarray(xindex)[self._order]
+        max_pixels = min(max_pixels, PRECOMPUTED_PIXELS_PER_POINT * len(self._y))
+        level = 0
+        while level < self.top and np.prod(self.level_shape(level)) > max_pixels:
+            level += 1
+        self.precomputed_level = level
+        if reduction not in ("mean", "max"):
+            raise ValueError(f"Unknown reduction: {reduction}")
+        self.reduction = reduction
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, None]
+        self._values = values[self._order]
+        shape = self.level_shape(self.precomputed_level)
+        image, counts = self._from_points(
+            self.precomputed_level, 0, shape[0], 0, shape[1]
+        )
+        self._levels = [image]
+        for _ in range(self.precomputed_level, self.top):
+            image, counts = self._reduce(image, counts)
+            self._levels.append(image)
+
+    def level_shape(self, level):
+        f = 2**level
+        return -(-self.shape[0] // f), -(-self.shape[1] // f)
+
+    def region(self, level, y0, y1, x0, x1):
+        """Return pixels [y0:y1, x0:x1] of an image (rows, columns, channels)."""
+        if level >= self.precomputed_level:
+            return self._levels[level - self.precomputed_level][y0:y1, x0:x1]
+        return self._from_points(level, y0, y1, x0, x1)[0]
+
+    def _from_points(self, level, y0, y1, x0, x1):
+        f = 2**level
+        lo, hi = np.searchsorted(self._y, [y0 * f, y1 * f])
+        y = self._y[lo:hi] // f - y0
+        x = self._x[lo:hi] // f - x0
+        inside = (x >= 0) & (x < x1 - x0)
+        shape = (y1 - y0, x1 - x0)
+        flat = np.ravel_multi_index((y[inside], x[inside]), shape)
+        values = self._values[lo:hi][inside]
+
+        size = shape[0] * shape[1]
+        image = np.full((size, values.shape[1]), np.nan)
+        counts = None
+        if self.reduction == "mean":
+            counts = np.zeros((size, values.shape[1]))
+            for i, v in enumerate(values.T):
+                known = ~np.isnan(v)
+                sums = np.bincount(flat[known], weights=v[known], minlength=size)
+                counts[:, i] = np.bincount(flat[known], minlength=size)
+                with np.errstate(invalid="ignore"):
+                    image[:, i] = sums / counts[:, i]
+            counts = counts.reshape(shape + (values.shape[1],))
+        else:
+            for i, v in enumerate(values.T):
+                np.fmax.at(image[:, i], flat, v)
+        return image.reshape(shape + (values.shape[1],)), counts
+
+    def _reduce(self, image, counts):
+        image = _pad_even(image, np.nan)
+        if self.reduction == "max":
+            return _block_max(image), None
+        counts = _pad_even(counts, 0)
+        sums = _block_sum(np.where(counts > 0, image * counts, 0))
+        counts = _block_sum(counts)
+        with np.errstate(invalid="ignore"):
+            return sums / counts, counts
+
+
+class PointLabels:
+    """
+    Images of non-negative integer labels of points (such as selection groups)
+    at the levels of an ImagePyramid. A pixel shows the largest label of its
+    points, or 0. Only points with nonzero labels are kept and images are
+    computed for regions when they are needed, so that labels of many points
+    can change often.
+
+    Args:
+        yindex, xindex (np.ndarray): pixel rows and columns of points
+        labels (np.ndarray): labels of points
+    """
+
+    def __init__(self, yindex, xindex, labels):
+        labelled = labels != 0
+        if not labelled.all():
+            yindex, xindex, labels = (
+                yindex[labelled],
+                xindex[labelled],
+                labels[labelled],
+            )
+        # smaller indices are faster to go through for every region
+        self._y = yindex.astype(np.int32)
+        self._x = xindex.astype(np.int32)
+        self._labels = labels
+
+    def __len__(self):
+        return len(self._labels)
+
+    def region(self, level, y0, y1, x0, x1):
+        """Return pixels [y0:y1, x0:x1] of an image at the level."""
+        h, w = y1 - y0, x1 - x0
+        y = (self._y >> level) - y0
+        x = (self._x >> level) - x0
+        flat = y * w + x
+        labels = self._labels
+        if y0 > 0 or x0 > 0 or (y >= h).any() or (x >= w).any():
+            inside = (y >= 0) & (y < h) & (x >= 0) & (x < w)
+            flat, labels = flat[inside], labels[inside]
+        image = np.zeros(h * w, dtype=labels.dtype)
+        present = np.flatnonzero(np.bincount(labels))
+        if len(present) == 1:
+            image[flat] = present[0]
+        else:
+            # larger labels are written later
+            for label in present:
+                image[flat[labels == label]] = label
+        return image.reshape(h, w)
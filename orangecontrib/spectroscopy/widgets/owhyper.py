@@ -38,7 +38,6 @@ from AnyQt.QtCore import pyqtSignal as Signal
 
 import bottleneck
 import numpy as np
-import pandas as pd
 import pyqtgraph as pg
 from pyqtgraph import GraphicsWidget
 import colorcet
@@ -66,11 +65,14 @@ from Orange.widgets.visualize.owscatterplotgraph import ScatterPlotItem
 from orangewidget.utils.visual_settings_dlg import VisualSettingsDialog
 
 from orangecontrib.spectroscopy.preprocess import Integrate
+from orangecontrib.spectroscopy.preprocess.integrate import IntegralIndex
 from orangecontrib.spectroscopy.utils import (
     values_to_linspace,
     index_values_nan,
     split_to_size,
 )
+from orangecontrib.spectroscopy.utils.pyramid import ImagePyramid, PointLabels
+from orangecontrib.spectroscopy.utils.skimage.shape import view_as_blocks
 
 from orangecontrib.spectroscopy.widgets.owspectra import (
     InteractiveViewBox,
@@ -104,6 +106,15 @@ from orangecontrib.spectroscopy.widgets.utils import (
 
 IMAGE_TOO_BIG = 1024 * 1024 * 100
 
+# larger images are shown at the level of detail matching the zoom
+IMAGE_LOD = 2048 * 2048
+
+# images larger than SPARSE_MIN_PIXELS with at most SPARSE_FILL_RATIO of pixels
+# with data (irregular maps, line scans) are also drawn from points with levels
+# of detail, so that memory does not grow with the extent of the image
+SPARSE_MIN_PIXELS = 512 * 512
+SPARSE_FILL_RATIO = 0.05
+
 
 NAN_COLOR = (100, 100, 100, 255)
 
@@ -204,11 +215,26 @@ class ImageItemNan(pg.ImageItem):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.selection = None
+        self.full_rect = None
+        self.dataBounds = None  # ViewBox uses the boundingRect
 
     def setSelection(self, selection):
         self.selection = selection
         self.updateImage()
 
+    def setFullRect(self, rect):
+        """Set the area of the whole image if only its part is shown,
+        so that the whole image is considered for auto-ranging."""
+        self.full_rect = rect
+        self.dataBounds = None if rect is None else self._full_bounds
+        self.informViewBoundsChanged()
+
+    def _full_bounds(self, axis, frac=1.0, orthoRange=None):
+        rect = self.mapRectFromParent(self.full_rect)
+        if axis == 0:
+            return rect.left(), rect.right()
+        return rect.top(), rect.bottom()
+
     def render(self):
         # simplified pg.ImageITem
 
@@ -375,12 +401,50 @@ def vector_color_model(colors):
     return model
 
 
-def circular_mean(degs):
-    sin = np.nansum(np.sin(np.radians(degs * 2)))
-    cos = np.nansum(np.cos(np.radians(degs * 2)))
+def circular_mean(degs, axis=None):
+    sin = np.nansum(np.sin(np.radians(degs * 2)), axis=axis)
+    cos = np.nansum(np.cos(np.radians(degs * 2)), axis=axis)
     return np.arctan2(sin, cos) / 2
 
 
+def pixel_means(yindex, xindex, values):
+    """
+    Average values (columns) of points in the same pixel. Pixels are placed
+    on a grid of only the rows and columns with any points.
+    Return grids of means for each column of values and point counts,
+    and the row and column indices of the grid.
+    """
+    rows, yi = np.unique(yindex, return_inverse=True)
+    cols, xi = np.unique(xindex, return_inverse=True)
+    shape = (len(rows), len(cols))
+    flat = np.ravel_multi_index((yi, xi), shape)
+    size = shape[0] * shape[1]
+    counts = np.bincount(flat, minlength=size).reshape(shape)
+    means = np.empty((values.shape[1],) + shape)
+    for i, v in enumerate(values.T):
+        known = ~np.isnan(v)
+        sums = np.bincount(flat[known], weights=v[known], minlength=size)
+        n = np.bincount(flat[known], minlength=size)
+        with np.errstate(invalid="ignore"):
+            means[i] = (sums / n).reshape(shape)
+    return means, counts, rows, cols
+
+
+def bin_blocks(grid, bin_sz):
+    """
+    Return a view of centered bin_sz x bin_sz blocks of the grid,
+    with block values in the last axis. Incomplete blocks on edges are left out.
+    """
+    start = tuple((s % bin_sz) // 2 for s in grid.shape)
+    stop = tuple(
+        st + s // bin_sz * bin_sz for st, s in zip(start, grid.shape, strict=True)
+    )
+    view = view_as_blocks(
+        grid[start[0] : stop[0], start[1] : stop[1]], (bin_sz, bin_sz)
+    )
+    return view.reshape(view.shape[:2] + (-1,))
+
+
 class VectorSettingMixin:
     show_vector_plot = Setting(False, schema_only=True)
     vector_angle = ContextSetting(None)
@@ -728,79 +792,28 @@ class VectorMixin:
                 self.v_bin_change = 0
                 self.vector_plot.hide()
             else:
-                th = np.asarray(v[:, 0], dtype=float)
-                v_mag = np.asarray(v[:, 1], dtype=float)
-                col = np.asarray(v[:, 2], dtype=float)
-                y = np.linspace(*lsy)[yindex]
-                x = np.linspace(*lsx)[xindex]
-                df = pd.DataFrame(
-                    [x, y, np.asarray([1 if i else 0 for i in valid]), v_mag, th, col],
-                    index=['x', 'y', 'valid', 'v_mag', 'th', 'cols'],
-                ).T
-
-                v_df = df.pivot_table(
-                    values='valid', columns='x', index='y', fill_value=0
+                values = np.asarray(v[valid], dtype=float)  # th, v_mag, cols
+                means, counts, rows, columns = pixel_means(
+                    yindex[valid], xindex[valid], values
                 )
-                a_df = df.pivot_table(values='v_mag', columns='x', index='y')
-                th_df = df.pivot_table(values='th', columns='x', index='y')
-                col_df = df.pivot_table(values='cols', columns='x', index='y')
                 bin_sz = self.v_bin + 1
-                if bin_sz > v_df.shape[0] or bin_sz > v_df.shape[1]:
-                    bin_sz = v_df.shape[0] if bin_sz > v_df.shape[0] else v_df.shape[1]
+                if bin_sz > min(counts.shape):
+                    bin_sz = min(counts.shape)
                     self.parent.Warning.bin_size_error(bin_sz, bin_sz)
-                x_mod, y_mod = v_df.shape[1] % bin_sz, v_df.shape[0] % bin_sz
-                st_x_idx = int(np.floor(x_mod / 2))
-                st_y_idx = int(np.floor(y_mod / 2))
-
-                nvalid = np.zeros(
-                    (
-                        int((v_df.shape[0] - y_mod) / bin_sz),
-                        int((v_df.shape[1] - x_mod) / bin_sz),
-                    )
-                )
-                a = np.zeros(
-                    (
-                        int((v_df.shape[0] - y_mod) / bin_sz),
-                        int((v_df.shape[1] - x_mod) / bin_sz),
-                    )
-                )
-                th = np.zeros(
-                    (
-                        int((v_df.shape[0] - y_mod) / bin_sz),
-                        int((v_df.shape[1] - x_mod) / bin_sz),
-                    )
-                )
-                cols = np.zeros(
-                    (
-                        int((v_df.shape[0] - y_mod) / bin_sz),
-                        int((v_df.shape[1] - x_mod) / bin_sz),
-                    )
-                )
-                columns = v_df.columns
-                rows = v_df.index
-                new_xs, new_ys = [], []
-                for i in range(st_y_idx, v_df.shape[0] - y_mod, bin_sz):
-                    for j in range(st_x_idx, v_df.shape[1] - x_mod, bin_sz):
-                        nvalid[int(i / bin_sz), int(j / bin_sz)] = np.nanmean(
-                            v_df.iloc[i : i + bin_sz, j : j + bin_sz].to_numpy()
-                        )
-                        a[int(i / bin_sz), int(j / bin_sz)] = np.nanmean(
-                            a_df.iloc[i : i + bin_sz, j : j + bin_sz].to_numpy()
-                        )
-                        th[int(i / bin_sz), int(j / bin_sz)] = circular_mean(
-                            th_df.iloc[i : i + bin_sz, j : j + bin_sz].to_numpy()
-                        )
-                        cols[int(i / bin_sz), int(j / bin_sz)] = np.nanmean(
-                            col_df.iloc[i : i + bin_sz, j : j + bin_sz].to_numpy()
-                        )
-                        new_xs.append(np.sum(columns[j : j + bin_sz]) / bin_sz)
-                        new_ys.append(np.sum(rows[i : i + bin_sz]) / bin_sz)
-                nvalid = nvalid.flatten() > 0 & ~np.isnan(nvalid.flatten())
+
+                nvalid = bin_blocks(counts, bin_sz).any(axis=2).flatten()
+                th = circular_mean(bin_blocks(means[0], bin_sz), axis=2)
+                a = bottleneck.nanmean(bin_blocks(means[1], bin_sz), axis=2)
+                cols = bottleneck.nanmean(bin_blocks(means[2], bin_sz), axis=2)
+                xs = np.broadcast_to(np.linspace(*lsx)[columns], counts.shape)
+                ys = np.broadcast_to(np.linspace(*lsy)[rows][:, None], counts.shape)
+                new_xs = bin_blocks(xs, bin_sz).mean(axis=2)
+                new_ys = bin_blocks(ys, bin_sz).mean(axis=2)
                 self.a = a.flatten()[nvalid]
                 self.th = th.flatten()[nvalid]
                 self.cols = cols.flatten()[nvalid]
-                self.new_xs = np.asarray(new_xs)[nvalid]
-                self.new_ys = np.asarray(new_ys)[nvalid]
+                self.new_xs = new_xs.flatten()[nvalid]
+                self.new_ys = new_ys.flatten()[nvalid]
                 if self.v_bin_change == 1:
                     self.v_bin_change = 0
                     self.update_vectors()
@@ -1506,6 +1519,9 @@ class BasicImagePlot(
 ):
     gamma = Setting(0)
 
+    # show large images from an image pyramid
+    level_of_detail = True
+
     selection_changed = Signal()
     image_updated = Signal()
 
@@ -1533,6 +1549,9 @@ class BasicImagePlot(
         self.data_valid_positions = None
         self.xindex = None
         self.yindex = None
+        self.pyramid = None
+        self.selection_labels = None
+        self.lod_shown = None  # (level, y0, y1, x0, x1) of the shown pyramid region
 
         self.plotview = GraphicsView()
         ci = pg.GraphicsLayout()
@@ -1558,6 +1577,8 @@ class BasicImagePlot(
         self.vis_img.setOpts(axisOrder='row-major')
         self.plot.vb.setAspectLocked()
         self.plot.scene().sigMouseMoved.connect(self.plot.vb.mouseMovedEvent)
+        self.plot.vb.sigRangeChanged.connect(self.update_lod_image)
+        self.plot.vb.sigResized.connect(self.update_lod_image)
 
         layout = QGridLayout()
         self.plotview.setLayout(layout)
@@ -1610,6 +1631,9 @@ class BasicImagePlot(
 
         self.data = None
         self.data_ids = {}
+        # parts of data with their IntegralIndex, built with the first
+        # integral image and reused for changed limits
+        self.integral_index = None
 
         self.image_updated.connect(self.refresh_img_selection)
 
@@ -1663,11 +1687,23 @@ class BasicImagePlot(
         else:
             self.data = None
             self.data_ids = {}
+        self.integral_index = None
         self.selection_distances = None
 
     def refresh_img_selection(self):
         if self.lsx is None or self.lsy is None:
             return
+        if self.pyramid is not None:
+            # selected pixels are computed with shown regions
+            labels = PointLabels(
+                self.yindex,
+                self.xindex,
+                np.where(self.data_valid_positions, self.selection_group, 0),
+            )
+            self.selection_labels = labels if len(labels) else None
+            self.lod_shown = None
+            self.update_lod_image()
+            return
         selected_px = np.zeros((self.lsy[2], self.lsx[2]), dtype=np.uint8)
         selected_px[
             self.data_imagepixels[self.data_valid_positions, 0],
@@ -1716,6 +1752,7 @@ class BasicImagePlot(
         self.parent.Information.not_shown.clear()
         self.img.clear()
         self.img.setSelection(None)
+        self.img.setFullRect(None)
         self.legend.set_colors(None)
         self.lsx = None
         self.lsy = None
@@ -1725,6 +1762,9 @@ class BasicImagePlot(
         self.data_valid_positions = None
         self.xindex = None
         self.yindex = None
+        self.pyramid = None
+        self.selection_labels = None
+        self.lod_shown = None
 
         self.start(
             self.compute_image,
@@ -1733,6 +1773,8 @@ class BasicImagePlot(
             self.attr_y,
             self.parent.image_values(),
             self.parent.image_values_fixed_levels(),
+            self.integral_index,
+            self.level_of_detail,
         )
 
     def set_visible_image(self, img: np.ndarray, rect: QRectF):
@@ -1760,6 +1802,8 @@ class BasicImagePlot(
         attr_y,
         image_values,
         image_values_fixed_levels,
+        integral_index,
+        level_of_detail,
         state: TaskState,
     ):
         if data is None or attr_x is None or attr_y is None:
@@ -1784,9 +1828,18 @@ class BasicImagePlot(
         res.lsx = lsx = values_to_linspace(res.coorx)
         res.lsy = lsy = values_to_linspace(res.coory)
         res.image_values_fixed_levels = image_values_fixed_levels
+        res.integral_index = integral_index
+        res.pyramid = None
         progress_interrupt(0)
 
-        if lsx is not None and lsy is not None and lsx[-1] * lsy[-1] > IMAGE_TOO_BIG:
+        image_size = lsx[-1] * lsy[-1] if lsx is not None and lsy is not None else 0
+        n_points = np.count_nonzero(~np.isnan(res.coorx) & ~np.isnan(res.coory))
+        sparse = (
+            image_size > SPARSE_MIN_PIXELS
+            and n_points <= SPARSE_FILL_RATIO * image_size
+        )
+        res.level_of_detail = level_of_detail and (image_size > IMAGE_LOD or sparse)
+        if not res.level_of_detail and image_size > IMAGE_TOO_BIG:
             raise ImageTooBigException((lsx[-1], lsy[-1]))
 
         ims = image_values(data[:1]).X
@@ -1795,7 +1848,22 @@ class BasicImagePlot(
 
         step = 100000 if len(data) > 1e6 else 10000
 
-        if lsx is not None and lsy is not None:
+        if lsx is not None and lsy is not None and isinstance(image_values, Integrate):
+            # integrals for changed limits are computed from indices,
+            # which are built part-wise with the first integral image
+            if integral_index is None:
+                res.integral_index = [
+                    (slice, None) for slice in split_to_size(len(data), step)
+                ]
+            for i, (slice, index) in enumerate(res.integral_index):
+                if index is None:
+                    index = IntegralIndex(data[slice])
+                    res.integral_index[i] = slice, index
+                    progress_interrupt(0)
+                d[slice, :] = index.compute(image_values)
+                progress_interrupt(0)
+                state.set_partial_result(res)
+        elif lsx is not None and lsy is not None:
             # the code below does this, but part-wise:
             # d = image_values(data).X[:, 0]
             for slice in split_to_size(len(data), step):
@@ -1806,6 +1874,15 @@ class BasicImagePlot(
 
         progress_interrupt(0)
 
+        if res.level_of_detail:
+            xindex, xnan = index_values_nan(res.coorx, lsx)
+            yindex, ynan = index_values_nan(res.coory, lsy)
+            valid = np.logical_not(np.logical_or(xnan, ynan))
+            res.pyramid = ImagePyramid(
+                yindex[valid], xindex[valid], d[valid], (lsy[2], lsx[2])
+            )
+            progress_interrupt(0)
+
         return res
 
     def draw(self, res, finished=False):
@@ -1817,6 +1894,7 @@ class BasicImagePlot(
         if finished:
             self.lsx, self.lsy = lsx, lsy
             self.data_points = res.data_points
+            self.integral_index = res.integral_index
 
         xindex, xnan = index_values_nan(res.coorx, lsx)
         yindex, ynan = index_values_nan(res.coory, lsy)
@@ -1828,12 +1906,33 @@ class BasicImagePlot(
             if invalid_positions:
                 self.parent.Information.not_shown(invalid_positions)
 
-        if lsx is not None and lsy is not None:
-            imdata = np.ones((lsy[2], lsx[2], d.shape[1])) * float("nan")
-            imdata[yindex[valid], xindex[valid]] = d[valid]
+        # pyramids are only available for finished images
+        if (
+            lsx is not None
+            and lsy is not None
+            and (finished or not res.level_of_detail)
+        ):
+            # shift centres of the pixels so that the axes are useful
+            shiftx = _shift(lsx)
+            shifty = _shift(lsy)
+            left = lsx[0] - shiftx
+            bottom = lsy[0] - shifty
+            width = (lsx[1] - lsx[0]) + 2 * shiftx
+            height = (lsy[1] - lsy[0]) + 2 * shifty
+            rect = QRectF(left, bottom, width, height)
+
+            if res.level_of_detail:
+                self.pyramid = res.pyramid
+                self.lod_shown = None
+                self.img.setFullRect(rect)
+                self.update_lod_image()
+            else:
+                imdata = np.ones((lsy[2], lsx[2], d.shape[1])) * float("nan")
+                imdata[yindex[valid], xindex[valid]] = d[valid]
+                self.img.setImage(imdata, autoLevels=False)
+                self.img.setRect(rect)
 
             self.data_imagepixels = np.vstack((yindex, xindex)).T
-            self.img.setImage(imdata, autoLevels=False)
             self.update_levels()
             self.update_rgb_levels()
             self.update_color_schema()
@@ -1843,18 +1942,73 @@ class BasicImagePlot(
             self.yindex = yindex
             self.xindex = xindex
 
-            # shift centres of the pixels so that the axes are useful
-            shiftx = _shift(lsx)
-            shifty = _shift(lsy)
-            left = lsx[0] - shiftx
-            bottom = lsy[0] - shifty
-            width = (lsx[1] - lsx[0]) + 2 * shiftx
-            height = (lsy[1] - lsy[0]) + 2 * shifty
-            self.img.setRect(QRectF(left, bottom, width, height))
-
         if finished:
             self.image_updated.emit()
 
+    def update_lod_image(self):
+        """Show the region of the pyramid in view at the matching level."""
+        if self.pyramid is None:
+            return
+        vb = self.plot.vb
+        (vx0, vx1), (vy0, vy1) = vb.viewRange()
+        if vb.width() <= 0 or vb.height() <= 0:
+            return
+        dx, dy = 2 * _shift(self.lsx), 2 * _shift(self.lsy)
+        left, bottom = self.lsx[0] - dx / 2, self.lsy[0] - dy / 2
+
+        # the coarsest level with at least one screen pixel per image pixel
+        density = max((vx1 - vx0) / vb.width() / dx, (vy1 - vy0) / vb.height() / dy)
+        level = min(int(np.log2(max(density, 1))), self.pyramid.top)
+        f = 2**level
+        h, w = self.pyramid.level_shape(level)
+
+        def clip(a, b, size):
+            # show at least one pixel so that images are never empty
+            a = min(max(a, 0), size - 1)
+            return a, max(min(b, size), a + 1)
+
+        y0, y1 = clip(
+            int(np.floor((vy0 - bottom) / (dy * f))),
+            int(np.ceil((vy1 - bottom) / (dy * f))),
+            h,
+        )
+        x0, x1 = clip(
+            int(np.floor((vx0 - left) / (dx * f))),
+            int(np.ceil((vx1 - left) / (dx * f))),
+            w,
+        )
+        shown = self.lod_shown
+        if (
+            shown is not None
+            and shown[0] == level
+            and shown[1] <= y0
+            and y1 <= shown[2]
+            and shown[3] <= x0
+            and x1 <= shown[4]
+        ):
+            return
+
+        # add margins so that panning does not need new images immediately
+        my, mx = (y1 - y0) // 2, (x1 - x0) // 2
+        y0, y1 = max(y0 - my, 0), min(y1 + my, h)
+        x0, x1 = max(x0 - mx, 0), min(x1 + mx, w)
+        self.lod_shown = level, y0, y1, x0, x1
+
+        selection = None
+        if self.selection_labels is not None:
+            selection = self.selection_labels.region(level, y0, y1, x0, x1)
+            selection = selection.astype(np.uint8)
+        self.img.selection = selection
+        self.img.setImage(self.pyramid.region(level, y0, y1, x0, x1), autoLevels=False)
+        self.img.setRect(
+            QRectF(
+                left + x0 * f * dx,
+                bottom + y0 * f * dy,
+                (x1 - x0) * f * dx,
+                (y1 - y0) * f * dy,
+            )
+        )
+
     def on_done(self, res):
         self.draw(res, finished=True)
 
@@ -28,6 +28,9 @@ class AImagePlot(BasicImagePlot):
     attr_x = None  # not settings, set from the parent class
     attr_y = None
 
+    # the whole image is needed for the overlay
+    level_of_detail = False
+
     def __init__(self, parent):
         super().__init__(parent)
         self.axes_settings_box.hide()
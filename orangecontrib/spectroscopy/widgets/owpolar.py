@@ -1,17 +1,11 @@
-import time
 import os
-import multiprocessing
-from multiprocessing.managers import SharedMemoryManager
 from typing import List, Optional, Sequence
 
-import math
 from types import SimpleNamespace
 import numpy as np
-import pandas as pd
 from AnyQt.QtCore import QItemSelectionModel, QItemSelection, QItemSelectionRange, Qt
 from AnyQt.QtWidgets import QFormLayout, QWidget, QListView, QLabel, QSizePolicy
 from AnyQt.QtGui import QDoubleValidator
-from scipy.optimize import curve_fit
 
 
 import Orange.data
@@ -200,106 +194,80 @@ def run(
     return results
 
 
-# Calculate by fitting to function
+# The model is linear in its parameters a0, a1 and a2, so it is fitted
+# in closed form for all pixels and features at once
 def azimuth(x, a0, a1, a2):
     t = 2 * np.radians(x)
     return a0 * np.sin(t) + a1 * np.cos(t) + a2
 
 
-def azimuth_jac(x, a0, a1, a2):
-    t = 2 * np.radians(x).reshape(-1, 1)
-    da0 = np.sin(t)
-    da1 = np.cos(t)
-    da2 = np.ones(t.shape)
-    return np.hstack((da0, da1, da2))
+def design_matrix(polangles):
+    t = 2 * np.radians(np.asarray(polangles, dtype=float))
+    return np.column_stack((np.sin(t), np.cos(t), np.ones_like(t)))
+
+
+def fit_azimuth(values, polangles):
+    """
+    Least-squares fit of azimuth to values at polangles (the last axis).
+    Return parameters (a0, a1, a2 in the last axis), R-squared and the
+    total sum of squares. Fits of values with NaNs are NaN.
+    """
+    design = design_matrix(polangles)
+    params = values @ np.linalg.pinv(design).T
+    ss_res = np.sum((values - params @ design.T) ** 2, axis=-1)
+    ss_tot = np.sum((values - np.mean(values, axis=-1, keepdims=True)) ** 2, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r2 = 1 - ss_res / ss_tot
+    return params, r2, ss_tot
 
 
 def calc_angles(a0, a1):
-    return np.degrees(0.5 * np.arctan(a0 / a1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.degrees(0.5 * np.arctan(a0 / a1))
 
 
 def ampl2(a0, a1):
-    return 2 * (math.sqrt(a0**2 + a1**2))
+    return 2 * np.sqrt(a0**2 + a1**2)
 
 
 def orfunc(alpha, a0, a1, a2):
-    if alpha < 54.73:
-        Dmax = (2 * a2 + 2 * math.sqrt(a0**2 + a1**2)) / (
-            2 * a2 - 2 * math.sqrt(a0**2 + a1**2)
+    ampl = np.sqrt(a0**2 + a1**2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # dichroic ratio: Dmax for alpha < 54.73, Dmin otherwise
+        D = np.where(
+            alpha < 54.73,
+            (2 * a2 + 2 * ampl) / (2 * a2 - 2 * ampl),
+            (2 * a2 - 2 * ampl) / (2 * a2 + 2 * ampl),
         )
-        return (Dmax - 1) / (Dmax + 2) * (2 / (3 * np.cos(np.radians(alpha)) ** 2 - 1))
-    elif alpha >= 54.73:
-        Dmin = (2 * a2 - 2 * math.sqrt(a0**2 + a1**2)) / (
-            2 * a2 + 2 * math.sqrt(a0**2 + a1**2)
-        )
-        return (Dmin - 1) / (Dmin + 2) * (2 / (3 * np.cos(np.radians(alpha)) ** 2 - 1))
-    return None
-
-
-def find_az(params):
-    Az0 = calc_angles(params[0], params[1])
-    Abs0 = azimuth(Az0, *params)
-    Az1 = calc_angles(params[0], params[1]) + 90
-    Abs1 = azimuth(Az1, *params)
-    Az2 = calc_angles(params[0], params[1]) - 90
-
-    if Abs0 > Abs1:
-        Az = Az0
-    elif Abs1 > Abs0:
-        if Az1 < 90:
-            Az = Az1
-        elif Az1 > 90:
-            Az = Az2
-    return Az
-
-
-def compute(xys, yidx, smms, shapes, dtypes, polangles):
-    tcvs = smms[0]
-    cvs = np.ndarray(shapes[0], dtype=dtypes[0], buffer=tcvs.buf)
-    tout = smms[3]
-    out = np.ndarray(shapes[3], dtype=dtypes[3], buffer=tout.buf)
-    tmod = smms[4]
-    mod = np.ndarray(shapes[4], dtype=dtypes[4], buffer=tmod.buf)
-    tcoords = smms[5]
-    coords = np.ndarray(shapes[5], dtype=dtypes[5], buffer=tcoords.buf)
-    tvars = smms[6]
-    vars = np.ndarray(shapes[6], dtype=dtypes[6], buffer=tvars.buf)
-
-    x = np.asarray(polangles)
-
-    for i in range(yidx[0], yidx[1]):  # y-values(rows)
-        if vars[-1] != 0:
-            break
-        for j in enumerate(xys[0]):  # x-values(cols)
-            if vars[-1] != 0:
-                break
-            for l in range(cvs.shape[2]):
-                if np.any(np.isnan(cvs[i, j[0], l, :]), axis=0):
-                    continue
-                out[i, j[0], l, 0] = coords[i, j[0], 1]  # x-map
-                mod[i, j[0], l, 0] = coords[i, j[0], 1]
-                out[i, j[0], l, 1] = coords[i, j[0], 0]  # y-map
-                mod[i, j[0], l, 1] = coords[i, j[0], 0]
-
-                temp = list(cvs[i, j[0], l, :])
-
-                params = curve_fit(azimuth, x, temp, jac=azimuth_jac)[0]
-
-                residuals = temp - azimuth(x, *params)
-                ss_res = np.sum(residuals**2)
-                ss_tot = np.sum((temp - np.mean(temp)) ** 2)
-                if ss_tot == 0:
-                    vars[-1] = 1
-                    break
-                out[i, j[0], l, 6] = 1 - (ss_res / ss_tot)
-                mod[i, j[0], l, 2] = 1 - (ss_res / ss_tot)
-                out[i, j[0], l, 2] = find_az(params)
-                out[i, j[0], l, 3] = orfunc(vars[l], *params)
-                out[i, j[0], l, 4] = params[2]
-                out[i, j[0], l, 5] = ampl2(params[0], params[1])
-                mod[i, j[0], l, 3] = params[0]
-                mod[i, j[0], l, 4] = params[1]
-                mod[i, j[0], l, 5] = params[2]
+        return (D - 1) / (D + 2) * (2 / (3 * np.cos(np.radians(alpha)) ** 2 - 1))
+
+
+def find_az(a0, a1, a2):
+    """Return the angle of maximal absorbance within [-90, 90)."""
+    Az0 = calc_angles(a0, a1)
+    Abs0 = azimuth(Az0, a0, a1, a2)
+    Abs1 = azimuth(Az0 + 90, a0, a1, a2)
+    return np.where(Abs0 > Abs1, Az0, np.where(Az0 < 0, Az0 + 90, Az0 - 90))
+
+
+def compute(cvs, polangles, alphas):
+    """
+    Fit values at polarization angles (the last axis of cvs) for every pixel
+    and feature (the second to last axis, with alphas). Return outputs
+    (azimuth, orientation function, intensity, amplitude, R-squared) and model
+    (R-squared, a0, a1, a2), both in the last axis, and the error state,
+    which is 1 if any values do not change with angles.
+    """
+    params, r2, ss_tot = fit_azimuth(cvs, polangles)
+    errorstate = 1 if np.any(ss_tot == 0) else 0
+    a0, a1, a2 = np.moveaxis(params, -1, 0)
+    alphas = np.asarray(alphas, dtype=float)
+    out = np.stack(
+        (find_az(a0, a1, a2), orfunc(alphas, a0, a1, a2), a2, ampl2(a0, a1), r2),
+        axis=-1,
+    )
+    mod = np.stack((r2, a0, a1, a2), axis=-1)
+    return out, mod, errorstate
 
 
 def unique_xys(images, map_x, map_y):
@@ -317,51 +285,6 @@ def unique_xys(images, map_x, map_y):
     return ulsxs, ulsys
 
 
-def start_compute(ulsxs, ulsys, names, shapes, dtypes, polangles, state):
-    # single core processing is faster for small data sets and small number of selected features
-    # if <data size> > x:
-    # ncpu = os.cpu_count()
-    # ncpu = 6
-    env_proc = os.getenv('QUASAR_N_PROCESSES')
-    ncpu = (
-        os.cpu_count()
-        if env_proc == "all"
-        else int(env_proc)
-        if env_proc
-        else min(2, os.cpu_count())
-    )
-    tulsys = np.array_split(ulsys, ncpu)
-    state.set_status("Calculating...")
-    threads = []
-    cumu = 0
-    for i in range(ncpu):
-        tlsxys = [ulsxs, tulsys[i]]
-        yidx = [cumu, cumu + len(tulsys[i])]
-        cumu += len(tulsys[i])
-        # compute(tlsxys, yidx, shapes, dtypes, polangles, i)
-        t = multiprocessing.Process(
-            target=compute, args=(tlsxys, yidx, names, shapes, dtypes, polangles)
-        )
-        threads.append(t)
-        t.start()
-
-    # for t in threads:
-    #     t.join()
-
-    # else:
-    # ncpu = 1
-    # tulsys = np.array_split(ulsys, ncpu)
-    # state.set_status("Calculating...")
-    # threads=[]
-    # cumu = 0
-    # for i in range(ncpu):
-    #     tlsxys = [ulsxs,tulsys[i]]
-    #     yidx = [cumu, cumu+len(tulsys[i])]
-    #     cumu += len(tulsys[i])
-    #     compute(tlsxys, yidx, shapes, dtypes, polangles, i)
-    return threads
-
-
 def process_polar_abs(
     images, alphas, feature, map_x, map_y, invert, polangles, average, state
 ):
@@ -384,22 +307,9 @@ def process_polar_abs(
     cvs = np.full(
         (np.shape(ulsys)[0], np.shape(ulsxs)[0], len(featnames), len(images)), np.nan
     )
-    spec = np.full(
-        (np.shape(ulsys)[0], np.shape(ulsxs)[0], images[0].X.shape[1], len(images)),
-        np.nan,
-        dtype=object,
-    )
-    metas = np.full(
-        (np.shape(ulsys)[0], np.shape(ulsxs)[0], images[0].metas.shape[1], len(images)),
-        np.nan,
-        dtype=object,
-    )
-    out = np.full((np.shape(ulsys)[0], np.shape(ulsxs)[0], len(featnames), 7), np.nan)
-    mod = np.full((np.shape(ulsys)[0], np.shape(ulsxs)[0], len(featnames), 6), np.nan)
-    coords = np.full((np.shape(ulsys)[0], np.shape(ulsxs)[0], 2), np.nan)
-    vars = np.hstack((np.asarray(alphas), 0))
-    fill = np.full((np.shape(ulsys)[0], np.shape(ulsxs)[0]), np.nan)
-
+    # row of each pixel in every image (-1 where missing); spectra and
+    # metas are taken from images only for the output pixels
+    rows = np.full((np.shape(ulsys)[0], np.shape(ulsxs)[0], len(images)), -1)
     for i, j in enumerate(images):
         if state.is_interruption_requested():
             return None, None, None, None, 2
@@ -411,127 +321,56 @@ def process_polar_abs(
         temp_xy[:, 1] = np.rint(((temp_xy[:, 1] - miny) / dy))
         temp_xy = np.array(temp_xy, dtype=np.int_)
         cvs[temp_xy[:, 1], temp_xy[:, 0], :, i] = tempdata[:, 2:]
-        spec[temp_xy[:, 1], temp_xy[:, 0], :, i] = j.X
-        metas[temp_xy[:, 1], temp_xy[:, 0], :, i] = j.metas
-    xys = pd.DataFrame(fill, index=ulsys, columns=ulsxs, dtype=object)
-    for k, i in enumerate(xys.index):
-        for l, j in enumerate(xys.columns):
-            coords[k, l, 0] = i
-            coords[k, l, 1] = j
+        rows[temp_xy[:, 1], temp_xy[:, 0], i] = np.arange(len(j))
 
     if state.is_interruption_requested():
         return None, None, None, None, 2
 
-    with SharedMemoryManager() as smm:
-        tcvs = smm.SharedMemory(size=cvs.nbytes)
-        scvs = np.ndarray(cvs.shape, dtype=cvs.dtype, buffer=tcvs.buf)
-        scvs[:, :, :] = cvs[:, :, :]
-        tout = smm.SharedMemory(size=out.nbytes)
-        sout = np.ndarray(out.shape, dtype=out.dtype, buffer=tout.buf)
-        sout[:, :, :, :] = out[:, :, :, :]
-        tmod = smm.SharedMemory(size=mod.nbytes)
-        smod = np.ndarray(mod.shape, dtype=mod.dtype, buffer=tmod.buf)
-        smod[:, :, :, :] = mod[:, :, :, :]
-        tcoords = smm.SharedMemory(size=coords.nbytes)
-        scoords = np.ndarray(coords.shape, dtype=coords.dtype, buffer=tcoords.buf)
-        scoords[:, :, :] = coords[:, :, :]
-        tvars = smm.SharedMemory(size=vars.nbytes)
-        svars = np.ndarray(vars.shape, dtype=vars.dtype, buffer=tvars.buf)
-        svars[:] = vars[:]
-
-        smms = [tcvs, None, None, tout, tmod, tcoords, tvars]
-        shapes = [
-            cvs.shape,
-            spec.shape,
-            metas.shape,
-            out.shape,
-            mod.shape,
-            coords.shape,
-            vars.shape,
-        ]
-        dtypes = [
-            cvs.dtype,
-            spec.dtype,
-            metas.dtype,
-            out.dtype,
-            mod.dtype,
-            coords.dtype,
-            vars.dtype,
-        ]
+    state.set_status("Calculating...")
+    out, mod, errorstate = compute(cvs, polangles, alphas)
 
-        if state.is_interruption_requested():
-            return None, None, None, None, 2
-        threads = start_compute(ulsxs, ulsys, smms, shapes, dtypes, polangles, state)
-
-        for t in threads:
-            t.join(0)
-
-        while any([i.exitcode is None for i in threads]):
-            if state.is_interruption_requested():
-                svars[1] = 2
-            time.sleep(0.10)
-
-        state.set_status("Finishing...")
-        if invert is True:
-            sout[:, :, :, 2] = sout[:, :, :, 2] * -1
-        outputs = np.reshape(
-            sout[:, :, :, 2:],
-            (np.shape(ulsys)[0] * np.shape(ulsxs)[0], 5 * len(featnames)),
-        )
-        model = np.reshape(
-            smod[:, :, :, 2:],
-            (np.shape(ulsys)[0] * np.shape(ulsxs)[0], 4 * len(featnames)),
-        )
-        vars[:] = svars[:]
+    state.set_status("Finishing...")
+    if invert is True:
+        out[:, :, :, 0] = out[:, :, :, 0] * -1
+    outputs = np.reshape(
+        out, (np.shape(ulsys)[0] * np.shape(ulsxs)[0], 5 * len(featnames))
+    )
+    model = np.reshape(
+        mod, (np.shape(ulsys)[0] * np.shape(ulsxs)[0], 4 * len(featnames))
+    )
+
+    rows = np.reshape(rows, (-1, len(images)))
+    valid = ~np.isnan(model).any(axis=1) & (rows >= 0).all(axis=1)
+    rows = rows[valid]
+    outputs = outputs[valid]
+    model = model[valid]
 
     if state.is_interruption_requested():
         return None, None, None, None, 2
 
-    spectra = []
-    met = []
     if average is False:
-        for i in range(len(polangles)):
-            spectratemp = np.reshape(
-                spec[:, :, :, i],
-                (np.shape(ulsys)[0] * np.shape(ulsxs)[0], images[0].X.shape[1]),
-            )
-            spectratemp = spectratemp[~np.isnan(model).any(axis=1)]
-            spectra.append(spectratemp)
-            metatemp = np.reshape(
-                metas[:, :, :, i],
-                (np.shape(ulsys)[0] * np.shape(ulsxs)[0], images[0].metas.shape[1]),
-            )
-            metatemp = metatemp[~np.isnan(model).any(axis=1)]
-            metatemp = np.append(
-                metatemp, np.full((np.shape(metatemp)[0], 1), i), axis=1
-            )
-            met.append(metatemp)
-
-            if state.is_interruption_requested():
-                return None, None, None, None, 2
-
-    elif average is True:
-        average_spec = np.average(spec, axis=3)
-        spectratemp = np.reshape(
-            average_spec,
-            (np.shape(ulsys)[0] * np.shape(ulsxs)[0], images[0].X.shape[1]),
+        spectra = np.concatenate(
+            [images[i].X[rows[:, i]] for i in range(len(polangles))], axis=0
         )
-        spectratemp = spectratemp[~np.isnan(model).any(axis=1)]
-        spectra.append(spectratemp)
-        metatemp = np.reshape(
-            metas[:, :, :, 0],
-            (np.shape(ulsys)[0] * np.shape(ulsxs)[0], images[0].metas.shape[1]),
+        meta = np.concatenate(
+            [
+                np.append(
+                    images[i].metas[rows[:, i]],
+                    np.full((len(rows), 1), i),
+                    axis=1,
+                )
+                for i in range(len(polangles))
+            ],
+            axis=0,
         )
-        metatemp = metatemp[~np.isnan(model).any(axis=1)]
-        met.append(metatemp)
-
-    outputs = outputs[~np.isnan(model).any(axis=1)]
-    model = model[~np.isnan(model).any(axis=1)]
-
-    spectra = np.concatenate((spectra), axis=0)
-    meta = np.concatenate((met), axis=0)
+    elif average is True:
+        spectra = np.zeros((len(rows), images[0].X.shape[1]))
+        for i, j in enumerate(images):
+            spectra += j.X[rows[:, i]]
+        spectra /= len(images)
+        meta = images[0].metas[rows[:, 0]]
 
-    return outputs, model, spectra, meta, vars[-1]
+    return outputs, model, spectra, meta, errorstate
 
 
 class OWPolar(OWWidget, ConcurrentWidgetMixin):
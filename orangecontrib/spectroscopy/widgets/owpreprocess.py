@@ -57,7 +57,13 @@ from AnyQt.QtGui import (
 )
 from AnyQt.QtCore import pyqtSignal as Signal, pyqtSlot as Slot, QObject
 
-from orangecontrib.spectroscopy.preprocess.utils import PreprocessException
+from orangecontrib.spectroscopy.preprocess.cache import result_cache
+from orangecontrib.spectroscopy.preprocess.utils import (
+    BLOCK_SIZE,
+    DeferredPreprocessing,
+    PreprocessException,
+    preprocessed_domain,
+)
 from orangecontrib.spectroscopy.widgets.owspectra import CurvePlot, NoSuchCurve
 from orangecontrib.spectroscopy.widgets.preprocessors.misc import (
     SavitzkyGolayFilteringEditor,
@@ -334,6 +340,14 @@ def create_preprocessor(item, reference):
     return create(params)
 
 
+def preprocessor_definition(item):
+    """Return what defines the preprocessor of an item (without reference)."""
+    params = item.data(ParametersRole)
+    params = dict(params) if isinstance(params, dict) else {}
+    params.pop(REFERENCE_DATA_PARAM, None)
+    return item.data(DescriptionRole).qualname, params
+
+
 class InterruptException(Exception):
     pass
 
@@ -1044,16 +1058,50 @@ class OWPreprocess(SpectralPreprocessReference):
 
         n = len(pp_def)
         plist = []
+        cache = result_cache() if data is not None and n else None
+        if cache is not None:
+            key = cache.key(
+                data,
+                reference,
+                process_reference,
+                [preprocessor_definition(item) for item in pp_def],
+            )
         for i in range(n):
-            progress_interrupt(i / n * 100)
+            progress_interrupt(i / n * 50)
             item = pp_def[i]
             pp = create_preprocessor(item, reference)
             plist.append(pp)
-            if data is not None:
-                data = pp(data)
-            progress_interrupt((i / n + 0.5 / n) * 100)
             if process_reference and reference is not None and i != n - 1:
                 reference = pp(reference)
+
+        cached = None
+        if cache is not None:
+            # stored results contain only values
+            domain = preprocessed_domain(plist, data.domain)
+            if domain is None:
+                cache = None
+            else:
+                cached = cache.get(key, data, domain)
+        if cached is not None:
+            data = cached
+        elif data is not None:
+            # tables are only built when needed, usually just the final one;
+            # they are built in blocks of rows to show progress and to allow
+            # interruption
+            deferred = DeferredPreprocessing(data, block_size=BLOCK_SIZE)
+            for i, pp in enumerate(plist):
+
+                def step_progress(part, i=i):
+                    progress_interrupt(50 + (i + part) / n * 25)
+
+                step_progress(0)
+                deferred.apply(pp, callback=step_progress)
+            processed = deferred.result(
+                callback=lambda part: progress_interrupt(75 + part * 25)
+            )
+            if cache is not None:
+                cache.put(key, processed, data)
+            data = processed
         # if there are no preprocessors, return None instead of an empty list
         preprocessor = preprocess.preprocess.PreprocessorList(plist) if plist else None
         return data, preprocessor